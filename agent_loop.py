@@ -0,0 +1,432 @@
+"""
+Агентский цикл ассистента как конечный автомат.
+
+Каждый ход диалога (AgentRun) проходит состояния
+queued → running → requires_action → tool_execution → submitted → ... → completed
+отдельными шагами. Шаг — одна асинхронная операция, поэтому цикл выполняется
+в event loop бота или веб-сервера, не блокируя его. Состояние сериализуется
+(snapshot/from_snapshot), и прерванный ход можно продолжить с того же шага.
+
+После выполнения функций результаты отправляются в тот же run
+(submit_tool_outputs), без нового пустого сообщения и нового run.
+"""
+import asyncio
+import functools
+import json
+import os
+import time
+
+import metrics
+from answer_cache import BOOKING_RE, context_free, get_answer_cache
+from assistant_client import NO_REPLY_TEXT, get_assistant_client, last_assistant_reply
+from executor import run_blocking
+from faq_router import get_faq_router
+
+QUEUED = "queued"
+RUNNING = "running"
+REQUIRES_ACTION = "requires_action"
+TOOL_EXECUTION = "tool_execution"
+SUBMITTED = "submitted"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL_STATES = (COMPLETED, FAILED)
+
+# Жёсткий бюджет на один ход: число раундов tool calls и общее время
+AGENT_MAX_ITERATIONS = int(os.getenv("AGENT_MAX_ITERATIONS", "5"))
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "120"))
+
+# Функции, доступные ассистенту: имя -> синхронная функция(**kwargs)
+TOOLS = {}
+# Функции, которым передаётся tool_call_id (ключ идемпотентности)
+TOOLS_WITH_CALL_ID = set()
+
+# Агрегированные метрики шагов: state -> {"count", "errors", "total", "max"}
+STEP_METRICS = {}
+
+
+def register_tool(name, func, pass_call_id=False):
+    """
+    Регистрирует функцию для OpenAI Function Calling.
+    pass_call_id=True — функция получает аргумент tool_call_id, чтобы повтор
+    того же вызова (например, после сбоя submit_tool_outputs) не выполнялся дважды.
+    """
+    TOOLS[name] = func
+    if pass_call_id:
+        TOOLS_WITH_CALL_ID.add(name)
+    else:
+        TOOLS_WITH_CALL_ID.discard(name)
+
+
+def get_step_metrics():
+    """
+    Копия агрегированных метрик по шагам автомата (время в секундах).
+    """
+    return {state: dict(values) for state, values in STEP_METRICS.items()}
+
+
+def _record_step(state, seconds, ok):
+    metric = STEP_METRICS.setdefault(state, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+    metric["count"] += 1
+    metric["total"] += seconds
+    metric["max"] = max(metric["max"], seconds)
+    if not ok:
+        metric["errors"] += 1
+
+
+async def _call_tool(call):
+    name = call.get("function", {}).get("name")
+    func = TOOLS.get(name)
+    if func is None:
+        return {"success": False, "error": f"Неизвестная функция: {name}"}
+    try:
+        args = json.loads(call["function"].get("arguments") or "{}")
+    except ValueError as ex:
+        return {"success": False, "error": f"Некорректные аргументы: {ex}"}
+    if name in TOOLS_WITH_CALL_ID:
+        args["tool_call_id"] = call.get("id")
+    try:
+        # Функции синхронные (Sheets, requests) — выполняем в пуле потоков.
+        # Аргументы функции не смешиваются с параметрами run_blocking (name, timeout)
+        with metrics.timed(f"tool.{name}"):
+            return await run_blocking(functools.partial(func, **args), name=f"tool:{name}")
+    except Exception as ex:
+        return {"success": False, "error": str(ex)}
+
+
+async def execute_tool_calls(tool_calls):
+    """
+    Выполняет функции, запрошенные ассистентом, и возвращает tool_outputs.
+    Ответ формируется для каждого tool call, иначе OpenAI не примет submit.
+    """
+    results = await asyncio.gather(*(_call_tool(call) for call in tool_calls))
+    return [
+        {"tool_call_id": call["id"], "output": json.dumps(result, ensure_ascii=False)}
+        for call, result in zip(tool_calls, results)
+    ]
+
+
+class AgentRun:
+    """
+    Один ход диалога с ассистентом. step() выполняет один переход,
+    drive() — все переходы до completed/failed в пределах бюджета.
+    """
+
+    def __init__(self, message, thread_id=None, client=None,
+                 max_iterations=AGENT_MAX_ITERATIONS, max_seconds=AGENT_MAX_SECONDS):
+        self.client = client or get_assistant_client()
+        self.message = message
+        self.thread_id = thread_id
+        self.run_id = None
+        self.state = QUEUED
+        self.tool_calls = []
+        self.tool_outputs = []
+        self.iterations = 0
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.elapsed = 0.0
+        self.history = None
+        self.error = None
+        self.steps = []
+
+    def snapshot(self):
+        """
+        Сериализуемое состояние хода для сохранения и последующего продолжения.
+        """
+        return {
+            "message": self.message,
+            "thread_id": self.thread_id,
+            "run_id": self.run_id,
+            "state": self.state,
+            "tool_calls": self.tool_calls,
+            "tool_outputs": self.tool_outputs,
+            "iterations": self.iterations,
+            "elapsed": self.elapsed,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data, client=None):
+        run = cls(data.get("message", ""), data.get("thread_id"), client=client)
+        run.run_id = data.get("run_id")
+        run.state = data.get("state", QUEUED)
+        run.tool_calls = data.get("tool_calls") or []
+        run.tool_outputs = data.get("tool_outputs") or []
+        run.iterations = data.get("iterations", 0)
+        run.elapsed = data.get("elapsed", 0.0)
+        run.error = data.get("error")
+        return run
+
+    @property
+    def done(self):
+        return self.state in TERMINAL_STATES
+
+    def _remaining(self):
+        return self.max_seconds - self.elapsed
+
+    async def _fail(self, error, cancel=True):
+        self.state = FAILED
+        self.error = error
+        # Брошенный run держит thread: следующее сообщение получило бы "run is active"
+        if cancel and self.run_id:
+            await self.client.cancel_run(self.thread_id, self.run_id)
+
+    async def step(self):
+        """
+        Выполняет один переход автомата и возвращает новое состояние.
+        """
+        if self.done:
+            return self.state
+        if self._remaining() <= 0:
+            await self._fail(f"Превышен лимит времени ответа ({self.max_seconds:.0f} c).")
+            return self.state
+        state = self.state
+        started = time.perf_counter()
+        ok = True
+        try:
+            await self._handlers[state](self)
+        except asyncio.TimeoutError:
+            ok = False
+            await self._fail("Ассистент не дал ответ вовремя.")
+        except Exception as ex:
+            ok = False
+            await self._fail(f"Ошибка на шаге {state}: {ex}")
+        seconds = time.perf_counter() - started
+        self.elapsed += seconds
+        self.steps.append((state, seconds))
+        _record_step(state, seconds, ok and self.state != FAILED)
+        return self.state
+
+    async def drive(self):
+        """
+        Прогоняет автомат до конечного состояния и возвращает результат хода.
+        """
+        metrics.add_gauge("runs_in_flight", 1)
+        try:
+            with metrics.span("agent.turn", thread_id=self.thread_id) as span:
+                while not self.done:
+                    await self.step()
+                span.attrs.update(state=self.state, iterations=self.iterations)
+        finally:
+            metrics.add_gauge("runs_in_flight", -1)
+        return self.result()
+
+    async def _on_queued(self):
+        if not self.client.configured:
+            await self._fail("OpenAI ключи не заданы.")
+            return
+        if not self.thread_id:
+            self.thread_id = await self.client.create_thread()
+        await self.client.add_message(self.thread_id, self.message)
+        self.run_id = await self.client.create_run(self.thread_id)
+        self.state = RUNNING
+
+    async def _on_running(self):
+        run = await self.client.wait_for_run(self.thread_id, self.run_id, timeout=self._remaining())
+        status = run.get("status")
+        if status == "requires_action":
+            self.tool_calls = run.get("required_action", {}).get("submit_tool_outputs", {}).get("tool_calls", [])
+            self.tool_outputs = []
+            self.state = REQUIRES_ACTION
+        elif status == "completed":
+            self.history = await self.client.fetch_history(self.thread_id)
+            self.state = COMPLETED
+        else:
+            error = (run.get("last_error") or {}).get("message") or status
+            await self._fail(f"Run завершился со статусом {error}", cancel=False)
+
+    async def _on_requires_action(self):
+        self.iterations += 1
+        if self.iterations > self.max_iterations:
+            await self._fail(f"Превышен лимит вызовов функций ({self.max_iterations}).")
+            return
+        self.state = TOOL_EXECUTION
+
+    async def _on_tool_execution(self):
+        # При продолжении после сбоя уже посчитанные результаты не пересчитываются
+        if not self.tool_outputs:
+            self.tool_outputs = await execute_tool_calls(self.tool_calls)
+        resp = await self.client.submit_tool_outputs(self.thread_id, self.run_id, self.tool_outputs)
+        if resp.get("status") == "error":
+            await self._fail(f"Ошибка отправки результатов функций: {resp.get('error')}")
+            return
+        self.state = SUBMITTED
+
+    async def _on_submitted(self):
+        # Тот же run продолжает работу с результатами функций
+        self.tool_calls = []
+        self.tool_outputs = []
+        self.state = RUNNING
+
+    _handlers = {
+        QUEUED: _on_queued,
+        RUNNING: _on_running,
+        REQUIRES_ACTION: _on_requires_action,
+        TOOL_EXECUTION: _on_tool_execution,
+        SUBMITTED: _on_submitted,
+    }
+
+    def result(self):
+        """
+        Результат в формате ask_openai_assistant.
+        """
+        if self.state == COMPLETED:
+            return {
+                "status": "completed",
+                "reply": last_assistant_reply(self.history or []),
+                "thread_id": self.thread_id,
+                "history": self.history or [],
+            }
+        if self.state == FAILED:
+            return {"status": "error", "error": self.error, "thread_id": self.thread_id}
+        return {"status": self.state, "run_id": self.run_id, "thread_id": self.thread_id}
+
+
+def _local_answer(message, thread_id=None):
+    """
+    Ответ без обращения к OpenAI: сначала база знаний (FAQ), затем кэш ответов.
+    Возвращает (reply, source) или (None, None).
+    """
+    # Сообщение с признаками записи должно дойти до save_booking_data
+    if not message or BOOKING_RE.search(message):
+        return None, None
+    # В начатом диалоге — только вопросы, понятные без его контекста
+    if thread_id and not context_free(message):
+        return None, None
+    router = get_faq_router()
+    reply = router.answer(message) if router is not None else None
+    if reply is not None:
+        metrics.inc("cache_hits_total", source="faq")
+        return reply, "faq"
+    cache = get_answer_cache()
+    reply = cache.get(message) if cache is not None else None
+    if reply is not None:
+        metrics.inc("cache_hits_total", source="cache")
+        return reply, "cache"
+    metrics.inc("cache_misses_total")
+    return None, None
+
+
+async def _append_to_thread(client, thread_id, message, reply):
+    """
+    Дописывает локальный ответ в начатый thread: следующие ходы ассистента видят его в контексте.
+    """
+    try:
+        await client.add_message(thread_id, message)
+        await client.add_message(thread_id, reply, role="assistant")
+    except Exception as ex:
+        print(f"[Agent] Не удалось дописать локальный ответ в thread {thread_id}: {ex}")
+
+
+def _cached_result(message, reply, thread_id, source="cache"):
+    return {
+        "status": "completed",
+        "reply": reply,
+        "thread_id": thread_id,
+        "history": [{"role": "user", "content": message}, {"role": "assistant", "content": reply}],
+        "cached": True,
+        "source": source,
+    }
+
+
+def _should_store(cache, thread_id, tools_used, reply):
+    # Кэшируем только ответы без контекста прошлых сообщений и без вызова функций
+    return cache is not None and not thread_id and not tools_used and reply and reply != NO_REPLY_TEXT
+
+
+async def run_turn(message, thread_id=None, client=None, max_seconds=AGENT_MAX_SECONDS):
+    """
+    Выполняет полный ход диалога через AgentRun; типовые вопросы — из базы знаний
+    или кэша ответов.
+    """
+    reply, source = _local_answer(message, thread_id)
+    if reply is not None:
+        if thread_id:
+            await _append_to_thread(client or get_assistant_client(), thread_id, message, reply)
+        return _cached_result(message, reply, thread_id, source)
+    cache = get_answer_cache()
+    run = AgentRun(message, thread_id, client=client, max_seconds=max_seconds)
+    result = await run.drive()
+    if result["status"] == "completed" and _should_store(cache, thread_id, run.iterations, result["reply"]):
+        cache.put(message, result["reply"])
+    return result
+
+
+async def _until(events, deadline):
+    """
+    События потока до deadline (время event loop), дальше — asyncio.TimeoutError.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            event = await asyncio.wait_for(events.__anext__(), max(0.0, deadline - loop.time()))
+        except StopAsyncIteration:
+            return
+        yield event
+
+
+async def stream_turn(message, thread_id=None, client=None,
+                      max_iterations=AGENT_MAX_ITERATIONS, max_seconds=AGENT_MAX_SECONDS):
+    """
+    Потоковый ход диалога: отдаёт события ассистента (thread/delta/completed/error)
+    и сам выполняет tool calls, продолжая тот же run через submit_tool_outputs.
+    Бюджет тот же, что у run_turn; при его исчерпании run отменяется.
+    """
+    client = client or get_assistant_client()
+    reply, source = _local_answer(message, thread_id)
+    if reply is not None:
+        if thread_id:
+            await _append_to_thread(client, thread_id, message, reply)
+        yield {"type": "delta", "text": reply}
+        yield {"type": "completed", "reply": reply, "thread_id": thread_id, "cached": True, "source": source}
+        return
+    cache = get_answer_cache()
+    deadline = asyncio.get_running_loop().time() + max_seconds
+    events = client.ask_stream(message, thread_id)
+    iterations = 0
+    current_thread, run_id = thread_id, None
+    failure = None
+    # run дошёл до конечного состояния (или уже отменён) — отменять при закрытии не нужно
+    settled = False
+    metrics.add_gauge("runs_in_flight", 1)
+    try:
+        while events is not None:
+            next_events = None
+            try:
+                async for event in _until(events, deadline):
+                    current_thread = event.get("thread_id") or current_thread
+                    if event["type"] == "run":
+                        run_id = event["run_id"]
+                        continue
+                    if event["type"] == "requires_action":
+                        run_id = event["run_id"]
+                        iterations += 1
+                        if iterations > max_iterations:
+                            failure = f"Превышен лимит вызовов функций ({max_iterations})."
+                            break
+                        started = time.perf_counter()
+                        remaining = max(0.0, deadline - asyncio.get_running_loop().time())
+                        tool_outputs = await asyncio.wait_for(execute_tool_calls(event["tool_calls"]), remaining)
+                        _record_step(TOOL_EXECUTION, time.perf_counter() - started, True)
+                        next_events = client.stream_tool_outputs(event["thread_id"], event["run_id"], tool_outputs)
+                        break
+                    if event["type"] in ("completed", "error"):
+                        settled = True
+                    if event["type"] == "completed" and _should_store(cache, thread_id, iterations, event["reply"]):
+                        cache.put(message, event["reply"])
+                    yield event
+            except asyncio.TimeoutError:
+                failure = f"Превышен лимит времени ответа ({max_seconds:.0f} c)."
+            finally:
+                await events.aclose()
+            events = next_events
+        if failure:
+            settled = True
+            if run_id:
+                await client.cancel_run(current_thread, run_id)
+            yield {"type": "error", "error": failure, "thread_id": current_thread}
+    finally:
+        # Потребитель бросил поток (закрыл SSE, отменили правку сообщения в Telegram):
+        # run иначе продолжит работать и занимать thread
+        if run_id and not settled:
+            await client.cancel_run(current_thread, run_id)
+        metrics.add_gauge("runs_in_flight", -1)
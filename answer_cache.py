@@ -0,0 +1,237 @@
+"""
+Кэш ответов ассистента на типовые вопросы (цены, часы работы, адрес, мастера).
+
+Поиск идёт по точному тексту, затем по нормализованному (регистр, ё/е,
+пунктуация, вежливые слова) и, если включено, по близости векторов
+символьных триграмм (локально, без внешних моделей). Записи живут TTL,
+объём ограничен (LRU). Кэш сбрасывается при изменении Knowledge.txt или
+Prompt.txt и не используется для сообщений, похожих на запись на услугу:
+такие ходы могут вызвать save_booking_data. В начатом диалоге из кэша
+отвечают только на вопросы без отсылок к прошлым сообщениям (context_free).
+
+У каждого салона (tenants) свой кэш по файлам его папки базы знаний.
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import tenants
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+# Порог косинусной близости триграмм; 0 — поиск по близости выключен
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))
+# Как часто проверять, не изменились ли файлы инструкций
+SOURCE_CHECK_INTERVAL = 5.0
+MIN_WORDS = 2
+
+INSTRUCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_instructions")
+SOURCE_FILES = (
+    os.path.join(INSTRUCTIONS_DIR, "Knowledge.txt"),
+    os.path.join(INSTRUCTIONS_DIR, "Prompt.txt"),
+)
+
+# Слова, не меняющие смысл вопроса
+FILLER_WORDS = frozenset(
+    "а и ну же ли бы пожалуйста подскажите скажите здравствуйте добрый день вечер утро "
+    "привет хочу узнать можно вас у в".split()
+)
+# Признаки записи: такие сообщения идут только к ассистенту
+BOOKING_RE = re.compile(
+    r"запиш|записат|запись|забронир|бронь|оформ|\+?\d[\d\s\-()]{8,}\d|\d{1,2}[.:/]\d{2}",
+    re.IGNORECASE,
+)
+# Отсылки к прошлым сообщениям («это», «у неё», «тогда»): в начатом диалоге такой
+# вопрос понятен только ассистенту, который видит весь thread
+CONTEXT_RE = re.compile(
+    r"\b(?:это|этот|эта|эту|этого|этой|этим|тот|та|ту|того|той|тем|он|она|оно|они|его|её|ее|их|"
+    r"ему|ей|им|него|неё|нее|них|нему|ней|ним|там|тогда|туда|тоже|такой|такая|такое|такие|"
+    r"другой|другая|другое|другую|вместо)\b|перенес|перенёс|отмен",
+    re.IGNORECASE,
+)
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize(text):
+    """
+    Нормализованная форма вопроса для сравнения.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT_RE.sub(" ", text)
+    words = [word for word in _SPACE_RE.split(text) if word and word not in FILLER_WORDS]
+    return " ".join(words)
+
+
+def trigram_vector(text):
+    """
+    Разреженный вектор символьных триграмм, нормированный по длине.
+    """
+    counts = {}
+    for word in text.split():
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            gram = padded[i:i + 3]
+            counts[gram] = counts.get(gram, 0) + 1
+    norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+    return {gram: value / norm for gram, value in counts.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(gram, 0.0) for gram, value in a.items())
+
+
+def cacheable(message):
+    """
+    Можно ли отвечать на сообщение из кэша (и класть ответ в кэш).
+    """
+    if not message or BOOKING_RE.search(message):
+        return False
+    return len(normalize(message).split()) >= MIN_WORDS
+
+
+def context_free(message):
+    """
+    Понятно ли сообщение без предыдущих сообщений диалога: без отсылок
+    к ним и не обрывок вроде «а маникюр?».
+    """
+    if not message or CONTEXT_RE.search(message):
+        return False
+    return len(normalize(message).split()) >= MIN_WORDS
+
+
+class AnswerCache:
+    """
+    LRU-кэш ответов с TTL и сбросом при изменении файлов инструкций.
+    """
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 similarity=ANSWER_CACHE_SIMILARITY, sources=SOURCE_FILES):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.sources = sources
+        self._entries = OrderedDict()  # normalized -> (reply, expires, vector)
+        self._exact = {}  # исходный текст -> normalized
+        self._lock = threading.Lock()
+        self._fingerprint = self._source_fingerprint()
+        self._checked_at = time.monotonic()
+        self.stats = {
+            "hits_exact": 0, "hits_normalized": 0, "hits_similar": 0,
+            "misses": 0, "skipped": 0, "stores": 0, "invalidations": 0,
+        }
+
+    def _source_fingerprint(self):
+        result = []
+        for path in self.sources:
+            try:
+                st = os.stat(path)
+                result.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                result.append(None)
+        return tuple(result)
+
+    def _check_sources(self):
+        now = time.monotonic()
+        if now - self._checked_at < SOURCE_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        fingerprint = self._source_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.clear()
+            self.stats["invalidations"] += 1
+            print("[AnswerCache] Инструкции ассистента изменились — кэш очищен")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+
+    def hit_rate(self):
+        hits = self.stats["hits_exact"] + self.stats["hits_normalized"] + self.stats["hits_similar"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def get(self, message):
+        """
+        Ответ из кэша или None.
+        """
+        if not cacheable(message):
+            self.stats["skipped"] += 1
+            return None
+        self._check_sources()
+        now = time.time()
+        with self._lock:
+            key = self._exact.get(message)
+            kind = "hits_exact"
+            if key is None:
+                key = normalize(message)
+                kind = "hits_normalized"
+            entry = self._entries.get(key)
+            if entry is None and self.similarity > 0:
+                key, entry = self._most_similar(key, now)
+                kind = "hits_similar"
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    self._drop(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats[kind] += 1
+            return entry[0]
+
+    def _most_similar(self, key, now):
+        vector = trigram_vector(key)
+        best_key, best_entry, best_score = None, None, self.similarity
+        for other_key, entry in self._entries.items():
+            if entry[1] <= now:
+                continue
+            score = cosine(vector, entry[2])
+            if score >= best_score:
+                best_key, best_entry, best_score = other_key, entry, score
+        return best_key, best_entry
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        for text in [text for text, normalized in self._exact.items() if normalized == key]:
+            del self._exact[text]
+
+    def put(self, message, reply):
+        if not reply or not cacheable(message):
+            return
+        key = normalize(message)
+        vector = trigram_vector(key) if self.similarity > 0 else None
+        with self._lock:
+            self._entries[key] = (reply, time.time() + self.ttl, vector)
+            self._entries.move_to_end(key)
+            self._exact[message] = key
+            while len(self._entries) > self.max_size:
+                old_key, _ = self._entries.popitem(last=False)
+                self._drop(old_key)
+            self.stats["stores"] += 1
+
+
+_caches = tenants.PerTenant(lambda tenant: AnswerCache(sources=(tenant.knowledge_path, tenant.prompt_path)))
+
+
+def get_answer_cache(tenant=None):
+    """
+    Кэш ответов салона (по умолчанию текущего); None, если выключен через ANSWER_CACHE_ENABLED=0.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return _caches.get(tenant)
+
+
+def all_answer_caches():
+    """
+    Уже созданные кэши ответов: [(ключ салона, AnswerCache)].
+    """
+    return _caches.items()
@@ -0,0 +1,435 @@
+"""
+Асинхронный клиент OpenAI Assistants API (threads / messages / runs).
+
+Тот же контракт, что и у functions.ask_openai_assistant: создать thread,
+добавить сообщение, запустить run, дождаться статуса и забрать историю.
+Все запросы идут через общий пул соединений httpx, а статус run опрашивается
+с адаптивной задержкой, поэтому ожидание ответа не блокирует event loop.
+У каждого салона (tenants) свой ассистент, а пул соединений общий.
+"""
+import asyncio
+import json
+import os
+import time
+import weakref
+
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+import tenants
+from history_cache import HISTORY_WINDOW, get_history_cache
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+# Адаптивный polling: начинаем часто, затем растягиваем интервал до максимума
+POLL_INITIAL_DELAY = float(os.getenv("OPENAI_POLL_INITIAL_DELAY", "0.25"))
+POLL_MAX_DELAY = float(os.getenv("OPENAI_POLL_MAX_DELAY", "2.0"))
+POLL_BACKOFF = 1.5
+RUN_TIMEOUT = float(os.getenv("OPENAI_RUN_TIMEOUT", "120"))
+POLL_MAX_ERRORS = 3
+
+HTTP_TIMEOUT = 20
+HTTP_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = 20
+
+HISTORY_LIMIT = HISTORY_WINDOW
+# Размер страницы при дозагрузке истории после курсора (максимум API — 100)
+HISTORY_PAGE_SIZE = 100
+NO_REPLY_TEXT = "(Нет ответа ассистента)"
+
+# Статусы, после которых polling прекращается
+STOP_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete", "requires_action")
+
+
+def parse_history(items):
+    """
+    Превращает список сообщений thread (по возрастанию времени) в [{"id", "role", "content"}].
+    """
+    history = []
+    for item in items:
+        role = item.get("role", "user")
+        content = ""
+        try:
+            content = item["content"][0]["text"]["value"]
+        except Exception:
+            content = str(item["content"][0]) if item.get("content") else ""
+        history.append({"id": item.get("id"), "role": role, "content": content})
+    return history
+
+
+def last_assistant_reply(history):
+    """
+    Возвращает текст последнего непустого ответа ассистента из истории.
+    """
+    for msg in reversed(history):
+        if msg["role"] == "assistant" and msg["content"]:
+            return msg["content"]
+    return NO_REPLY_TEXT
+
+
+class AssistantClient:
+    """
+    Асинхронный клиент Assistants API с общим пулом соединений.
+
+    На каждый event loop создаётся один httpx.AsyncClient на пару (адрес API, ключ):
+    в боте и в веб-API это один и тот же loop, поэтому keep-alive соединения
+    переиспользуются всеми диалогами процесса, в том числе клиентами разных
+    ассистентов (салонов).
+    """
+
+    # event loop -> {(base_url, api_key): httpx.AsyncClient}, общий для всех экземпляров
+    _pools = weakref.WeakKeyDictionary()
+
+    def __init__(self, api_key=None, assistant_id=None, base_url=None):
+        self.api_key = api_key or OPENAI_API_KEY
+        self.assistant_id = assistant_id or OPENAI_ASSISTANT_ID
+        self.base_url = (base_url or OPENAI_API_BASE).rstrip("/")
+
+    @property
+    def configured(self):
+        return bool(self.api_key and self.assistant_id)
+
+    def _http(self):
+        clients = self._pools.setdefault(asyncio.get_running_loop(), {})
+        pool_key = (self.base_url, self.api_key)
+        client = clients.get(pool_key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                    "OpenAI-Beta": "assistants=v2",
+                },
+                timeout=HTTP_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                ),
+            )
+            clients[pool_key] = client
+        return client
+
+    async def aclose(self):
+        """
+        Закрывает пул соединений текущего event loop (общий с другими клиентами того же API).
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        client = self._pools.get(loop, {}).pop((self.base_url, self.api_key), None)
+        if client is not None:
+            await client.aclose()
+
+    async def _request(self, method, path, payload=None, params=None):
+        resp = await self._http().request(method, path, json=payload, params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+    async def create_thread(self):
+        with metrics.timed("openai.thread_create"):
+            data = await self._request("POST", "/threads", {})
+        return data["id"]
+
+    async def add_message(self, thread_id, content, role="user"):
+        with metrics.timed("openai.message_post"):
+            return await self._request(
+                "POST", f"/threads/{thread_id}/messages", {"role": role, "content": content}
+            )
+
+    async def create_run(self, thread_id):
+        with metrics.timed("openai.run_create"):
+            data = await self._request("POST", f"/threads/{thread_id}/runs", {"assistant_id": self.assistant_id})
+        return data["id"]
+
+    async def get_run(self, thread_id, run_id):
+        return await self._request("GET", f"/threads/{thread_id}/runs/{run_id}")
+
+    async def cancel_run(self, thread_id, run_id):
+        """
+        Отменяет run, брошенный по бюджету или ошибке: иначе thread остаётся
+        занятым ("run is active") для следующего сообщения. True, если отмена принята.
+        """
+        try:
+            with metrics.timed("openai.run_cancel", run_id=run_id):
+                await self._request("POST", f"/threads/{thread_id}/runs/{run_id}/cancel")
+            return True
+        except Exception as ex:
+            print(f"[OpenAI] Не удалось отменить run {run_id}: {ex}")
+            return False
+
+    async def wait_for_run(self, thread_id, run_id, timeout=RUN_TIMEOUT):
+        """
+        Ждёт, пока run перейдёт в один из STOP_STATUSES.
+        Интервал опроса растёт от POLL_INITIAL_DELAY до POLL_MAX_DELAY;
+        единичные сетевые сбои не прерывают ожидание.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = POLL_INITIAL_DELAY
+        errors = 0
+        polls = 0
+        with metrics.timed("openai.run_wait", run_id=run_id) as span:
+            try:
+                while True:
+                    polls += 1
+                    try:
+                        run = await self.get_run(thread_id, run_id)
+                        errors = 0
+                        if run.get("status") in STOP_STATUSES:
+                            span.attrs["status"] = run.get("status")
+                            return run
+                    except httpx.HTTPError:
+                        errors += 1
+                        metrics.inc("retries_total", component="openai_poll")
+                        if errors >= POLL_MAX_ERRORS:
+                            raise
+                    if loop.time() + delay > deadline:
+                        raise asyncio.TimeoutError(f"run {run_id} не завершился за {timeout} c")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+            finally:
+                span.attrs["polls"] = polls
+                metrics.observe("run_polls", polls)
+
+    async def _fetch_latest(self, thread_id, limit):
+        with metrics.timed("openai.history", mode="full"):
+            data = await self._request(
+                "GET", f"/threads/{thread_id}/messages", params={"order": "desc", "limit": limit}
+            )
+        return parse_history(reversed(data.get("data", [])))
+
+    async def _fetch_after(self, thread_id, cursor, max_messages):
+        """
+        Сообщения после cursor по страницам или None, если их больше max_messages.
+        """
+        messages = []
+        with metrics.timed("openai.history", mode="delta") as span:
+            while True:
+                data = await self._request(
+                    "GET", f"/threads/{thread_id}/messages",
+                    params={"order": "asc", "after": cursor, "limit": HISTORY_PAGE_SIZE},
+                )
+                page = parse_history(data.get("data", []))
+                messages.extend(page)
+                span.attrs["messages"] = len(messages)
+                if not page or not data.get("has_more"):
+                    return messages
+                if len(messages) >= max_messages:
+                    return None
+                cursor = page[-1]["id"]
+
+    async def fetch_history(self, thread_id, limit=HISTORY_LIMIT):
+        """
+        Последние limit сообщений thread. Если thread уже есть в кэше истории,
+        загружаются только сообщения после последнего известного (курсор after).
+        """
+        cache = get_history_cache()
+        if cache is None:
+            return await self._fetch_latest(thread_id, limit)
+        cursor = cache.cursor(thread_id)
+        if cursor is not None:
+            messages = await self._fetch_after(thread_id, cursor, cache.max_messages)
+            if messages is not None:
+                cache.add(thread_id, messages)
+                return cache.window(thread_id, limit)
+        # Thread ещё не в кэше или новых сообщений больше, чем помещается в буфер
+        latest = await self._fetch_latest(thread_id, limit if cursor is None else cache.max_messages)
+        cache.add(thread_id, latest, full=True)
+        return cache.window(thread_id, limit)
+
+    async def submit_tool_outputs(self, thread_id, run_id, tool_outputs):
+        """
+        Отправляет результаты выполнения функций обратно в OpenAI.
+        tool_outputs — список словарей с ключами: "tool_call_id", "output"
+        """
+        if not self.api_key:
+            return {"status": "error", "error": "OpenAI ключ не задан."}
+        try:
+            with metrics.timed("openai.submit_tool_outputs"):
+                return await self._request(
+                    "POST",
+                    f"/threads/{thread_id}/runs/{run_id}/submit_tool_outputs",
+                    {"tool_outputs": tool_outputs},
+                )
+        except Exception as e:
+            return {"status": "error", "error": str(e)}
+
+    async def _stream_events(self, path, payload):
+        """
+        Выполняет POST с stream=true и отдаёт события SSE как (event, data).
+        """
+        # Span через yield держать нельзя — этап записывается по завершении потока
+        started = time.perf_counter()
+        error = None
+        try:
+            async with self._http().stream("POST", path, json=dict(payload, stream=True)) as resp:
+                resp.raise_for_status()
+                event, data_lines = None, []
+                async for line in resp.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:"):
+                        data_lines.append(line[5:].strip())
+                    elif not line and data_lines:
+                        raw = "\n".join(data_lines)
+                        event, data_lines = event or "message", []
+                        if raw == "[DONE]":
+                            return
+                        yield event, json.loads(raw)
+                        event = None
+        except Exception as ex:
+            error = f"{type(ex).__name__}: {ex}"
+            raise
+        finally:
+            metrics.record("openai.run_stream", time.perf_counter() - started, error)
+
+    async def _translate_run_stream(self, thread_id, events):
+        """
+        Переводит события run stream в упрощённые события для бота и виджета:
+        run / delta / requires_action / completed / error.
+        """
+        parts = []
+        run_id = None
+        async for event, data in events:
+            if event == "thread.run.created":
+                run_id = data.get("id")
+                yield {"type": "run", "run_id": run_id, "thread_id": thread_id}
+            elif event == "thread.message.delta":
+                for block in data.get("delta", {}).get("content", []):
+                    text = block.get("text", {}).get("value")
+                    if text:
+                        parts.append(text)
+                        yield {"type": "delta", "text": text}
+            elif event == "thread.run.requires_action":
+                tool_calls = data.get("required_action", {}).get("submit_tool_outputs", {}).get("tool_calls", [])
+                yield {
+                    "type": "requires_action",
+                    "tool_calls": tool_calls,
+                    "run_id": data.get("id", run_id),
+                    "thread_id": thread_id,
+                }
+                return
+            elif event == "thread.run.completed":
+                yield {"type": "completed", "reply": "".join(parts) or NO_REPLY_TEXT, "thread_id": thread_id}
+                return
+            elif event in ("thread.run.failed", "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete"):
+                error = (data.get("last_error") or {}).get("message") or event.rsplit(".", 1)[-1]
+                yield {"type": "error", "error": f"Run завершился с ошибкой: {error}", "thread_id": thread_id}
+                return
+            elif event == "error":
+                yield {"type": "error", "error": str(data.get("message") or data), "thread_id": thread_id}
+                return
+        yield {"type": "error", "error": "Поток ответа ассистента оборвался.", "thread_id": thread_id}
+
+    async def ask_stream(self, message, thread_id=None):
+        """
+        Потоковый вариант ask: async-генератор событий
+        {"type": "thread"}, {"type": "run", "run_id"}, {"type": "delta", "text"}, {"type": "requires_action", ...},
+        {"type": "completed", "reply"} или {"type": "error", "error"}.
+        """
+        if not self.configured:
+            yield {"type": "error", "error": "OpenAI ключи не заданы."}
+            return
+        try:
+            if not thread_id:
+                thread_id = await self.create_thread()
+        except Exception as ex:
+            yield {"type": "error", "error": f"Ошибка создания thread: {ex}"}
+            return
+        yield {"type": "thread", "thread_id": thread_id}
+        try:
+            await self.add_message(thread_id, message)
+        except Exception as ex:
+            yield {"type": "error", "error": f"Ошибка отправки сообщения: {ex}", "thread_id": thread_id}
+            return
+        events = self._stream_events(f"/threads/{thread_id}/runs", {"assistant_id": self.assistant_id})
+        try:
+            async for item in self._translate_run_stream(thread_id, events):
+                yield item
+        except Exception as ex:
+            yield {"type": "error", "error": f"Ошибка потока run: {ex}", "thread_id": thread_id}
+
+    async def stream_tool_outputs(self, thread_id, run_id, tool_outputs):
+        """
+        Отправляет результаты функций и продолжает тот же run в потоковом режиме.
+        """
+        events = self._stream_events(
+            f"/threads/{thread_id}/runs/{run_id}/submit_tool_outputs",
+            {"tool_outputs": tool_outputs},
+        )
+        try:
+            async for item in self._translate_run_stream(thread_id, events):
+                yield item
+        except Exception as ex:
+            yield {"type": "error", "error": f"Ошибка потока run: {ex}", "thread_id": thread_id}
+
+    async def ask(self, message, thread_id=None):
+        """
+        Асинхронный аналог functions.ask_openai_assistant с тем же форматом ответа:
+        {"status": "completed", "reply", "thread_id", "history"},
+        {"status": "requires_action", "tool_calls", "run_id", "thread_id"}
+        или {"status": "error", "error"}.
+        """
+        if not self.configured:
+            return {"status": "error", "error": "OpenAI ключи не заданы."}
+        # 1. Получить или создать thread
+        try:
+            if not thread_id:
+                thread_id = await self.create_thread()
+        except Exception as ex:
+            return {"status": "error", "error": f"Ошибка создания thread: {ex}"}
+        # 2. Отправить сообщение в thread
+        try:
+            await self.add_message(thread_id, message)
+        except Exception as ex:
+            return {"status": "error", "error": f"Ошибка отправки сообщения: {ex}"}
+        # 3. Запустить ассистента (run) для thread
+        try:
+            run_id = await self.create_run(thread_id)
+        except Exception as ex:
+            return {"status": "error", "error": f"Ошибка запуска run: {ex}"}
+        # 4. Дождаться статуса
+        try:
+            run = await self.wait_for_run(thread_id, run_id)
+        except asyncio.TimeoutError as ex:
+            return {"status": "error", "error": f"Ассистент не дал ответ: {ex}"}
+        except Exception as ex:
+            return {"status": "error", "error": f"Ошибка polling run: {ex}"}
+        status = run.get("status", "")
+        if status == "requires_action":
+            tool_calls = run.get("required_action", {}).get("submit_tool_outputs", {}).get("tool_calls", [])
+            return {
+                "status": "requires_action",
+                "tool_calls": tool_calls,
+                "run_id": run_id,
+                "thread_id": thread_id,
+            }
+        if status == "completed":
+            try:
+                history = await self.fetch_history(thread_id)
+            except Exception as ex:
+                return {"status": "error", "error": f"Ошибка получения истории: {ex}"}
+            return {
+                "status": "completed",
+                "reply": last_assistant_reply(history),
+                "thread_id": thread_id,
+                "history": history,
+            }
+        return {"status": status, "run_id": run_id, "thread_id": thread_id}
+
+
+_clients = tenants.PerTenant(lambda tenant: AssistantClient(assistant_id=tenant.assistant_id))
+
+
+def get_assistant_client(tenant=None):
+    """
+    AssistantClient ассистента салона (по умолчанию текущего); пул соединений общий.
+    """
+    return _clients.get(tenant)
@@ -0,0 +1,294 @@
+"""
+Свободные слоты и проверка пересечений записей.
+
+Для каждого мастера, категории мастеров и салона целиком в памяти хранится
+отсортированный список интервалов записей. Запись к мастеру учитывается
+у мастера, в его категории и в салоне; запись на категорию — в категории и
+в салоне; запись к любому мастеру — только в салоне. Время свободно, если ни
+в одной из этих групп не заняты все места (у мастера одно, у категории —
+по числу её мастеров, у салона — по числу всех мастеров). Проверка
+пересечения — двоичный поиск по началу интервала: кандидаты только те, что
+начинаются не раньше, чем (начало - самая длинная услуга в группе).
+Индекс строится из строк таблицы заявок (плюс ещё не записанные строки
+очереди) в фоновом потоке и дополняется при каждой новой заявке, поэтому
+запросы не перечитывают таблицу.
+
+Несколько воркеров видят заявки друг друга только после очередного обновления
+из таблицы (AVAILABILITY_REFRESH_INTERVAL).
+"""
+import bisect
+import os
+import threading
+from datetime import datetime, timedelta
+
+AVAILABILITY_ENABLED = os.getenv("AVAILABILITY_ENABLED", "1") == "1"
+AVAILABILITY_RANGE = os.getenv("AVAILABILITY_RANGE", "A2:H")
+AVAILABILITY_REFRESH_INTERVAL = float(os.getenv("AVAILABILITY_REFRESH_INTERVAL", "300"))
+# Часы и дни работы салона (0 — понедельник)
+SALON_OPEN = os.getenv("SALON_OPEN", "10:00")
+SALON_CLOSE = os.getenv("SALON_CLOSE", "20:00")
+SALON_WORKDAYS = frozenset(int(day) for day in os.getenv("SALON_WORKDAYS", "0,1,2,3,4,5").split(",") if day.strip())
+SLOT_STEP_MINUTES = int(os.getenv("SLOT_STEP_MINUTES", "30"))
+SLOT_HORIZON_DAYS = int(os.getenv("SLOT_HORIZON_DAYS", "14"))
+DEFAULT_DURATION = 60
+
+DATE_FORMAT = "%d.%m.%Y %H:%M"
+# Колонки строки заявки (см. functions.build_booking_row)
+SERVICE_COLUMN = 2
+DATE_COLUMN = 3
+MASTER_COLUMN = 4
+
+_EPOCH = datetime(2000, 1, 1)
+
+
+def _minutes(moment):
+    return int((moment - _EPOCH).total_seconds() // 60)
+
+
+def _moment(minutes):
+    return _EPOCH + timedelta(minutes=minutes)
+
+
+def _clock(value):
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_datetime(value):
+    try:
+        return datetime.strptime(str(value).strip(), DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def master_key(master):
+    return (master or "").strip().lower()
+
+
+class _Schedule:
+    """
+    Интервалы [start, end) одной группы в минутах, отсортированные по началу.
+    """
+    __slots__ = ("starts", "ends", "max_length")
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.max_length = 0
+
+    def add(self, start, end):
+        index = bisect.bisect_right(self.starts, start)
+        self.starts.insert(index, start)
+        self.ends.insert(index, end)
+        self.max_length = max(self.max_length, end - start)
+
+    def remove(self, start, end):
+        index = bisect.bisect_left(self.starts, start)
+        while index < len(self.starts) and self.starts[index] == start:
+            if self.ends[index] == end:
+                del self.starts[index]
+                del self.ends[index]
+                return True
+            index += 1
+        return False
+
+    def overlapping(self, start, end):
+        lo = bisect.bisect_right(self.starts, start - self.max_length)
+        hi = bisect.bisect_left(self.starts, end)
+        return [(self.starts[i], self.ends[i]) for i in range(lo, hi) if self.ends[i] > start]
+
+    def busy(self, start, end, capacity=1):
+        """
+        True, если в [start, end) одновременно заняты все capacity мест.
+        """
+        found = self.overlapping(start, end)
+        if len(found) < capacity:
+            return False
+        if capacity == 1:
+            return True
+        events = sorted([(max(s, start), 1) for s, _ in found] + [(min(e, end), -1) for _, e in found])
+        current = 0
+        for _, delta in events:
+            current += delta
+            if current >= capacity:
+                return True
+        return False
+
+
+class AvailabilityIndex:
+    """
+    Индекс занятости мастеров.
+
+    rows_source() — строки заявок (как в таблице), duration_of(service) —
+    длительность услуги в минутах, groups_of(master) — группы, места в которых
+    занимает запись к мастеру/категории: [(ключ группы, сколько записей на
+    одно время допускает группа)].
+    """
+
+    def __init__(self, rows_source, duration_of=None, groups_of=None,
+                 refresh_interval=AVAILABILITY_REFRESH_INTERVAL,
+                 open_time=SALON_OPEN, close_time=SALON_CLOSE, workdays=SALON_WORKDAYS,
+                 step=SLOT_STEP_MINUTES):
+        self.rows_source = rows_source
+        self.duration_of = duration_of or (lambda service: DEFAULT_DURATION)
+        self.groups_of = groups_of or (lambda master: [(master_key(master), 1)])
+        self.refresh_interval = refresh_interval
+        self.open_minute = _clock(open_time)
+        self.close_minute = _clock(close_time)
+        self.workdays = workdays
+        self.step = step
+        self._schedules = {}
+        self._lock = threading.Lock()
+        # Брони, сделанные во время перестроения индекса: переносятся в новый индекс
+        self._recent = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.loaded = False
+        self.stats = {"rebuilds": 0, "errors": 0, "reserved": 0, "conflicts": 0}
+
+    # --- Построение ---
+
+    def _interval(self, service, moment):
+        start = _minutes(moment)
+        duration = self.duration_of(service) or DEFAULT_DURATION
+        return start, start + int(duration)
+
+    def rebuild(self):
+        """
+        Перестраивает индекс из строк таблицы. Возвращает число учтённых записей.
+        """
+        with self._lock:
+            self._recent = []
+        try:
+            rows = self.rows_source()
+        except Exception as ex:
+            self.stats["errors"] += 1
+            with self._lock:
+                self._recent = None
+            print(f"[Availability] Ошибка загрузки записей: {ex}")
+            return None
+        schedules = {}
+        count = 0
+        for row in rows:
+            moment = parse_datetime(row[DATE_COLUMN]) if len(row) > DATE_COLUMN else None
+            if moment is None:
+                continue
+            service = row[SERVICE_COLUMN] if len(row) > SERVICE_COLUMN else ""
+            master = row[MASTER_COLUMN] if len(row) > MASTER_COLUMN else ""
+            start, end = self._interval(service, moment)
+            for key, _ in self.groups_of(master):
+                schedules.setdefault(key, _Schedule()).add(start, end)
+            count += 1
+        with self._lock:
+            for keys, start, end in self._recent:
+                # Бронь уже есть в строках, если она нашлась в самой узкой своей группе
+                first = schedules.get(keys[0]) if keys else None
+                if first is not None and (start, end) in first.overlapping(start, end):
+                    continue
+                for key in keys:
+                    schedules.setdefault(key, _Schedule()).add(start, end)
+            self._recent = None
+            self._schedules = schedules
+            self.loaded = True
+        self.stats["rebuilds"] += 1
+        return count
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="availability-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        self.rebuild()
+        while not self._stop.wait(self.refresh_interval):
+            self.rebuild()
+
+    # --- Запросы ---
+
+    def within_hours(self, moment, service=None):
+        if moment.weekday() not in self.workdays:
+            return False
+        start = moment.hour * 60 + moment.minute
+        duration = self.duration_of(service) or DEFAULT_DURATION
+        return start >= self.open_minute and start + duration <= self.close_minute
+
+    def _busy(self, groups, start, end):
+        # Вызывается под self._lock
+        for key, capacity in groups:
+            schedule = self._schedules.get(key)
+            if schedule is not None and schedule.busy(start, end, capacity):
+                return True
+        return False
+
+    def is_free(self, master, service, moment):
+        start, end = self._interval(service, moment)
+        groups = self.groups_of(master)
+        with self._lock:
+            return not self._busy(groups, start, end)
+
+    def free_slots(self, master=None, service=None, after=None, count=5):
+        """
+        Ближайшие count свободных начал записи после after (по сетке step минут).
+        Часы работы салона ограничивают только подсказки, а не запись на выбранное время.
+        """
+        after = after or datetime.now()
+        first = _minutes(after)
+        first += -first % self.step
+        day = _moment(first).replace(hour=0, minute=0)
+        result = []
+        for _ in range(SLOT_HORIZON_DAYS):
+            if day.weekday() in self.workdays:
+                minute = max(_minutes(day) + self.open_minute, first)
+                minute += -(minute - _minutes(day)) % self.step
+                while minute < _minutes(day) + self.close_minute and len(result) < count:
+                    moment = _moment(minute)
+                    if self.within_hours(moment, service) and self.is_free(master, service, moment):
+                        result.append(moment)
+                    minute += self.step
+            if len(result) >= count:
+                break
+            day += timedelta(days=1)
+        return result
+
+    def reserve(self, master, service, moment):
+        """
+        Атомарно проверяет и занимает интервал. Возвращает (ok, token);
+        token нужен для release(), если заявку не удалось сохранить.
+        """
+        start, end = self._interval(service, moment)
+        groups = self.groups_of(master)
+        keys = tuple(key for key, _ in groups)
+        with self._lock:
+            if self._busy(groups, start, end):
+                self.stats["conflicts"] += 1
+                return False, None
+            for key in keys:
+                self._schedules.setdefault(key, _Schedule()).add(start, end)
+            if self._recent is not None:
+                self._recent.append((keys, start, end))
+        self.stats["reserved"] += 1
+        return True, (keys, start, end)
+
+    def release(self, token):
+        if token is None:
+            return
+        keys, start, end = token
+        with self._lock:
+            for key in keys:
+                schedule = self._schedules.get(key)
+                if schedule is not None:
+                    schedule.remove(start, end)
+            if self._recent is not None and token in self._recent:
+                self._recent.remove(token)
+
+
+def format_slot(moment):
+    return moment.strftime(DATE_FORMAT)
@@ -0,0 +1,345 @@
+"""
+Локальные HTTP-заменители OpenAI Assistants API и Telegram Bot API для нагрузочных прогонов.
+
+Серверы работают в фоновых потоках (http.server), считают вызовы по методам
+и имитируют задержку: run ассистента переходит в completed (или requires_action
+с вызовом save_booking_data) через run_latency секунд.
+"""
+import asyncio
+import itertools
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Сообщение пользователя с этим словом приводит к вызову save_booking_data
+BOOKING_TRIGGER = re.compile(r"запиш", re.IGNORECASE)
+REPLY_TEXT = "Окрашивание AirTouch стоит от 9000 ₽, длительность около трёх часов."
+BOOKED_TEXT = "Готово! Ваша запись создана."
+STREAM_CHUNKS = 4
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return {}
+        if "json" in (self.headers.get("Content-Type") or ""):
+            return json.loads(raw)
+        # PTB отправляет параметры формой, сложные значения — строками JSON
+        return {key: values[-1] for key, values in parse_qs(raw.decode("utf-8")).items()}
+
+    def _send_json(self, payload, status=200):
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, event, data):
+        payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _dispatch(self, method):
+        try:
+            self.server.owner.handle(self, method, self._body())
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент закрыл поток run после requires_action — это штатно
+            self.close_connection = True
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class _FakeServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.owner = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def handle(self, handler, method, body):
+        raise NotImplementedError
+
+
+class FakeOpenAIServer(_FakeServer):
+    """
+    Threads / messages / runs (обычные и stream=true), submit_tool_outputs и cancel.
+    Базовый адрес для OPENAI_API_BASE — url + "/v1".
+    """
+
+    def __init__(self, run_latency=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.run_latency = run_latency
+        self._ids = itertools.count(1)
+        self._threads = {}  # thread_id -> [message]
+        self._runs = {}  # run_id -> dict
+        self._slots = itertools.count()
+        self.tool_outputs = {}  # thread_id -> [tool_output] из submit_tool_outputs
+
+    def _new_id(self, prefix):
+        return f"{prefix}_{next(self._ids)}"
+
+    def _message(self, role, text):
+        return {
+            "id": self._new_id("msg"), "object": "thread.message", "role": role,
+            "created_at": int(time.time()),
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        }
+
+    def _tool_call(self):
+        # Каждой заявке — свой мастер, чтобы расписание не отклоняло их как пересечения
+        n = next(self._slots)
+        return {
+            "id": self._new_id("call"),
+            "type": "function",
+            "function": {
+                "name": "save_booking_data",
+                "arguments": json.dumps({
+                    "name": f"Клиент {n}", "phone": f"+7999{n:07d}", "service": "Стрижка",
+                    "datetime": next_workday_slot(), "master_category": f"Мастер {n}",
+                }, ensure_ascii=False),
+            },
+        }
+
+    def _create_run(self, thread_id):
+        messages = self._threads.setdefault(thread_id, [])
+        last_user = next((m for m in reversed(messages) if m["role"] == "user"), None)
+        text = last_user["content"][0]["text"]["value"] if last_user else ""
+        run = {
+            "id": self._new_id("run"), "object": "thread.run", "thread_id": thread_id,
+            "status": "in_progress", "ready_at": time.monotonic() + self.run_latency,
+            "tool_call": self._tool_call() if BOOKING_TRIGGER.search(text) else None,
+            "submitted": False,
+        }
+        with self._lock:
+            self._runs[run["id"]] = run
+        return run
+
+    def _run_view(self, run):
+        if run["status"] == "in_progress" and time.monotonic() >= run["ready_at"]:
+            if run["tool_call"] and not run["submitted"]:
+                run["status"] = "requires_action"
+            else:
+                self._complete(run)
+        view = {key: run[key] for key in ("id", "object", "thread_id", "status")}
+        if run["status"] == "requires_action":
+            view["required_action"] = {
+                "type": "submit_tool_outputs",
+                "submit_tool_outputs": {"tool_calls": [run["tool_call"]]},
+            }
+        return view
+
+    def _complete(self, run):
+        run["status"] = "completed"
+        text = BOOKED_TEXT if run["tool_call"] else REPLY_TEXT
+        self._threads.setdefault(run["thread_id"], []).append(self._message("assistant", text))
+        return text
+
+    def _stream_run(self, handler, run):
+        handler._start_stream()
+        handler._send_event("thread.run.created", {"id": run["id"], "status": "queued"})
+        time.sleep(max(0.0, run["ready_at"] - time.monotonic()))
+        if run["tool_call"] and not run["submitted"]:
+            run["status"] = "requires_action"
+            handler._send_event("thread.run.requires_action", self._run_view(run))
+        else:
+            text = self._complete(run)
+            step = max(1, len(text) // STREAM_CHUNKS)
+            for i in range(0, len(text), step):
+                handler._send_event("thread.message.delta", {
+                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": text[i:i + step]}}]},
+                })
+            handler._send_event("thread.run.completed", {"id": run["id"], "status": "completed"})
+        handler._send_event("done", "[DONE]")
+
+    def _list_messages(self, thread_id, query):
+        # order / after / limit, как у GET /threads/{id}/messages
+        messages = list(self._threads.get(thread_id, []))
+        if query.get("order", ["desc"])[0] == "desc":
+            messages.reverse()
+        after = query.get("after", [None])[0]
+        if after is not None:
+            ids = [m["id"] for m in messages]
+            messages = messages[ids.index(after) + 1:] if after in ids else []
+        limit = int(query.get("limit", ["20"])[0])
+        return {"data": messages[:limit], "has_more": len(messages) > limit}
+
+    def handle(self, handler, method, body):
+        path = urlparse(handler.path).path
+        parts = [part for part in path.split("/") if part][1:]  # без "v1"
+        if method == "POST" and parts == ["threads"]:
+            self.count("threads.create")
+            thread_id = self._new_id("thread")
+            self._threads[thread_id] = []
+            return handler._send_json({"id": thread_id, "object": "thread"})
+        if len(parts) == 3 and parts[0] == "threads" and parts[2] == "messages":
+            thread_id = parts[1]
+            if method == "POST":
+                self.count("messages.create")
+                message = self._message(body.get("role", "user"), body.get("content", ""))
+                self._threads.setdefault(thread_id, []).append(message)
+                return handler._send_json(message)
+            self.count("messages.list")
+            return handler._send_json(self._list_messages(thread_id, parse_qs(urlparse(handler.path).query)))
+        if len(parts) == 3 and parts[0] == "threads" and parts[2] == "runs" and method == "POST":
+            run = self._create_run(parts[1])
+            if body.get("stream"):
+                self.count("runs.create_stream")
+                return self._stream_run(handler, run)
+            self.count("runs.create")
+            return handler._send_json(self._run_view(run))
+        if len(parts) == 4 and parts[0] == "threads" and parts[2] == "runs" and method == "GET":
+            self.count("runs.retrieve")
+            run = self._runs.get(parts[3])
+            if run is None:
+                return handler._send_json({"error": {"message": "run not found"}}, 404)
+            return handler._send_json(self._run_view(run))
+        if len(parts) == 5 and parts[4] == "cancel" and method == "POST":
+            self.count("runs.cancel")
+            run = self._runs.get(parts[3])
+            if run is None:
+                return handler._send_json({"error": {"message": "run not found"}}, 404)
+            run["status"] = "cancelled"
+            return handler._send_json({key: run[key] for key in ("id", "object", "thread_id", "status")})
+        if len(parts) == 5 and parts[4] == "submit_tool_outputs":
+            run = self._runs.get(parts[3])
+            if run is None:
+                return handler._send_json({"error": {"message": "run not found"}}, 404)
+            with self._lock:
+                self.tool_outputs.setdefault(run["thread_id"], []).extend(body.get("tool_outputs", []))
+            run["submitted"] = True
+            run["status"] = "in_progress"
+            run["ready_at"] = time.monotonic() + self.run_latency / 2
+            if body.get("stream"):
+                self.count("runs.submit_tool_outputs_stream")
+                return self._stream_run(handler, run)
+            self.count("runs.submit_tool_outputs")
+            return handler._send_json(self._run_view(run))
+        handler._send_json({"error": {"message": f"unknown endpoint {method} {path}"}}, 404)
+
+
+class FakeTelegramServer(_FakeServer):
+    """
+    Методы Bot API, которые вызывает бот: getMe, setMyCommands, setWebhook,
+    deleteWebhook, getUpdates, sendMessage, editMessageText, sendChatAction.
+    Отправленные ботом сообщения запоминаются по чатам; wait_for() ждёт их из event loop.
+    """
+
+    def __init__(self, latency=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self._message_ids = itertools.count(1)
+        self.messages = {}  # chat_id -> [(method, text)]
+        self._waiters = []  # (chat_id, predicate, future, loop)
+
+    def handle(self, handler, method, body):
+        match = re.match(r"^/bot[^/]+/(\w+)$", urlparse(handler.path).path)
+        if not match:
+            return handler._send_json({"ok": False, "error_code": 404, "description": "Not Found"}, 404)
+        name = match.group(1)
+        self.count(name)
+        if self.latency:
+            time.sleep(self.latency)
+        if name == "getMe":
+            return handler._send_json({"ok": True, "result": {
+                "id": 100000, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            }})
+        if name == "getUpdates":
+            return handler._send_json({"ok": True, "result": []})
+        if name in ("sendMessage", "editMessageText"):
+            chat_id = int(body.get("chat_id"))
+            text = body.get("text", "")
+            message_id = int(body.get("message_id") or next(self._message_ids))
+            handler._send_json({"ok": True, "result": {
+                "message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text,
+            }})
+            # Клиент узнаёт об ответе только после того, как бот получил ответ Bot API
+            return self._record(chat_id, name, text)
+        return handler._send_json({"ok": True, "result": True})
+
+    def _record(self, chat_id, method, text):
+        with self._lock:
+            events = self.messages.setdefault(chat_id, [])
+            events.append((method, text))
+            ready = [w for w in self._waiters if w[0] == chat_id and w[1](events)]
+            for waiter in ready:
+                self._waiters.remove(waiter)
+        for _, _, future, loop in ready:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(True))
+
+    def sent_count(self, chat_id):
+        with self._lock:
+            return len(self.messages.get(chat_id, []))
+
+    async def wait_for(self, chat_id, predicate, timeout):
+        """
+        Ждёт, пока predicate(события чата) станет истинным.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if predicate(self.messages.get(chat_id, [])):
+                return True
+            self._waiters.append((chat_id, predicate, future, loop))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            with self._lock:
+                self._waiters = [w for w in self._waiters if w[2] is not future]
+
+
+def next_workday_slot(days_ahead=7, hour=12):
+    """
+    Дата в будущем в рабочий день салона, формат ДД.ММ.ГГГГ ЧЧ:ММ.
+    """
+    day = datetime.now() + timedelta(days=days_ahead)
+    while day.weekday() == 6:
+        day += timedelta(days=1)
+    return day.replace(hour=hour, minute=0).strftime("%d.%m.%Y %H:%M")
@@ -0,0 +1,352 @@
+"""
+Офлайн-нагрузочный прогон: веб-API и Telegram-бот против локальных заменителей
+OpenAI, Telegram и Google Sheets.
+
+Сценарии (каждый — N одновременных пользователей, сценарии идут по очереди):
+    api_booking   — заявка с сайта: POST /api/booking;
+    chat_booking  — запись через ассистента: /api/chat с вызовом save_booking_data;
+    tg_booking    — быстрая запись в боте: /start → имя → телефон → услуга → дата → мастер → комментарий;
+    tg_consult    — консультация в боте: /start → «Консультация» → вопрос.
+
+Отчёт: p50/p95/p99 задержки ответа на шаг, пропускная способность (сценариев в секунду)
+и число вызовов OpenAI / Telegram / Sheets на один сценарий. Для CI:
+    python -m bench.run --users 50 --fail-p95 tg_booking=500 --json bench.json
+завершится с кодом 1, если p95 сценария превысит порог или были ошибки.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_servers import FakeOpenAIServer, FakeTelegramServer, next_workday_slot  # noqa: E402
+
+SCENARIOS = ("api_booking", "chat_booking", "tg_booking", "tg_consult")
+# Сценарии, каждый из которых должен добавить строку заявки в таблицу
+BOOKING_SCENARIOS = ("api_booking", "chat_booking", "tg_booking")
+ADMIN_CHAT_ID = 999
+WEBHOOK_SECRET = "bench-secret"
+# После этой фразы ответ консультации считается полученным целиком
+CONSULT_DONE_MARKER = "Быстрая запись"
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    # Метод ближайшего ранга
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def configure_env(args, openai, telegram, workdir):
+    """
+    Настройки приложения до импорта main: все внешние адреса — на заменители.
+    """
+    os.environ.update({
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_ASSISTANT_ID": "asst_bench",
+        "OPENAI_API_BASE": openai.url + "/v1",
+        "OPENAI_POLL_INITIAL_DELAY": str(args.poll_delay),
+        "TELEGRAM_BOT_TOKEN": "123456:bench",
+        "TELEGRAM_API_BASE": telegram.url,
+        "TELEGRAM_MODE": "webhook",
+        "TELEGRAM_WEBHOOK_URL": "",
+        "TELEGRAM_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "ADMIN_CHAT_ID": str(ADMIN_CHAT_ID),
+        "SHEETS_BACKEND": "fake",
+        "GOOGLE_SHEET_ID": "bench",
+        "ASSISTANT_STREAMING": "1" if args.streaming else "0",
+        # Локальные ответы не должны подменять проверяемый путь к ассистенту
+        "ANSWER_CACHE_ENABLED": "0",
+        "FAQ_ROUTER_ENABLED": "0",
+        "STORE_BACKEND": "sqlite",
+        "STORE_PATH": os.path.join(workdir, "store.db"),
+        "SHEETS_QUEUE_PATH": os.path.join(workdir, "sheets_queue.db"),
+        "IDEMPOTENCY_PATH": os.path.join(workdir, "idempotency.db"),
+        "BOOKINGS_MIRROR_PATH": os.path.join(workdir, "bookings.db"),
+        "REMINDERS_PATH": os.path.join(workdir, "reminders.db"),
+        "POLLING_LOCK_PATH": os.path.join(workdir, "polling.lock"),
+    })
+
+
+class Recorder:
+    """
+    Задержки шагов, длительность и итог сценариев одного типа.
+    pause — пауза пользователя перед каждым шагом (в задержку шага не входит).
+    """
+
+    def __init__(self, name, pause=0.0):
+        self.name = name
+        self.pause = pause
+        self.steps = []
+        self.flows = []
+        self.errors = []
+
+    async def step(self, coro):
+        if self.pause:
+            await asyncio.sleep(self.pause)
+        started = time.perf_counter()
+        result = await coro
+        self.steps.append(time.perf_counter() - started)
+        return result
+
+    def report(self, wall, calls):
+        completed = len(self.flows)
+        ms = lambda seconds: None if seconds is None else round(seconds * 1000, 1)  # noqa: E731
+        return {
+            "flows": completed,
+            "errors": len(self.errors),
+            "error_samples": self.errors[:5],
+            "wall_seconds": round(wall, 3),
+            "throughput_per_sec": round(completed / wall, 2) if wall else None,
+            "step_p50_ms": ms(percentile(self.steps, 50)),
+            "step_p95_ms": ms(percentile(self.steps, 95)),
+            "step_p99_ms": ms(percentile(self.steps, 99)),
+            "flow_p50_ms": ms(percentile(self.flows, 50)),
+            "flow_p95_ms": ms(percentile(self.flows, 95)),
+            "flow_p99_ms": ms(percentile(self.flows, 99)),
+            "calls_per_flow": {
+                name: round(count / completed, 2) if completed else None for name, count in calls.items()
+            },
+        }
+
+
+class TelegramUser:
+    """
+    Клиент Telegram: шлёт обновления в webhook и ждёт ответы бота в фейковом Bot API.
+    """
+    _update_ids = iter(range(1, 10 ** 9))
+
+    def __init__(self, client, telegram, user_id, timeout):
+        self.client = client
+        self.telegram = telegram
+        self.user_id = user_id
+        self.timeout = timeout
+
+    def _update(self, text):
+        message = {
+            "message_id": next(self._update_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False, "first_name": f"User {self.user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    async def send(self, text, replies=1, predicate=None):
+        """
+        Отправляет сообщение и ждёт replies новых сообщений бота (или predicate по новым событиям).
+        """
+        base = self.telegram.sent_count(self.user_id)
+        response = await self.client.post(
+            "/telegram/webhook", json=self._update(text),
+            headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET},
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"webhook ответил {response.status_code}")
+        check = (lambda events: predicate(events[base:])) if predicate else (lambda events: len(events) >= base + replies)
+        try:
+            await self.telegram.wait_for(self.user_id, check, self.timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"нет ответа бота на «{text}» за {self.timeout:.0f} c") from None
+        return self.telegram.messages[self.user_id][base:]
+
+
+async def api_booking(ctx, recorder, i):
+    payload = {
+        "name": f"Клиент сайта {i}", "phone": f"+7900{i:07d}", "service": "Стрижка",
+        "datetime": next_workday_slot(), "master": f"Мастер сайта {i}",
+    }
+    response = await recorder.step(ctx["client"].post(
+        "/api/booking", json=payload, headers={"Idempotency-Key": uuid.uuid4().hex},
+    ))
+    data = await response.get_json()
+    if response.status_code != 200 or not data.get("success"):
+        raise RuntimeError(f"/api/booking {response.status_code}: {data}")
+
+
+async def chat_booking(ctx, recorder, i):
+    response = await recorder.step(ctx["client"].post("/api/chat", json={
+        "user_id": f"bench-{i}", "message": "Запишите меня на стрижку на следующей неделе",
+    }))
+    data = await response.get_json()
+    if not data.get("success"):
+        raise RuntimeError(f"/api/chat: {data}")
+    # Ответ ассистента не зависит от результата функции — проверяем сам результат
+    outputs = ctx["openai"].tool_outputs.get(data.get("thread_id"), [])
+    if not any(json.loads(item["output"]).get("success") for item in outputs):
+        raise RuntimeError(f"save_booking_data не сохранил заявку: {outputs}")
+
+
+async def tg_booking(ctx, recorder, i):
+    user = TelegramUser(ctx["client"], ctx["telegram"], 2_000_000 + i, ctx["timeout"])
+    await recorder.step(user.send("/start"))
+    await recorder.step(user.send("Быстрая запись"))
+    await recorder.step(user.send(f"Клиент бота {i}"))
+    await recorder.step(user.send(f"+7901{i:07d}"))
+    await recorder.step(user.send("Стрижка"))
+    await recorder.step(user.send(next_workday_slot()))
+    await recorder.step(user.send(f"Мастер бота {i}"))
+    replies = await recorder.step(user.send("Без комментариев", replies=2))
+    if not replies[0][1].startswith("Спасибо"):
+        raise RuntimeError(f"заявка не принята: {replies[0][1]}")
+
+
+async def tg_consult(ctx, recorder, i):
+    user = TelegramUser(ctx["client"], ctx["telegram"], 3_000_000 + i, ctx["timeout"])
+    await recorder.step(user.send("/start"))
+    await recorder.step(user.send("Консультация"))
+    await recorder.step(user.send(
+        "Сколько стоит окрашивание AirTouch?",
+        predicate=lambda events: any(CONSULT_DONE_MARKER in text for _, text in events),
+    ))
+
+
+async def run_scenario(name, ctx, users):
+    # Бот сохраняет шаг диалога после отправки ответа: без паузы «пользователь»
+    # отвечает раньше, чем ConversationHandler перейдёт в следующее состояние
+    recorder = Recorder(name, ctx["think"] if name.startswith("tg_") else 0.0)
+    flow = globals()[name]
+
+    async def one(i):
+        started = time.perf_counter()
+        try:
+            await flow(ctx, recorder, i)
+        except Exception as ex:
+            recorder.errors.append(f"{type(ex).__name__}: {ex}")
+            return
+        recorder.flows.append(time.perf_counter() - started)
+
+    before = ctx["counters"]()
+    rows_before = ctx["rows"]()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(ctx["offset"] + i) for i in range(users)))
+    wall = time.perf_counter() - started
+    ctx["offset"] += users
+    # Отложенная запись в Sheets и уведомления админу — часть стоимости заявки
+    await ctx["drain"]()
+    after = ctx["counters"]()
+    if name in BOOKING_SCENARIOS:
+        booked = ctx["rows"]() - rows_before
+        if booked != len(recorder.flows):
+            recorder.errors.append(f"в таблицу записано {booked} заявок из {len(recorder.flows)}")
+    return recorder.report(wall, {key: after[key] - before[key] for key in after})
+
+
+async def bench(args, openai, telegram):
+    import integrations
+    import main
+    from fakes import FakeSheetsService
+    from functions import get_booking_queue
+    from notifier import get_dispatcher
+
+    sheets = FakeSheetsService(latency=args.sheets_latency)
+    integrations.override("sheets", sheets)
+
+    def counters():
+        return {"openai": openai.total_calls(), "telegram": telegram.total_calls(), "sheets": len(sheets.calls)}
+
+    async def drain():
+        queue = get_booking_queue()
+        if queue is not None:
+            await asyncio.to_thread(queue.flush, args.timeout)
+        dispatcher = get_dispatcher()
+        deadline = time.perf_counter() + args.timeout
+        while dispatcher.qsize() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+
+    results = {}
+    async with main.app.test_app() as test_app:
+        await asyncio.wait_for(asyncio.shield(main._startup_task), args.timeout)
+        ctx = {
+            "client": test_app.test_client(), "openai": openai, "telegram": telegram, "timeout": args.timeout,
+            "think": args.think, "counters": counters, "rows": lambda: len(sheets.rows), "drain": drain, "offset": 0,
+        }
+        for name in args.scenarios:
+            print(f"[Bench] {name}: {args.users} пользователей…")
+            results[name] = await run_scenario(name, ctx, args.users)
+    return results
+
+
+def print_report(results):
+    header = f"{'scenario':<14}{'flows':>7}{'err':>5}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}  calls/flow (openai/telegram/sheets)"
+    print(header)
+    print("-" * len(header))
+    for name, row in results.items():
+        calls = row["calls_per_flow"]
+        print(
+            f"{name:<14}{row['flows']:>7}{row['errors']:>5}{row['throughput_per_sec'] or 0:>8}"
+            f"{row['step_p50_ms'] or 0:>9}{row['step_p95_ms'] or 0:>9}{row['step_p99_ms'] or 0:>9}"
+            f"  {calls['openai']}/{calls['telegram']}/{calls['sheets']}"
+        )
+        for sample in row["error_samples"]:
+            print(f"    ! {sample}")
+    print("p50/p95/p99 — задержка ответа на один шаг пользователя, мс")
+
+
+def check_thresholds(results, thresholds):
+    failures = []
+    for name, row in results.items():
+        if row["errors"]:
+            failures.append(f"{name}: {row['errors']} ошибок")
+    for item in thresholds:
+        name, _, limit = item.partition("=")
+        row = results.get(name)
+        if row is None:
+            failures.append(f"{name}: сценарий не запускался")
+        elif row["step_p95_ms"] is None or row["step_p95_ms"] > float(limit):
+            failures.append(f"{name}: p95 {row['step_p95_ms']} мс > {limit} мс")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-нагрузочный прогон бота и веб-API")
+    parser.add_argument("--users", type=int, default=20, help="одновременных пользователей на сценарий")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="время run ассистента, c")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка Bot API, c")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="задержка Google Sheets, c")
+    parser.add_argument("--poll-delay", type=float, default=0.1, help="OPENAI_POLL_INITIAL_DELAY, c")
+    parser.add_argument("--think", type=float, default=0.05, help="пауза пользователя перед сообщением боту, c")
+    parser.add_argument("--streaming", action="store_true", help="потоковые ответы ассистента в боте")
+    parser.add_argument("--timeout", type=float, default=60.0, help="ожидание ответа на шаг, c")
+    parser.add_argument("--json", help="записать результаты в JSON-файл")
+    parser.add_argument(
+        "--fail-p95", action="append", default=[], metavar="SCENARIO=MS",
+        help="порог p95 шага для CI (можно повторять)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    openai = FakeOpenAIServer(run_latency=args.openai_latency).start()
+    telegram = FakeTelegramServer(latency=args.telegram_latency).start()
+    with tempfile.TemporaryDirectory(prefix="salon-bench-") as workdir:
+        configure_env(args, openai, telegram, workdir)
+        try:
+            results = asyncio.run(bench(args, openai, telegram))
+        finally:
+            openai.stop()
+            telegram.stop()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    failures = check_thresholds(results, args.fail_p95)
+    for failure in failures:
+        print(f"[Bench] FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Микробенчмарк проверки заявок: прежняя схема (pytz.timezone + strptime на каждый
+вызов) против booking.parse_booking_datetime / normalize_phone / parse_booking.
+
+    python -m bench.validation --number 20000
+
+Отчёт — микросекунды на вызов (лучший из --repeat прогонов timeit).
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pytz  # noqa: E402
+
+import tenants  # noqa: E402
+from booking import DATE_FORMAT, local_now, normalize_phone, parse_booking, parse_booking_datetime  # noqa: E402
+
+TIMEZONE = tenants.primary().timezone
+
+BOOKING = {
+    "name": "Анна",
+    "phone": "8 (999) 123-45-67",
+    "service": "Стрижка",
+    "date": "05.05.2099 14:30",
+    "master": "Топ-мастер",
+    "comment": "-",
+    "source": "Сайт",
+}
+
+
+def legacy_datetime(value):
+    """
+    Проверка даты в том виде, в каком она была до booking.py.
+    """
+    tz = pytz.timezone(TIMEZONE)
+    try:
+        moment = datetime.strptime(value.strip(), DATE_FORMAT)
+    except ValueError:
+        return False, "bad format"
+    if moment < datetime.now(tz).replace(tzinfo=None):
+        return False, "past"
+    return True, moment.strftime(DATE_FORMAT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Скорость проверки заявок")
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    now = local_now()
+    cases = (
+        ("legacy datetime", lambda: legacy_datetime("05.05.2099 14:30")),
+        ("parse_booking_datetime", lambda: parse_booking_datetime("05.05.2099 14:30", now)),
+        ("parse_booking_datetime (завтра)", lambda: parse_booking_datetime("завтра в 15:00", now)),
+        ("normalize_phone", lambda: normalize_phone("8 (999) 123-45-67")),
+        ("parse_booking", lambda: parse_booking(BOOKING, None, now)),
+    )
+    for title, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        print(f"{title:<34} {best / args.number * 1e6:8.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Проверка и нормализация заявок на запись.
+
+Одни и те же правила для сайта (/api/booking), бота (шаги быстрой записи)
+и функции ассистента save_booking_data: правила описаны таблицей FIELDS
+и собираются один раз при импорте (регулярные выражения), поэтому проверку
+можно вызывать на каждом шаге диалога. Часовой пояс — текущего салона
+(tenants.current().tz), он тоже создаётся один раз.
+
+parse_booking(data, salon) → (Booking, "") или (None, текст ошибки).
+Входной словарь не меняется; Booking.as_dict() отдаёт поля в прежнем формате
+(date/datetime, master/master_category), который ждут таблица и уведомления.
+
+Телефон приводится к E.164 (+79991234567). Дата понимает ДД.ММ.ГГГГ ЧЧ:ММ,
+ДД.ММ ЧЧ:ММ, ISO (2025-05-05 14:30, 2025-05-05T14:30), а также «сегодня»,
+«завтра», «послезавтра» и дни недели: «завтра в 15», «в пятницу в 18:30».
+"""
+import os
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import tenants
+
+# Код страны для номеров без него (8 999 ... / 999 ...)
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "7")
+DATE_FORMAT = "%d.%m.%Y %H:%M"
+MAX_TEXT_LENGTH = 200
+MAX_COMMENT_LENGTH = 1000
+
+DATE_HINT = "Дата должна быть в формате ДД.ММ.ГГГГ ЧЧ:ММ (например, 05.05.2025 14:30) или «завтра в 15:00»"
+PHONE_HINT = "Укажите телефон в формате +79991234567"
+
+_SPACES = re.compile(r"\s+")
+_NOT_DIGITS = re.compile(r"\D+")
+_PHONE_CHARS = re.compile(r"^\+?[\d\s().\-]+$")
+_LETTER = re.compile(r"[^\W\d_]")
+# Шаблоны дат применяются к тексту в нижнем регистре (отсюда [t\s] в ISO)
+_NUMERIC_DATE = re.compile(
+    r"^(?P<day>\d{1,2})[./](?P<month>\d{1,2})(?:[./](?P<year>\d{2}|\d{4}))?"
+    r"(?:[\s,]+(?:в\s+)?|\s*$)(?P<time>.*)$"
+)
+_ISO_DATE = re.compile(
+    r"^(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})(?:[t\s]+(?P<time>.*))?$"
+)
+_RELATIVE_DATE = re.compile(r"^(?:в\s+|во\s+)?(?P<word>[а-яё]+)(?:[\s,]+(?:в\s+)?(?P<time>.*))?$")
+_TIME = re.compile(
+    r"^(?P<hour>\d{1,2})(?:[:.\-\s](?P<minute>\d{2})(?::\d{2})?)?(?:\s*(?:ч|час(?:а|ов)?))?"
+    r"(?:\s+(?P<part>утра|дня|вечера|ночи))?$"
+)
+
+# Относительные дни: слово (или его основа) -> смещение в днях
+_DAY_WORDS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+# Основы дней недели (понедельник, во вторник, в среду, ...) -> номер дня
+_WEEKDAY_STEMS = (
+    ("понедельник", 0), ("вторник", 1), ("сред", 2), ("четверг", 3),
+    ("пятниц", 4), ("суббот", 5), ("воскресень", 6),
+)
+# Ответы «пропустить» на необязательных шагах бота
+SKIP_WORDS = frozenset(("", "-", "—", "нет", "пропустить", "пропустите", "любой", "любого", "без комментариев"))
+
+
+def local_now():
+    """
+    Текущее время салона без tzinfo (как даты в таблице); часовой пояс —
+    текущего салона (tenants.current()).
+    """
+    return datetime.now(tenants.current().tz).replace(tzinfo=None)
+
+
+def clean_text(value, limit=MAX_TEXT_LENGTH):
+    return _SPACES.sub(" ", str(value or "")).strip()[:limit]
+
+
+def normalize_phone(value):
+    """
+    Телефон в E.164. Возвращает (True, "+79991234567") или (False, текст ошибки).
+    """
+    raw = str(value or "").strip()
+    if not raw:
+        return False, "Не заполнено обязательное поле: phone"
+    if not _PHONE_CHARS.match(raw):
+        return False, PHONE_HINT
+    digits = _NOT_DIGITS.sub("", raw)
+    if raw.startswith("+"):
+        pass
+    elif DEFAULT_COUNTRY_CODE == "7" and len(digits) == 11 and digits[0] in "78":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10:
+        digits = DEFAULT_COUNTRY_CODE + digits
+    if not 10 <= len(digits) <= 15 or (digits[0] == "7" and len(digits) != 11):
+        return False, PHONE_HINT
+    return True, "+" + digits
+
+
+def _parse_time(text):
+    match = _TIME.match(text.strip().lower().rstrip("."))
+    if match is None:
+        return None
+    hour, minute = int(match.group("hour")), int(match.group("minute") or 0)
+    part = match.group("part")
+    if part in ("дня", "вечера") and hour < 12:
+        hour += 12
+    elif part == "ночи" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return hour, minute
+
+
+def _relative_day(word, today):
+    if word in _DAY_WORDS:
+        return today + timedelta(days=_DAY_WORDS[word])
+    for stem, weekday in _WEEKDAY_STEMS:
+        if word.startswith(stem):
+            return today + timedelta(days=(weekday - today.weekday()) % 7)
+    return None
+
+
+def parse_moment(value, now=None):
+    """
+    Разбирает дату и время записи. Возвращает datetime (без tzinfo) или None.
+    now — текущее время салона (для «завтра», дней недели и года по умолчанию).
+    """
+    text = clean_text(value).lower()
+    if not text:
+        return None
+    match = _NUMERIC_DATE.match(text) or _ISO_DATE.match(text)
+    if match is not None:
+        parts = match.groupdict()
+        clock = _parse_time(parts.get("time") or "")
+        if clock is None:
+            return None
+        now = now or local_now()
+        year = parts.get("year")
+        if year is None:
+            year = now.year
+        elif len(year) == 2:
+            year = 2000 + int(year)
+        try:
+            moment = datetime(int(year), int(parts["month"]), int(parts["day"]), *clock)
+        except ValueError:
+            return None
+        if parts.get("year") is None and moment < now:
+            # «05.01 14:00» в декабре — это январь следующего года
+            try:
+                moment = moment.replace(year=moment.year + 1)
+            except ValueError:
+                return None
+        return moment
+    match = _RELATIVE_DATE.match(text)
+    if match is None:
+        return None
+    now = now or local_now()
+    day = _relative_day(match.group("word"), now.date())
+    clock = _parse_time(match.group("time") or "")
+    if day is None or clock is None:
+        return None
+    moment = datetime(day.year, day.month, day.day, *clock)
+    if moment < now and match.group("word") not in _DAY_WORDS:
+        # «в пятницу в 10», а сегодня пятница и 10 уже прошло — следующая пятница
+        moment += timedelta(days=7)
+    return moment
+
+
+def _future_moment(value, now):
+    moment = parse_moment(value, now)
+    if moment is None:
+        return False, DATE_HINT
+    if moment < now:
+        return False, "Укажите дату и время в будущем."
+    return True, moment
+
+
+def parse_booking_datetime(value, now=None):
+    """
+    Дата и время записи в формате ДД.ММ.ГГГГ ЧЧ:ММ, только в будущем.
+    Возвращает (True, строка) или (False, текст ошибки).
+    """
+    if not value:
+        return False, "Не заполнено обязательное поле: date/datetime"
+    ok, moment = _future_moment(value, now or local_now())
+    return (True, moment.strftime(DATE_FORMAT)) if ok else (False, moment)
+
+
+class Booking:
+    """
+    Проверенная заявка. moment — дата и время записи (datetime без tzinfo).
+    """
+    __slots__ = ("name", "phone", "service", "moment", "master", "master_category", "comment", "source")
+
+    def __init__(self, name, phone, service, moment, master="", master_category="", comment="", source=""):
+        self.name = name
+        self.phone = phone
+        self.service = service
+        self.moment = moment
+        self.master = master
+        self.master_category = master_category
+        self.comment = comment
+        self.source = source
+
+    @property
+    def date(self):
+        return self.moment.strftime(DATE_FORMAT)
+
+    def as_dict(self):
+        """
+        Заявка в формате словаря (как раньше принимали таблица, расписание и уведомления).
+        """
+        date = self.date
+        return {
+            "name": self.name,
+            "phone": self.phone,
+            "service": self.service,
+            "date": date,
+            "datetime": date,
+            "master": self.master,
+            "master_category": self.master_category,
+            "comment": self.comment,
+            "source": self.source,
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, Booking) and all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def __repr__(self):
+        return f"Booking({self.name!r}, {self.phone!r}, {self.service!r}, {self.date!r}, master={self.master!r})"
+
+
+# Правило поля: ключи во входных данных (по порядку), название в ошибке, обязательность,
+# нормализатор(value, now) -> (ok, value | текст ошибки)
+Field = namedtuple("Field", "name keys label required normalize")
+
+
+def _name(value):
+    name = clean_text(value, 100)
+    if not _LETTER.search(name):
+        return False, "Укажите имя"
+    return True, name
+
+
+def _text(value):
+    return True, clean_text(value)
+
+
+def _comment(value):
+    comment = clean_text(value, MAX_COMMENT_LENGTH)
+    return True, "" if comment.lower() in SKIP_WORDS else comment
+
+
+def _master(value):
+    master = clean_text(value)
+    return True, "" if master.lower() in SKIP_WORDS else master
+
+
+def _plain(normalize):
+    return lambda value, now: normalize(value)
+
+
+FIELDS = (
+    Field("name", ("name",), "name", True, _plain(_name)),
+    Field("phone", ("phone",), "phone", True, _plain(normalize_phone)),
+    Field("service", ("service",), "service", True, _plain(_text)),
+    Field("moment", ("datetime", "date"), "date/datetime", True, _future_moment),
+    Field("master", ("master", "master_category"), "master", False, _plain(_master)),
+    Field("comment", ("comment", "comments"), "comment", False, _plain(_comment)),
+    Field("source", ("source",), "source", False, _plain(_text)),
+)
+
+
+def _first(data, keys):
+    for key in keys:
+        value = data.get(key)
+        if value:
+            return value
+    return None
+
+
+def resolve_service(salon, text):
+    """
+    Название услуги по каталогу (с алиасами и опечатками). (ok, name|error).
+    Без загруженного каталога принимается как есть.
+    """
+    if salon is None or not salon.services:
+        return True, text
+    service = salon.find_service(text)
+    if service is None:
+        return False, (
+            f"Услуга «{text}» не найдена. "
+            f"Доступные услуги: {', '.join(salon.service_names())}"
+        )
+    return True, service.name
+
+
+def resolve_master(salon, text):
+    """
+    Мастер или категория мастеров по каталогу. (ok, (master, category) | error).
+    «Любой», «-» и т.п. означают мастера без выбора (пустая строка).
+    """
+    text = _master(text)[1]
+    if not text or salon is None or not salon.masters:
+        return True, (text, text)
+    category = salon.find_category(text)
+    if category is not None:
+        return True, (category, category)
+    master = salon.find_master(text)
+    if master is None:
+        return False, (
+            f"Мастер или категория «{text}» не найдены. "
+            f"Категории мастеров: {', '.join(salon.categories)}"
+        )
+    return True, (master.name, master.category)
+
+
+def parse_booking(data, salon=None, now=None):
+    """
+    Проверяет и нормализует заявку. Возвращает (Booking, "") или (None, текст ошибки).
+    salon — каталог (catalog.Catalog) для сверки услуги и мастера.
+    """
+    if not isinstance(data, dict):
+        return None, "Некорректные данные заявки."
+    now = now or local_now()
+    values = {}
+    for field in FIELDS:
+        raw = _first(data, field.keys)
+        if raw is None:
+            if field.required:
+                return None, f"Не заполнено обязательное поле: {field.label}"
+            values[field.name] = ""
+            continue
+        ok, value = field.normalize(raw, now)
+        if not ok:
+            return None, value
+        if field.required and not value:
+            return None, f"Не заполнено обязательное поле: {field.label}"
+        values[field.name] = value
+    ok, service = resolve_service(salon, values["service"])
+    if not ok:
+        return None, service
+    ok, master = resolve_master(salon, values["master"])
+    if not ok:
+        return None, master
+    return Booking(
+        values["name"], values["phone"], service, values["moment"],
+        master[0], master[1], values["comment"], values["source"],
+    ), ""
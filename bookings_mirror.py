@@ -0,0 +1,322 @@
+"""
+Локальная копия таблицы заявок (SQLite) для быстрых запросов.
+
+Каждая новая заявка записывается в копию вместе с добавлением в Google Sheets
+(или в очередь отложенной записи), поэтому вопросы «сколько записей сегодня»,
+«что у мастера завтра», «есть ли заявки с этим телефоном» решаются запросом
+по индексам (дата, мастер, телефон) без чтения всей таблицы.
+
+Сверка с таблицей идёт в фоновом потоке чтением диапазонов по страницам:
+раз в BOOKINGS_MIRROR_SYNC_INTERVAL дочитываются только строки после последней
+известной, раз в BOOKINGS_MIRROR_FULL_SYNC_INTERVAL таблица перечитывается
+целиком — так в копию попадают правки и удаления строк администратором.
+Строка таблицы — источник истины; локальные заявки, которых нет в таблице
+и нет в очереди записи, удаляются при полной сверке.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from availability import DATE_COLUMN, MASTER_COLUMN, SERVICE_COLUMN, master_key, parse_datetime
+
+BOOKINGS_MIRROR_ENABLED = os.getenv("BOOKINGS_MIRROR_ENABLED", "1") == "1"
+BOOKINGS_MIRROR_PATH = os.getenv(
+    "BOOKINGS_MIRROR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bookings.db")
+)
+BOOKINGS_MIRROR_SYNC_INTERVAL = float(os.getenv("BOOKINGS_MIRROR_SYNC_INTERVAL", "60"))
+BOOKINGS_MIRROR_FULL_SYNC_INTERVAL = float(os.getenv("BOOKINGS_MIRROR_FULL_SYNC_INTERVAL", "3600"))
+# Строк таблицы за одно чтение диапазона
+BOOKINGS_MIRROR_PAGE_ROWS = int(os.getenv("BOOKINGS_MIRROR_PAGE_ROWS", "1000"))
+
+# Колонки строки заявки (см. functions.build_booking_row): A — имя ... H — время создания
+FIRST_COLUMN = "A"
+LAST_COLUMN = "H"
+FIRST_ROW = 2
+NAME_COLUMN = 0
+PHONE_COLUMN = 1
+COMMENT_COLUMN = 5
+SOURCE_COLUMN = 6
+CREATED_COLUMN = 7
+ROW_WIDTH = 8
+PHONE_TAIL = 10
+SORT_FORMAT = "%Y-%m-%d %H:%M"
+MAX_LIMIT = 500
+
+
+def phone_tail(phone):
+    """
+    Последние 10 цифр телефона: +7 999 ..., 8 999 ... и 999 ... совпадают.
+    """
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    return digits[-PHONE_TAIL:]
+
+
+def _cell(row, column):
+    return str(row[column]).strip() if len(row) > column and row[column] is not None else ""
+
+
+def row_key(row):
+    """
+    Ключ заявки по имени, телефону, услуге, времени и мастеру. Таблица с USER_ENTERED
+    может показать телефон, дату или время создания в своём формате, поэтому
+    ячейки сравниваются в нормализованном виде, а время создания не учитывается.
+    """
+    moment = parse_datetime(_cell(row, DATE_COLUMN))
+    parts = [
+        _cell(row, NAME_COLUMN).lower(),
+        phone_tail(_cell(row, PHONE_COLUMN)),
+        _cell(row, SERVICE_COLUMN).lower(),
+        moment.strftime(SORT_FORMAT) if moment else _cell(row, DATE_COLUMN),
+        master_key(_cell(row, MASTER_COLUMN)),
+    ]
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _record(row, sheet_row, recorded):
+    moment = parse_datetime(_cell(row, DATE_COLUMN))
+    master = _cell(row, MASTER_COLUMN)
+    return (
+        row_key(row), sheet_row,
+        _cell(row, NAME_COLUMN), _cell(row, PHONE_COLUMN), phone_tail(_cell(row, PHONE_COLUMN)),
+        _cell(row, SERVICE_COLUMN), _cell(row, DATE_COLUMN),
+        moment.strftime(SORT_FORMAT) if moment else None,
+        master, master_key(master),
+        _cell(row, COMMENT_COLUMN), _cell(row, SOURCE_COLUMN), _cell(row, CREATED_COLUMN),
+        recorded,
+    )
+
+
+_INSERT = (
+    "INSERT INTO bookings (key, sheet_row, name, phone, phone_tail, service, date, starts, "
+    "master, master_key, comment, source, created, recorded) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+)
+_COLUMNS = "name, phone, service, date, master, comment, source, created"
+
+
+class BookingMirror:
+    """
+    Копия заявок в SQLite с фоновой сверкой.
+
+    read_range(a1) — строки таблицы в диапазоне A1 (values().get),
+    pending_source() — строки, ещё стоящие в очереди записи в таблицу,
+    on_removed(keys) — вызывается с ключами заявок, удалённых при полной сверке.
+    """
+
+    def __init__(self, read_range, pending_source=None, on_removed=None, path=BOOKINGS_MIRROR_PATH,
+                 sync_interval=BOOKINGS_MIRROR_SYNC_INTERVAL,
+                 full_sync_interval=BOOKINGS_MIRROR_FULL_SYNC_INTERVAL,
+                 page_rows=BOOKINGS_MIRROR_PAGE_ROWS):
+        self.read_range = read_range
+        self.pending_source = pending_source
+        self.on_removed = on_removed
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.page_rows = page_rows
+        # Сколько строк данных таблицы уже прочитано (для дочитывания хвоста)
+        self.sheet_rows = None
+        self._last_full_sync = 0.0
+        self._lock = threading.Lock()
+        # Одна сверка за раз: фоновый поток и ручной sync() не читают таблицу параллельно
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"recorded": 0, "synced_rows": 0, "syncs": 0, "full_syncs": 0, "removed": 0, "errors": 0}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS bookings ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, sheet_row INTEGER, "
+            "name TEXT, phone TEXT, phone_tail TEXT, service TEXT, date TEXT, starts TEXT, "
+            "master TEXT, master_key TEXT, comment TEXT, source TEXT, created TEXT, recorded REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS bookings_starts ON bookings (starts)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS bookings_master ON bookings (master_key, starts)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS bookings_phone ON bookings (phone_tail, starts)")
+
+    # --- Запись и сверка ---
+
+    def record(self, row):
+        """
+        Добавляет строку новой заявки (как она уходит в таблицу).
+        """
+        with self._lock:
+            self._db.execute(_INSERT + "ON CONFLICT(key) DO NOTHING", _record(row, None, time.time()))
+        self.stats["recorded"] += 1
+
+    def _read_pages(self, first_row):
+        rows = []
+        start = first_row
+        while True:
+            end = start + self.page_rows - 1
+            page = self.read_range(f"{FIRST_COLUMN}{start}:{LAST_COLUMN}{end}")
+            rows.extend(page)
+            if len(page) < self.page_rows:
+                return rows
+            start = end + 1
+
+    def _upsert(self, rows, first_row, recorded):
+        # Пустые строки таблицы пропускаются, но номера строк сохраняются
+        records = [
+            _record(row, first_row + i, recorded)
+            for i, row in enumerate(rows) if any(_cell(row, column) for column in range(ROW_WIDTH))
+        ]
+        self._db.executemany(_INSERT + "ON CONFLICT(key) DO UPDATE SET sheet_row = excluded.sheet_row", records)
+        return len(records)
+
+    def sync(self, full=None):
+        """
+        Сверка с таблицей: дочитывание новых строк или (full) полное перечитывание.
+        Возвращает число прочитанных строк или None при ошибке.
+        """
+        with self._sync_lock:
+            if self.sheet_rows is None:
+                full = True
+            elif full is None:
+                full = time.time() - self._last_full_sync >= self.full_sync_interval
+            started = time.time()
+            try:
+                # Очередь читается до таблицы: строка, записанная между чтениями, найдётся хотя бы в одном
+                pending = {row_key(row) for row in self.pending_source()} if full and self.pending_source else set()
+                first_row = FIRST_ROW if full else FIRST_ROW + self.sheet_rows
+                rows = self._read_pages(first_row)
+            except Exception as ex:
+                self.stats["errors"] += 1
+                print(f"[BookingsMirror] Ошибка чтения таблицы: {ex}")
+                return None
+            with self._lock:
+                self._db.execute("BEGIN")
+                try:
+                    if full:
+                        self._db.execute("UPDATE bookings SET sheet_row = NULL")
+                    synced = self._upsert(rows, first_row, started)
+                    removed = self._remove_missing(started, pending) if full else []
+                    self._db.execute("COMMIT")
+                except Exception as ex:
+                    # Ошибка одной сверки (например, занятая или повреждённая база) не должна
+                    # останавливать фоновый поток: следующая сверка повторит попытку
+                    self._db.execute("ROLLBACK")
+                    self.stats["errors"] += 1
+                    print(f"[BookingsMirror] Ошибка сверки с таблицей: {ex}")
+                    return None
+            self.sheet_rows = (first_row - FIRST_ROW) + len(rows)
+            if full:
+                self._last_full_sync = started
+                self.stats["full_syncs"] += 1
+            self.stats["syncs"] += 1
+            self.stats["synced_rows"] += synced
+            self.stats["removed"] += len(removed)
+        if removed and self.on_removed is not None:
+            try:
+                self.on_removed([key for (key,) in removed])
+            except Exception as ex:
+                print(f"[BookingsMirror] Ошибка обработки удалённых заявок: {ex}")
+        return len(rows)
+
+    def _remove_missing(self, started, pending):
+        # Заявки, записанные до начала сверки, но не найденные ни в таблице, ни в очереди
+        stale = [
+            (key,) for (key,) in self._db.execute(
+                "SELECT key FROM bookings WHERE sheet_row IS NULL AND recorded < ?", (started,)
+            )
+            if key not in pending
+        ]
+        self._db.executemany("DELETE FROM bookings WHERE key = ?", stale)
+        return stale
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="bookings-mirror", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        self.sync()
+        while not self._stop.wait(self.sync_interval):
+            self.sync()
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    # --- Запросы ---
+
+    def _select(self, where, params, order="starts", limit=MAX_LIMIT):
+        sql = f"SELECT {_COLUMNS} FROM bookings"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order} LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(sql, (*params, max(1, min(int(limit), MAX_LIMIT)))).fetchall()
+        return [dict(zip(("name", "phone", "service", "date", "master", "comment", "source", "created"), row))
+                for row in rows]
+
+    def query(self, start=None, end=None, master=None, phone=None, limit=100):
+        """
+        Заявки с началом в [start, end) (datetime), у мастера master и/или
+        с телефоном phone, по возрастанию времени записи.
+        """
+        where, params = [], []
+        if start is not None:
+            where.append("starts >= ?")
+            params.append(start.strftime(SORT_FORMAT))
+        if end is not None:
+            where.append("starts < ?")
+            params.append(end.strftime(SORT_FORMAT))
+        if master:
+            where.append("master_key = ?")
+            params.append(master_key(master))
+        if phone:
+            where.append("phone_tail = ?")
+            params.append(phone_tail(phone))
+        return self._select(where, params, limit=limit)
+
+    def find_phone(self, phone, limit=20):
+        """
+        Последние заявки с этим телефоном (новые первыми).
+        """
+        tail = phone_tail(phone)
+        if not tail:
+            return []
+        return self._select(["phone_tail = ?"], [tail], order="starts DESC", limit=limit)
+
+    def count(self, start=None, end=None):
+        where, params = [], []
+        if start is not None:
+            where.append("starts >= ?")
+            params.append(start.strftime(SORT_FORMAT))
+        if end is not None:
+            where.append("starts < ?")
+            params.append(end.strftime(SORT_FORMAT))
+        sql = "SELECT COUNT(*) FROM bookings" + (" WHERE " + " AND ".join(where) if where else "")
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()[0]
+
+    def top(self, column, start, end, limit=5):
+        """
+        Самые частые мастера или услуги (column: "master" / "service") за период.
+        """
+        if column not in ("master", "service"):
+            raise ValueError(column)
+        with self._lock:
+            return self._db.execute(
+                f"SELECT {column}, COUNT(*) AS n FROM bookings WHERE starts >= ? AND starts < ? "
+                f"GROUP BY {column} ORDER BY n DESC, {column} LIMIT ?",
+                (start.strftime(SORT_FORMAT), end.strftime(SORT_FORMAT), limit),
+            ).fetchall()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
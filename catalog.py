@@ -0,0 +1,255 @@
+"""
+Каталог салона: услуги, мастера и цены из отдельных листов Google Sheets.
+
+Листы читаются одним запросом values().batchGet в фоновом потоке по таймеру.
+Если содержимое листов не изменилось (совпал хэш), индексы не пересобираются.
+Обработчики читают только готовый снимок в памяти и никогда не ходят в сеть.
+Поиск нечёткий: точное имя/синоним, затем префикс, затем близость символьных
+триграмм (опечатки, падежи).
+
+Лист «Услуги»: Название | Категория | Цена | Длительность, мин | Синонимы (через запятую)
+Лист «Мастера»: Имя | Категория | Услуги (через запятую, пусто — все)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+from answer_cache import cosine, normalize, trigram_vector
+
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "1") == "1"
+CATALOG_SERVICES_RANGE = os.getenv("CATALOG_SERVICES_RANGE", "Услуги!A2:E")
+CATALOG_MASTERS_RANGE = os.getenv("CATALOG_MASTERS_RANGE", "Мастера!A2:C")
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "300"))
+# Минимальная близость триграмм для нечёткого совпадения
+CATALOG_MIN_SIMILARITY = float(os.getenv("CATALOG_MIN_SIMILARITY", "0.5"))
+DEFAULT_DURATION = 60
+
+Service = namedtuple("Service", "name category price duration aliases")
+Master = namedtuple("Master", "name category services")
+
+
+def _cell(row, index):
+    return str(row[index]).strip() if len(row) > index else ""
+
+
+def _split_list(value):
+    return tuple(part.strip() for part in str(value or "").split(",") if part.strip())
+
+
+def _to_number(value, default=None):
+    text = str(value or "").replace("₽", "").replace("руб", "").replace(" ", "").replace(" ", "")
+    text = text.replace(",", ".").rstrip(".")
+    try:
+        number = float(text)
+    except ValueError:
+        return default
+    return int(number) if number.is_integer() else number
+
+
+def parse_services(rows):
+    services = []
+    for row in rows:
+        name = _cell(row, 0)
+        if not name:
+            continue
+        services.append(Service(
+            name=name,
+            category=_cell(row, 1),
+            price=_to_number(_cell(row, 2)),
+            duration=_to_number(_cell(row, 3), DEFAULT_DURATION),
+            aliases=_split_list(_cell(row, 4)),
+        ))
+    return services
+
+
+def parse_masters(rows):
+    masters = []
+    for row in rows:
+        name = _cell(row, 0)
+        if not name:
+            continue
+        masters.append(Master(name=name, category=_cell(row, 1), services=_split_list(_cell(row, 2))))
+    return masters
+
+
+class _FuzzyIndex:
+    """
+    Нечёткий поиск по именам: точный ключ, префикс, затем триграммы
+    через инвертированный индекс (кандидаты без полного перебора).
+    """
+
+    def __init__(self, items, keys_of, min_similarity=CATALOG_MIN_SIMILARITY):
+        self.items = items
+        self.min_similarity = min_similarity
+        self._exact = {}
+        self._keys = []  # (normalized, item_id, vector)
+        self._grams = {}
+        for item_id, item in enumerate(items):
+            for key in keys_of(item):
+                norm = normalize(key)
+                if not norm:
+                    continue
+                self._exact.setdefault(norm, item_id)
+                key_id = len(self._keys)
+                vector = trigram_vector(norm)
+                self._keys.append((norm, item_id, vector))
+                for gram in vector:
+                    self._grams.setdefault(gram, []).append(key_id)
+
+    def find(self, text):
+        """
+        (item, score) лучшего совпадения или (None, 0.0).
+        """
+        norm = normalize(text or "")
+        if not norm:
+            return None, 0.0
+        item_id = self._exact.get(norm)
+        if item_id is not None:
+            return self.items[item_id], 1.0
+        prefixed = {item_id for key, item_id, _ in self._keys if key.startswith(norm) or norm.startswith(key)}
+        if len(prefixed) == 1:
+            return self.items[prefixed.pop()], 0.9
+        vector = trigram_vector(norm)
+        candidates = set()
+        for gram in vector:
+            candidates.update(self._grams.get(gram, ()))
+        best_id, best_score = None, self.min_similarity
+        for key_id in candidates:
+            _, item_id, other = self._keys[key_id]
+            score = cosine(vector, other)
+            if score >= best_score:
+                best_id, best_score = item_id, score
+        if best_id is None:
+            return None, 0.0
+        return self.items[best_id], best_score
+
+
+class Catalog:
+    """
+    Снимок каталога в памяти с фоновым обновлением из Google Sheets.
+
+    sheets — объект spreadsheets() из googleapiclient или FakeSheetsService.
+    """
+
+    def __init__(self, sheets, spreadsheet_id, services_range=CATALOG_SERVICES_RANGE,
+                 masters_range=CATALOG_MASTERS_RANGE, refresh_interval=CATALOG_REFRESH_INTERVAL):
+        self.sheets = sheets
+        self.spreadsheet_id = spreadsheet_id
+        self.services_range = services_range
+        self.masters_range = masters_range
+        self.refresh_interval = refresh_interval
+        self._digest = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.loaded_at = None
+        self.services = []
+        self.masters = []
+        self.categories = []
+        self._service_index = _FuzzyIndex([], lambda item: ())
+        self._master_index = _FuzzyIndex([], lambda item: ())
+        self.stats = {"refreshes": 0, "rebuilds": 0, "unchanged": 0, "errors": 0}
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    # --- Загрузка ---
+
+    def refresh(self):
+        """
+        Читает листы каталога. Индексы пересобираются, только если данные изменились.
+        Возвращает True, если снимок обновлён.
+        """
+        self.stats["refreshes"] += 1
+        try:
+            with metrics.timed("sheets.catalog_read"):
+                response = self.sheets.values().batchGet(
+                    spreadsheetId=self.spreadsheet_id,
+                    ranges=[self.services_range, self.masters_range],
+                ).execute()
+        except Exception as ex:
+            self.stats["errors"] += 1
+            print(f"[Catalog] Ошибка загрузки каталога из Google Sheets: {ex}")
+            return False
+        ranges = response.get("valueRanges", [])
+        services_rows = ranges[0].get("values", []) if len(ranges) > 0 else []
+        masters_rows = ranges[1].get("values", []) if len(ranges) > 1 else []
+        digest = hashlib.sha1(
+            json.dumps([services_rows, masters_rows], ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        self.loaded_at = time.time()
+        if digest == self._digest:
+            self.stats["unchanged"] += 1
+            return False
+        self.load(parse_services(services_rows), parse_masters(masters_rows))
+        self._digest = digest
+        return True
+
+    def load(self, services, masters):
+        """
+        Подменяет снимок целиком: читатели видят либо старый, либо новый каталог.
+        """
+        service_index = _FuzzyIndex(services, lambda item: (item.name,) + item.aliases)
+        master_index = _FuzzyIndex(masters, lambda item: (item.name,))
+        categories = sorted({master.category for master in masters if master.category})
+        self.services, self.masters, self.categories = services, masters, categories
+        self._service_index, self._master_index = service_index, master_index
+        self.loaded_at = time.time()
+        self.stats["rebuilds"] += 1
+        print(f"[Catalog] Каталог обновлён: услуг {len(services)}, мастеров {len(masters)}")
+
+    def start(self):
+        """
+        Фоновый поток: первая загрузка и обновление раз в refresh_interval.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="catalog-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+
+    def _run(self):
+        self.refresh()
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    # --- Поиск ---
+
+    def find_service(self, text):
+        return self._service_index.find(text)[0]
+
+    def find_master(self, text):
+        return self._master_index.find(text)[0]
+
+    def find_category(self, text):
+        norm = normalize(text or "")
+        for category in self.categories:
+            if normalize(category) == norm:
+                return category
+        return None
+
+    def masters_for(self, service_name, category=None):
+        """
+        Мастера, выполняющие услугу (и, если задано, нужной категории).
+        """
+        result = []
+        for master in self.masters:
+            if category and master.category != category:
+                continue
+            if master.services and not any(normalize(s) == normalize(service_name) for s in master.services):
+                continue
+            result.append(master)
+        return result
+
+    def service_names(self):
+        return [service.name for service in self.services]
@@ -0,0 +1,204 @@
+"""
+Пул потоков для блокирующих вызовов из асинхронного кода.
+
+Google Sheets (googleapiclient), requests и SQLite блокируют поток, поэтому
+обработчики бота и веб-API вызывают их через run_blocking(): вызов уходит
+в ограниченный пул, у каждого вызова есть таймаут, а очередь ограничена —
+при перегрузке новые вызовы ждут свободного места (не дольше таймаута),
+а не копятся без предела. Event loop при этом продолжает обслуживать
+остальные обновления.
+
+Таймаут прерывает ожидание, но не сам поток: вызов доработает в фоне.
+Поэтому операции, которые могут повториться после таймаута (запись заявки),
+защищены ключами идемпотентности.
+
+Пул общий для всех салонов (tenants), но при нескольких салонах один салон
+занимает не больше EXECUTOR_TENANT_SHARE мест пула и очереди: медленная
+таблица одного салона не оставляет остальных без потоков.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tenants
+
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "16"))
+# Сколько вызовов может ждать свободного потока сверх EXECUTOR_WORKERS
+EXECUTOR_QUEUE_SIZE = int(os.getenv("EXECUTOR_QUEUE_SIZE", "64"))
+EXECUTOR_TIMEOUT = float(os.getenv("EXECUTOR_TIMEOUT", "30"))
+# Доля мест пула и очереди, которую может занять один салон (при нескольких салонах)
+EXECUTOR_TENANT_SHARE = float(os.getenv("EXECUTOR_TENANT_SHARE", "0.5"))
+
+
+class ExecutorBusy(RuntimeError):
+    """
+    Пул и очередь заполнены дольше таймаута вызова.
+    """
+
+
+class BlockingExecutor:
+    """
+    Ограниченный пул потоков с таймаутами и метриками очереди.
+    """
+
+    def __init__(self, workers=EXECUTOR_WORKERS, queue_size=EXECUTOR_QUEUE_SIZE, timeout=EXECUTOR_TIMEOUT,
+                 tenant_share=EXECUTOR_TENANT_SHARE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blocking")
+        # Места в пуле и очереди; общий для всех event loop семафор потоков
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        # Сколько мест занимает каждый салон и сколько ему можно
+        self.tenant_limit = max(1, int((workers + queue_size) * tenant_share))
+        self.tenant_slots = {}
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.stats = {
+            "submitted": 0, "completed": 0, "errors": 0, "timeouts": 0, "rejected": 0,
+            "max_queued": 0, "wait_total": 0.0, "run_total": 0.0,
+        }
+        # Время выполнения по именам вызовов: name -> {"count", "total", "max"}
+        self.calls = {}
+
+    def _acquire(self):
+        """
+        Занимает место в пуле: (True, ключ салона или None) или (False, None).
+        """
+        key = tenants.current().key if tenants.is_multi() else None
+        if key is not None:
+            with self._lock:
+                if self.tenant_slots.get(key, 0) >= self.tenant_limit:
+                    return False, None
+                self.tenant_slots[key] = self.tenant_slots.get(key, 0) + 1
+        if self._slots.acquire(blocking=False):
+            return True, key
+        self._release_tenant(key)
+        return False, None
+
+    def _release_tenant(self, key):
+        if key is not None:
+            with self._lock:
+                self.tenant_slots[key] -= 1
+
+    def _wrap(self, func, args, kwargs, name, enqueued, tenant_key):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.stats["wait_total"] += started - enqueued
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self.active -= 1
+                self.stats["completed" if ok else "errors"] += 1
+                self.stats["run_total"] += seconds
+                metric = self.calls.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+                metric["count"] += 1
+                metric["total"] += seconds
+                metric["max"] = max(metric["max"], seconds)
+            self._release_tenant(tenant_key)
+            self._slots.release()
+
+    def _submit(self, func, args, kwargs, name, tenant_key):
+        with self._lock:
+            self.queued += 1
+            self.stats["submitted"] += 1
+            self.stats["max_queued"] = max(self.stats["max_queued"], self.queued)
+        # Контекст (текущий span трассы) переходит в поток вместе с вызовом
+        context = contextvars.copy_context()
+        return self._pool.submit(context.run, self._wrap, func, args, kwargs, name, time.perf_counter(), tenant_key)
+
+    async def run(self, func, *args, timeout=None, name=None, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) в пуле и ждёт результат не дольше timeout.
+        asyncio.TimeoutError — вызов не уложился; ExecutorBusy — нет места в очереди
+        (или салон уже занял свою долю пула).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        name = name or getattr(func, "__name__", "call")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        acquired, tenant_key = self._acquire()
+        if not acquired:
+            # Очередь заполнена: ждём место, не блокируя event loop
+            while loop.time() < deadline:
+                await asyncio.sleep(0.01)
+                acquired, tenant_key = self._acquire()
+                if acquired:
+                    break
+            if not acquired:
+                with self._lock:
+                    self.stats["rejected"] += 1
+                raise ExecutorBusy(f"Нет свободных потоков для {name}")
+        future = self._submit(func, args, kwargs, name, tenant_key)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.stats["timeouts"] += 1
+            print(f"[Executor] {name} не завершился за {timeout:.1f} c")
+            raise
+
+    def submit(self, func, *args, name=None, **kwargs):
+        """
+        Фоновый вызов без ожидания результата (из синхронного кода).
+        Возвращает concurrent.futures.Future или None, если очередь заполнена.
+        """
+        name = name or getattr(func, "__name__", "call")
+        acquired, tenant_key = self._acquire()
+        if not acquired:
+            with self._lock:
+                self.stats["rejected"] += 1
+            print(f"[Executor] Очередь заполнена, вызов {name} отброшен")
+            return None
+        return self._submit(func, args, kwargs, name, tenant_key)
+
+    def snapshot(self):
+        """
+        Текущие метрики: глубина очереди, активные потоки, счётчики и время по вызовам.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "active": self.active,
+                "queued": self.queued,
+                **self.stats,
+                "tenants": dict(self.tenant_slots),
+                "calls": {name: dict(values) for name, values in self.calls.items()},
+            }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Общий на процесс пул для блокирующих вызовов.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = BlockingExecutor()
+        return _executor
+
+
+async def run_blocking(func, *args, timeout=None, name=None, **kwargs):
+    """
+    Короткая форма get_executor().run(...).
+    """
+    return await get_executor().run(func, *args, timeout=timeout, name=name, **kwargs)
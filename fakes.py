@@ -0,0 +1,180 @@
+"""
+Локальные заменители внешних сервисов для офлайн-проверок и разработки
+без доступа к Google API.
+"""
+import re
+import threading
+import time
+
+# Номера строк в диапазоне A1: "Лист!A2:H1001", "A2:H", "A5"
+_ROWS_RE = re.compile(r"^[A-Z]+(\d*)(?::[A-Z]+(\d*))?$")
+
+
+class FakeHttpError(Exception):
+    """
+    Ошибка в стиле googleapiclient.errors.HttpError: статус доступен как resp.status.
+    """
+
+    class _Resp:
+        def __init__(self, status):
+            self.status = status
+
+    def __init__(self, status, message=""):
+        super().__init__(f"<HttpError {status}: {message}>")
+        self.resp = self._Resp(status)
+
+
+class _FakeRequest:
+    def __init__(self, func):
+        self._func = func
+
+    def execute(self, num_retries=0):
+        return self._func()
+
+
+class _FakeValues:
+    def __init__(self, service):
+        self._service = service
+
+    def append(self, spreadsheetId, range, body, valueInputOption=None, insertDataOption=None):
+        return _FakeRequest(lambda: self._service._append(spreadsheetId, range, body))
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return _FakeRequest(lambda: self._service._get(spreadsheetId, range))
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return _FakeRequest(lambda: {
+            "spreadsheetId": spreadsheetId,
+            "valueRanges": [self._service._get(spreadsheetId, range_) for range_ in ranges],
+        })
+
+
+class FakeSheetsService:
+    """
+    Заменитель service.spreadsheets() из googleapiclient.
+
+    Хранит строки в памяти по листам; latency имитирует задержку сети,
+    fail_times/fail_status — серию ошибок перед успешной записью.
+    """
+
+    def __init__(self, latency=0.0, fail_times=0, fail_status=429):
+        self.latency = latency
+        self.fail_times = fail_times
+        self.fail_status = fail_status
+        self.tables = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return _FakeValues(self)
+
+    @staticmethod
+    def _sheet_name(range_):
+        return range_.split("!", 1)[0] if "!" in range_ else ""
+
+    @staticmethod
+    def _row_slice(range_):
+        # Первая строка листа — заголовок, в tables хранятся строки начиная со второй
+        match = _ROWS_RE.match(range_.split("!", 1)[-1])
+        if match is None:
+            return slice(None)
+        start, end = match.group(1), match.group(2)
+        return slice(max(int(start) - 2, 0) if start else 0, int(end) - 1 if end else None)
+
+    def _append(self, spreadsheet_id, range_, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append(("append", range_, len(body.get("values", []))))
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise FakeHttpError(self.fail_status, "fake failure")
+            rows = self.tables.setdefault(self._sheet_name(range_), [])
+            start = len(rows) + 2
+            rows.extend(list(row) for row in body.get("values", []))
+            name = self._sheet_name(range_) or "Sheet1"
+            return {
+                "spreadsheetId": spreadsheet_id,
+                "updates": {
+                    "updatedRange": f"{name}!A{start}:H{len(rows) + 1}",
+                    "updatedRows": len(body.get("values", [])),
+                },
+            }
+
+    def _get(self, spreadsheet_id, range_):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append(("get", range_, 0))
+            rows = self.tables.get(self._sheet_name(range_), [])[self._row_slice(range_)]
+            return {"range": range_, "values": [list(row) for row in rows]}
+
+    @property
+    def rows(self):
+        """
+        Строки листа по умолчанию (диапазон без имени листа).
+        """
+        return self.tables.get("", [])
+
+
+class FakeRedis:
+    """
+    Заменитель redis.Redis в памяти: get/set(ex)/delete/pipeline/scan_iter.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, name):
+        value = self.data.get(name)
+        if value is None:
+            return None
+        raw, expires = value
+        if expires is not None and expires <= time.time():
+            del self.data[name]
+            return None
+        return raw
+
+    def get(self, name):
+        with self._lock:
+            return self._alive(name)
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self.data[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+    def scan_iter(self, match="*"):
+        prefix = match.rstrip("*")
+        with self._lock:
+            keys = [name for name in list(self.data) if name.startswith(prefix) and self._alive(name) is not None]
+        return iter(keys)
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._ops = []
+
+    def set(self, name, value, ex=None):
+        self._ops.append((self._redis.set, (name, value), {"ex": ex}))
+        return self
+
+    def delete(self, *names):
+        self._ops.append((self._redis.delete, names, {}))
+        return self
+
+    def execute(self):
+        ops, self._ops = self._ops, []
+        return [func(*args, **kwargs) for func, args, kwargs in ops]
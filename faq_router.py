@@ -0,0 +1,195 @@
+"""
+Локальные ответы на частые вопросы без обращения к OpenAI.
+
+При старте база знаний llm_instructions/Knowledge.txt (список пар
+"Вопросы"/"Ответы") превращается в инвертированный TF-IDF индекс по
+основам слов. Вопрос клиента сопоставляется с индексом за доли
+миллисекунды; если совпадение уверенное, ответ отдаётся сразу, иначе
+вопрос уходит ассистенту. При изменении файла индекс пересобирается.
+У каждого салона (tenants) свой индекс по Knowledge.txt из его папки базы знаний.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+
+import tenants
+from answer_cache import BOOKING_RE
+
+FAQ_ROUTER_ENABLED = os.getenv("FAQ_ROUTER_ENABLED", "1") == "1"
+# Минимальная косинусная близость и отрыв от второго кандидата для прямого ответа
+FAQ_MIN_SCORE = float(os.getenv("FAQ_MIN_SCORE", "0.6"))
+FAQ_MIN_MARGIN = float(os.getenv("FAQ_MIN_MARGIN", "0.1"))
+# Вклад текста ответа в вектор статьи (вопрос важнее)
+ANSWER_WEIGHT = 0.3
+RELOAD_CHECK_INTERVAL = 5.0
+
+KNOWLEDGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_instructions", "Knowledge.txt")
+
+STOP_WORDS = frozenset(
+    "а и в во на с со к ко о об от до по за из у для при ли же бы ну не "
+    "что как какой какая какие каков какова каковы где когда можно могу ли "
+    "я мы вы ты вас вам ваш ваша ваше ваши вашем вашей нас нам мне меня "
+    "это этот эта есть ли пожалуйста подскажите скажите здравствуйте".split()
+)
+# Окончания, отбрасываемые при получении основы (от длинных к коротким)
+ENDINGS = (
+    "иями", "ями", "ами", "ией", "ого", "его", "ему", "ому", "ыми", "ими", "ться", "тся",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ой", "ей", "ий", "ый", "ов", "ев", "ах", "ях",
+    "ам", "ям", "ом", "ем", "ую", "юю", "ть", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+)
+STEM_LENGTH = 5
+# Синонимы на уровне основ: разные слова одного намерения
+SYNONYMS = {
+    "стоит": "цен", "стоимо": "цен", "цен": "цен", "прайс": "цен", "почем": "цен",
+    "открыв": "работ", "закрыв": "работ", "работ": "работ", "график": "работ",
+    "наход": "адрес", "адрес": "адрес", "располож": "адрес",
+}
+_WORD_RE = re.compile(r"[а-яёa-z0-9]+")
+
+
+def stem(word):
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            word = word[:-len(ending)]
+            break
+    word = word[:STEM_LENGTH]
+    for prefix, canonical in SYNONYMS.items():
+        if word.startswith(prefix):
+            return canonical
+    return word
+
+
+def tokenize(text):
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return [stem(word) for word in words if word not in STOP_WORDS]
+
+
+def _term_counts(tokens, weight=1.0):
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0.0) + weight
+    return counts
+
+
+class FaqRouter:
+    """
+    TF-IDF индекс по статьям базы знаний с инвертированными списками.
+    """
+
+    def __init__(self, path=KNOWLEDGE_PATH, min_score=FAQ_MIN_SCORE, min_margin=FAQ_MIN_MARGIN):
+        self.path = path
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.entries = []
+        self._postings = {}
+        self._idf = {}
+        self.stats = {"answered": 0, "fallback": 0, "skipped": 0, "reloads": 0}
+        self.reload()
+
+    def reload(self):
+        """
+        Перечитывает базу знаний и пересобирает индекс.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+        except (OSError, ValueError) as ex:
+            print(f"[FAQ] Не удалось загрузить базу знаний {self.path}: {ex}")
+            return False
+        entries = [
+            (item.get("Вопросы", ""), item.get("Ответы", ""))
+            for item in items if item.get("Вопросы") and item.get("Ответы")
+        ]
+        doc_terms = []
+        for question, answer in entries:
+            counts = _term_counts(tokenize(question))
+            for token, value in _term_counts(tokenize(answer), ANSWER_WEIGHT).items():
+                counts[token] = counts.get(token, 0.0) + value
+            doc_terms.append(counts)
+        df = {}
+        for counts in doc_terms:
+            for token in counts:
+                df[token] = df.get(token, 0) + 1
+        total = len(doc_terms)
+        idf = {token: math.log((1 + total) / (1 + count)) + 1.0 for token, count in df.items()}
+        postings = {}
+        for doc_id, counts in enumerate(doc_terms):
+            weights = {token: value * idf[token] for token, value in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for token, w in weights.items():
+                postings.setdefault(token, []).append((doc_id, w / norm))
+        with self._lock:
+            self.entries = entries
+            self._idf = idf
+            self._postings = postings
+            self._mtime = mtime
+        self.stats["reloads"] += 1
+        return True
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._mtime:
+            print("[FAQ] База знаний изменилась — индекс пересобран")
+            self.reload()
+
+    def search(self, text, limit=2):
+        """
+        Лучшие статьи: [(score, question, answer)] по убыванию близости.
+        """
+        counts = _term_counts(tokenize(text))
+        with self._lock:
+            idf, postings, entries = self._idf, self._postings, self.entries
+        weights = {token: value * idf[token] for token, value in counts.items() if token in idf}
+        norm = math.sqrt(sum(w * w for w in weights.values()))
+        if not norm:
+            return []
+        scores = {}
+        for token, w in weights.items():
+            for doc_id, doc_w in postings[token]:
+                scores[doc_id] = scores.get(doc_id, 0.0) + w * doc_w
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(score / norm, entries[doc_id][0], entries[doc_id][1]) for doc_id, score in best]
+
+    def answer(self, text):
+        """
+        Ответ из базы знаний, если совпадение уверенное, иначе None.
+        """
+        if not text or BOOKING_RE.search(text):
+            self.stats["skipped"] += 1
+            return None
+        self._maybe_reload()
+        found = self.search(text)
+        if found:
+            score = found[0][0]
+            runner_up = found[1][0] if len(found) > 1 else 0.0
+            if score >= self.min_score and score - runner_up >= self.min_margin:
+                self.stats["answered"] += 1
+                return found[0][2]
+        self.stats["fallback"] += 1
+        return None
+
+
+_routers = tenants.PerTenant(lambda tenant: FaqRouter(tenant.knowledge_path))
+
+
+def get_faq_router(tenant=None):
+    """
+    FAQ-роутер салона (по умолчанию текущего); None, если выключен через FAQ_ROUTER_ENABLED=0.
+    """
+    if not FAQ_ROUTER_ENABLED:
+        return None
+    return _routers.get(tenant)
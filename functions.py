@@ -1,93 +1,130 @@
 import os
-import json
-import pytz
+import asyncio
+import atexit
 from datetime import datetime
 from dotenv import load_dotenv
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import requests
-import time
+import metrics
+from assistant_client import AssistantClient
+from booking import Booking, local_now, parse_booking, parse_booking_datetime
+import availability
+import bookings_mirror
+import catalog
+import reminders
+import tenants
+from sheets_queue import SHEETS_QUEUE_PATH, BookingQueue
+from idempotency import BUSY, DONE, get_idempotency_index
+from sheets_client import SheetsClientPool
+import integrations
+from integrations import IntegrationUnavailable
 
 # Загрузка переменных из .env
 load_dotenv()
 
-# Переменные окружения
+# Переменные окружения основного салона (остальные салоны — в реестре tenants)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID")
 GOOGLE_SERVICE_ACCOUNT_EMAIL = os.getenv("GOOGLE_SERVICE_ACCOUNT_EMAIL")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
-TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
+# Отложенная запись заявок в Google Sheets через локальную очередь
+SHEETS_WRITE_BEHIND = os.getenv("SHEETS_WRITE_BEHIND", "1") == "1"
 
-# Проверка наличия credentials.json
+# Google Sheets: credentials.json читается при первом обращении, а не при импорте
 CREDENTIALS_PATH = os.path.join(os.path.dirname(__file__), 'credentials.json')
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-if not os.path.exists(CREDENTIALS_PATH):
-    raise FileNotFoundError(f"credentials.json отсутствует по пути: {CREDENTIALS_PATH}")
+# google — настоящая таблица, fake — таблица в памяти (fakes.FakeSheetsService) для разработки
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google")
 
-credentials = service_account.Credentials.from_service_account_file(
-    CREDENTIALS_PATH,
-    scopes=SCOPES,
-)
-service = build('sheets', 'v4', credentials=credentials)
-sheet = service.spreadsheets()
+def _build_sheets():
+    if SHEETS_BACKEND == "fake":
+        from fakes import FakeSheetsService
+        return FakeSheetsService()
+    if not os.path.exists(CREDENTIALS_PATH):
+        raise IntegrationUnavailable(f"credentials.json отсутствует по пути: {CREDENTIALS_PATH}")
+    # Отдельный клиент Sheets на каждый поток с общим токеном сервисного аккаунта
+    return SheetsClientPool.from_service_account_file(CREDENTIALS_PATH, SCOPES).warm_up()
+
+# Фабрики интеграций салона вызываются в его контексте (tenants.current());
+# колбэки фоновых потоков привязываются к салону через Tenant.bind
+
+def _build_booking_queue():
+    tenant = tenants.current()
+    queue = BookingQueue(get_sheets(), tenant.sheet_id, tenant.path(SHEETS_QUEUE_PATH)).start()
+    atexit.register(queue.stop)
+    return queue
+
+def _build_catalog():
+    if not catalog.CATALOG_ENABLED:
+        return None
+    return catalog.Catalog(get_sheets(), tenants.current().sheet_id).start()
+
+def _build_availability():
+    if not availability.AVAILABILITY_ENABLED:
+        return None
+    tenant = tenants.current()
+    return availability.AvailabilityIndex(
+        tenant.bind(_booking_rows), tenant.bind(_service_duration), tenant.bind(_master_groups)
+    ).start()
+
+def _build_bookings_mirror():
+    if not bookings_mirror.BOOKINGS_MIRROR_ENABLED:
+        return None
+    tenant = tenants.current()
+    return bookings_mirror.BookingMirror(
+        tenant.bind(_read_booking_range), tenant.bind(_pending_booking_rows), tenant.bind(_cancel_reminders),
+        path=tenant.path(bookings_mirror.BOOKINGS_MIRROR_PATH),
+    ).start()
+
+def get_sheets():
+    """
+    Ресурс spreadsheets() Google Sheets (создаётся при первом обращении, общий для всех салонов).
+    """
+    return integrations.get("sheets")
+
+def _tenant_integration(name):
+    # Очередь, каталог, расписание и копия заявок — свои у каждого салона
+    return integrations.get(tenants.current().scoped(name))
+
+def _optional(name):
+    # Необязательная интеграция: без Sheets проверки по каталогу и расписанию пропускаются
+    try:
+        return _tenant_integration(name)
+    except IntegrationUnavailable:
+        return None
 
 def normalize_booking_datetime(value):
     """
     Приводит дату/время к формату ДД.ММ.ГГГГ ЧЧ:ММ и проверяет, что дата в будущем.
+    Понимает и «завтра в 15», ISO и ДД.ММ ЧЧ:ММ (см. booking.parse_moment).
     Возвращает (True, normalized_str) или (False, error_message).
     """
-    if not value:
-        return False, "Не заполнено обязательное поле: date/datetime"
-    try:
-        tz = pytz.timezone(TIMEZONE)
-        parsed_naive = datetime.strptime(value.strip(), "%d.%m.%Y %H:%M")
-        parsed_dt = tz.localize(parsed_naive)
-    except ValueError:
-        return False, "Дата должна быть в формате ДД.ММ.ГГГГ ЧЧ:ММ (например, 05.05.2025 14:30)"
-    now = datetime.now(tz)
-    if parsed_dt < now:
-        return False, "Укажите дату и время в будущем."
-    normalized = parsed_dt.strftime("%d.%m.%Y %H:%M")
-    return True, normalized
+    return parse_booking_datetime(value)
 
 
-def validate_booking_data(data):
+def parse_booking_data(data):
     """
-    Проверяет наличие обязательных полей для заявки и синхронизирует названия
-    между разными источниками (сайт, Telegram-бот, OpenAI tools).
-    Возвращает (is_valid, error_message)
+    Проверяет и нормализует заявку из любого источника (сайт, Telegram-бот, OpenAI tools):
+    телефон в E.164, дата, услуга и мастер по каталогу из Google Sheets (если он загружен).
+    Возвращает (Booking, "") или (None, error_message); data не меняется.
     """
-    if not isinstance(data, dict):
-        return False, "Некорректные данные заявки."
+    return parse_booking(data, get_catalog())
 
-    # Общие обязательные поля
-    for field in ['name', 'phone', 'service']:
-        if not data.get(field):
-            return False, f"Не заполнено обязательное поле: {field}"
 
-    # Дата/время: допускаем как date, так и datetime
-    date_value = data.get('date') or data.get('datetime')
-    ok, normalized_date = normalize_booking_datetime(date_value)
-    if not ok:
-        return False, normalized_date
-    data.setdefault('date', normalized_date)
-    data.setdefault('datetime', normalized_date)
-
-    # Мастер может приходить как master или master_category — поле не обязательное,
-    # но синхронизируем названия, чтобы таблица получала master.
-    master_value = data.get('master') or data.get('master_category') or ""
-    data.setdefault('master', master_value)
-    data.setdefault('master_category', master_value)
-
-    return True, ""
+def validate_booking_data(data):
+    """
+    Возвращает (is_valid, error_message). Нормализованную заявку отдаёт parse_booking_data.
+    """
+    booking, err = parse_booking_data(data)
+    return booking is not None, err
 
-def save_booking_data(name, phone, service, datetime, master_category, comments=None):
+def save_booking_data(name, phone, service, datetime, master_category, comments=None, tool_call_id=None):
     """
     Функция для OpenAI Function Calling и прямого вызова: сохраняет запись в Google Sheets.
     Аргументы строго по схеме ассистента!
     comments может быть пропущенным.
+    tool_call_id передаёт агентский цикл: повторный вызов с тем же id не создаёт дубль.
     """
     data = {
         "name": name,
@@ -98,15 +135,17 @@ def save_booking_data(name, phone, service, datetime, master_category, comments=
         "comment": comments if comments is not None else "",
         "source": "OpenAI Assistant"
     }
-    # Используем add_booking_to_sheet внутри
-    return add_booking_to_sheet(data)
+    # Те же правила, что у сайта и бота: ассистент получит текст ошибки и переспросит клиента
+    booking, err = parse_booking_data(data)
+    if booking is None:
+        return {"success": False, "data": None, "error": err}
+    return add_booking_to_sheet(booking, f"tool:{tool_call_id}" if tool_call_id else None)
 
-def add_booking_to_sheet(data):
+def build_booking_row(data):
     """
-    Добавляет заявку в Google Таблицу. Возвращает dict:
-    {"success": True/False, "data":..., "error": ...}
+    Строка таблицы для заявки (порядок колонок как в Google Sheets).
     """
-    row = [
+    return [
         data.get('name', ''),
         data.get('phone', ''),
         data.get('service', ''),
@@ -114,36 +153,239 @@ def add_booking_to_sheet(data):
         data.get('master', ''),
         data.get('comment', ''),
         data.get('source', ''),
-        datetime.now(pytz.timezone(TIMEZONE)).strftime('%Y-%m-%d %H:%M'),
+        local_now().strftime('%Y-%m-%d %H:%M'),
     ]
+
+def get_booking_queue():
+    """
+    Очередь отложенной записи в Google Sheets текущего салона; фоновый поток запускается при первом обращении.
+    """
+    return _tenant_integration("booking_queue")
+
+def add_booking_to_sheet(data, idempotency_key=None, chat_id=None):
+    """
+    Добавляет заявку в Google Таблицу. Возвращает dict:
+    {"success": True/False, "data":..., "error": ...}
+    При SHEETS_WRITE_BEHIND заявка сохраняется в локальную очередь и записывается
+    в таблицу фоновым потоком пачками; data = {"queued": id}.
+    Перед записью время мастера проверяется по индексу занятости (reserve_slot).
+    Повтор с тем же idempotency_key возвращает исходный результат
+    с "duplicate": True и ничего не записывает.
+    data — словарь заявки или booking.Booking; chat_id — чат клиента в Telegram
+    для напоминаний о записи (без него напоминание получит администратор).
+    Заявка пишется в таблицу текущего салона (tenants.current()).
+    """
+    if isinstance(data, Booking):
+        data = data.as_dict()
+    if not idempotency_key:
+        return _append_booking(data, chat_id)
+    # Индекс общий, а update_id и Idempotency-Key уникальны только в пределах салона
+    idempotency_key = tenants.current().scoped(idempotency_key)
+    index = get_idempotency_index()
+    status, previous = index.claim(idempotency_key)
+    if status == DONE:
+        return dict(previous, duplicate=True)
+    if status == BUSY:
+        return {"success": False, "data": None, "error": "Эта заявка уже обрабатывается", "duplicate": True}
+    try:
+        result = _append_booking(data, chat_id)
+    except Exception:
+        index.release(idempotency_key)
+        raise
+    if result["success"]:
+        index.complete(idempotency_key, result)
+    else:
+        index.release(idempotency_key)
+    return result
+
+def _append_booking(data, chat_id=None):
+    ok, error, reservation = reserve_slot(data)
+    if not ok:
+        return {"success": False, "data": None, "error": error}
+    row = build_booking_row(data)
+    if SHEETS_WRITE_BEHIND:
+        try:
+            with metrics.timed("sheets.enqueue"):
+                queued_id = get_booking_queue().enqueue(row)
+            _after_booking(row, data, chat_id)
+            return {"success": True, "data": {"queued": queued_id}, "error": None}
+        except Exception as ex:
+            release_slot(reservation)
+            print(f"[GoogleSheets] Ошибка постановки заявки в очередь: {ex}")
+            return {"success": False, "data": None, "error": str(ex)}
     body = {'values': [row]}
     try:
-        result = sheet.values().append(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range="A2",
-            valueInputOption="USER_ENTERED",
-            insertDataOption="INSERT_ROWS",
-            body=body
-        ).execute()
+        with metrics.timed("sheets.append", rows=1):
+            result = get_sheets().values().append(
+                spreadsheetId=tenants.current().sheet_id,
+                range="A2",
+                valueInputOption="USER_ENTERED",
+                insertDataOption="INSERT_ROWS",
+                body=body
+            ).execute()
+        _after_booking(row, data, chat_id)
         return {"success": True, "data": result, "error": None}
     except Exception as ex:
+        release_slot(reservation)
         print(f"[GoogleSheets] Ошибка при добавлении заявки: {ex}")
         return {"success": False, "data": None, "error": str(ex)}
 
+def _after_booking(row, data, chat_id):
+    # Копия заявок и напоминания вспомогательные: их ошибка не отменяет принятую заявку
+    try:
+        mirror = get_bookings_mirror()
+        if mirror is not None:
+            mirror.record(row)
+    except Exception as ex:
+        print(f"[BookingsMirror] Ошибка записи заявки в локальную копию: {ex}")
+    try:
+        queue = reminders.get_reminders()
+        if queue is not None:
+            queue.schedule(bookings_mirror.row_key(row), data, chat_id)
+    except Exception as ex:
+        print(f"[Reminders] Ошибка постановки напоминаний: {ex}")
+
+def _cancel_reminders(booking_keys):
+    # Заявку удалили из таблицы — напоминать о ней не нужно
+    queue = reminders.get_reminders()
+    if queue is not None and queue.cancel(booking_keys):
+        print(f"[Reminders] Отменены напоминания по {len(booking_keys)} удалённым заявкам")
+
+def _read_booking_range(range_):
+    with metrics.timed("sheets.read", range=range_):
+        result = get_sheets().values().get(spreadsheetId=tenants.current().sheet_id, range=range_).execute()
+    return result.get("values", [])
+
+def _pending_booking_rows():
+    return get_booking_queue().pending_rows() if SHEETS_WRITE_BEHIND else []
+
+def get_bookings_mirror():
+    """
+    Локальная копия таблицы заявок (SQLite) для /today, /stats, /find и /api/bookings.
+    None, если выключена через BOOKINGS_MIRROR_ENABLED=0.
+    """
+    if not bookings_mirror.BOOKINGS_MIRROR_ENABLED:
+        return None
+    return _optional("bookings_mirror")
+
+def _booking_rows():
+    """
+    Все заявки для индекса занятости: строки таблицы и ещё не записанные строки очереди.
+    """
+    with metrics.timed("sheets.read"):
+        result = get_sheets().values().get(
+            spreadsheetId=tenants.current().sheet_id, range=availability.AVAILABILITY_RANGE
+        ).execute()
+    rows = result.get("values", [])
+    if SHEETS_WRITE_BEHIND:
+        rows += get_booking_queue().pending_rows()
+    return rows
+
+def _service_duration(service):
+    salon = get_catalog()
+    found = salon.find_service(service) if salon is not None and service else None
+    return found.duration if found else availability.DEFAULT_DURATION
+
+def _master_groups(master):
+    # Мастер — одно место; категория — по числу её мастеров; салон («любой мастер») — по числу всех мастеров
+    salon = get_catalog()
+    if salon is None or not salon.masters:
+        return [(availability.master_key(master), 1)]
+    everyone = ("", len(salon.masters))
+    if not master:
+        return [everyone]
+    category = salon.find_category(master)
+    if category:
+        size = sum(1 for m in salon.masters if m.category == category)
+        return [(availability.master_key(category), max(1, size)), everyone]
+    found = salon.find_master(master)
+    if found is None:
+        return [(availability.master_key(master), 1), everyone]
+    groups = [(availability.master_key(found.name), 1)]
+    if found.category:
+        size = sum(1 for m in salon.masters if m.category == found.category)
+        groups.append((availability.master_key(found.category), max(1, size)))
+    return groups + [everyone]
+
+def get_availability():
+    """
+    Индекс занятости мастеров (строится в фоне из таблицы заявок).
+    None, если выключен через AVAILABILITY_ENABLED=0.
+    """
+    if not availability.AVAILABILITY_ENABLED:
+        return None
+    return _optional("availability")
+
+def find_free_slots(master=None, service=None, after=None, count=5):
+    """
+    Ближайшие свободные слоты в формате ДД.ММ.ГГГГ ЧЧ:ММ (пустой список, если индекс ещё не готов).
+    """
+    slots = get_availability()
+    if slots is None or not slots.loaded:
+        return []
+    if after is None:
+        after = local_now()
+    return [availability.format_slot(moment) for moment in slots.free_slots(master, service, after, count)]
+
+def reserve_slot(data):
+    """
+    Проверяет, что мастер свободен в выбранное время, и занимает интервал.
+    Возвращает (ok, error, reservation). Если индекс ещё не загружен или дата
+    не распознана, проверка пропускается.
+    """
+    slots = get_availability()
+    moment = availability.parse_datetime(data.get('date') or data.get('datetime') or "")
+    if slots is None or not slots.loaded or moment is None:
+        return True, "", None
+    master = data.get('master') or data.get('master_category') or ""
+    service = data.get('service', '')
+    ok, reservation = slots.reserve(master, service, moment)
+    if not ok:
+        return False, (
+            "Это время уже занято. "
+            f"Ближайшее свободное время: {', '.join(find_free_slots(master, service, moment))}"
+        ), None
+    return True, "", reservation
+
+def release_slot(reservation):
+    slots = get_availability()
+    if slots is not None:
+        slots.release(reservation)
+
+def get_free_slots(service=None, master_category=None, date=None, count=5):
+    """
+    Функция для OpenAI Function Calling: ближайшие свободные даты и время записи.
+    date — день ДД.ММ.ГГГГ, с которого искать (по умолчанию — сейчас).
+    """
+    after = None
+    if date:
+        try:
+            after = datetime.strptime(date.strip()[:10], "%d.%m.%Y")
+        except ValueError:
+            return {"success": False, "data": None, "error": "Дата должна быть в формате ДД.ММ.ГГГГ"}
+        after = max(after, local_now())
+    slots = find_free_slots(master_category, service, after, max(1, min(int(count), 20)))
+    if not slots and (get_availability() is None or not get_availability().loaded):
+        return {"success": False, "data": None, "error": "Расписание недоступно"}
+    return {"success": True, "data": slots, "error": None}
+
 def send_telegram_notification(text):
     """
-    Отправляет уведомление в служебный Telegram-чат. Всегда возвращает dict с ключами success/error.
+    Отправляет уведомление в служебный Telegram-чат текущего салона.
+    Всегда возвращает dict с ключами success/error.
     """
-    if not TELEGRAM_BOT_TOKEN or not ADMIN_CHAT_ID:
+    tenant = tenants.current()
+    if not tenant.bot_token or not tenant.admin_chat_id:
         return {"success": False, "error": "TELEGRAM_BOT_TOKEN или ADMIN_CHAT_ID не задан"}
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    print(f"[Telegram][debug] chat_id={ADMIN_CHAT_ID}")
+    url = f"https://api.telegram.org/bot{tenant.bot_token}/sendMessage"
+    print(f"[Telegram][debug] chat_id={tenant.admin_chat_id}")
     payload = {
-        'chat_id': ADMIN_CHAT_ID,
+        'chat_id': tenant.admin_chat_id,
         'text': text,
     }
     try:
-        resp = requests.post(url, data=payload, timeout=10)
+        with metrics.timed("notification.send"):
+            resp = requests.post(url, data=payload, timeout=10)
         if resp.status_code == 200:
             return {"success": True, "error": None}
         else:
@@ -158,8 +400,7 @@ def build_booking_notification(data, source_label="Telegram бота"):
     """
     Формирует текст уведомления о новой заявке.
     """
-    tz = pytz.timezone(TIMEZONE)
-    now_str = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
+    now_str = local_now().strftime('%Y-%m-%d %H:%M:%S')
     return (
         f"🤖 НОВАЯ ЗАЯВКА через {source_label}!\n"
         f"Имя: {data.get('name', '—')}\n"
@@ -173,129 +414,129 @@ def build_booking_notification(data, source_label="Telegram бота"):
 
 def ask_openai_assistant(message, thread_id=None):
     """
-    Критические внешние запросы (создание thread, message, run, polling) делаем через try/except.
-    При любой ошибке — аккуратный возврат и текст ошибки.
+    Синхронная обёртка над AssistantClient.ask для кода вне event loop.
+    В асинхронных обработчиках используйте get_assistant_client().ask напрямую.
     """
-    if not OPENAI_API_KEY or not OPENAI_ASSISTANT_ID:
-        return {"status": "error", "error": "OpenAI ключи не заданы."}
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-        "OpenAI-Beta": "assistants=v2",
-    }
-    # 1. Получить или создать thread (только через try)
-    try:
-        if not thread_id:
-            thread_resp = requests.post(
-                "https://api.openai.com/v1/threads",
-                headers=headers,
-                data=json.dumps({}),
-                timeout=20
-            )
-            thread_resp.raise_for_status()
-            thread_id = thread_resp.json()["id"]
-    except Exception as ex:
-        return {"status": "error", "error": f"Ошибка создания thread: {ex}"}
-    # 2. Отправить сообщение в thread
-    try:
-        msg_url = f"https://api.openai.com/v1/threads/{thread_id}/messages"
-        msg_payload = {"role": "user", "content": message}
-        msg_resp = requests.post(msg_url, headers=headers, data=json.dumps(msg_payload), timeout=20)
-        msg_resp.raise_for_status()
-    except Exception as ex:
-        return {"status": "error", "error": f"Ошибка отправки сообщения: {ex}"}
-    # 3. Запустить ассистента (run) для thread
-    try:
-        run_url = f"https://api.openai.com/v1/threads/{thread_id}/runs"
-        run_payload = {"assistant_id": OPENAI_ASSISTANT_ID}
-        run_resp = requests.post(run_url, headers=headers, data=json.dumps(run_payload), timeout=20)
-        run_resp.raise_for_status()
-        run_id = run_resp.json()["id"]
-    except Exception as ex:
-        return {"status": "error", "error": f"Ошибка запуска run: {ex}"}
-    # 4. Poll статуса
-    status = "in_progress"
-    timeout_poll = 60
-    poll_url = f"https://api.openai.com/v1/threads/{thread_id}/runs/{run_id}"
-    poll_resp = None
-    for i in range(timeout_poll):
-        try:
-            poll_resp = requests.get(poll_url, headers=headers, timeout=20)
-            poll_resp.raise_for_status()
-            status = poll_resp.json().get("status", "")
-            if status in ["completed", "failed", "cancelled", "requires_action"]:
-                break
-            time.sleep(2)
-        except Exception as ex:
-            return {"status": "error", "error": f"Ошибка polling run: {ex}"}
-    if poll_resp is None:
-        return {"status": "error", "error": "Ассистент не дал ответ: polling run не инициализирован."}
-    if status == "requires_action":
-        run_details = poll_resp.json()
-        tool_calls = run_details.get("required_action", {}).get("submit_tool_outputs", {}).get("tool_calls", [])
-        return {
-            "status": "requires_action",
-            "tool_calls": tool_calls,
-            "run_id": run_id,
-            "thread_id": thread_id
-        }
-    elif status == "completed":
-        # Получить историю сообщений (try-except для robustness)
+    assistant_id = tenants.current().assistant_id
+
+    async def _ask():
+        client = AssistantClient(assistant_id=assistant_id)
         try:
-            history_url = f"https://api.openai.com/v1/threads/{thread_id}/messages?order=desc&limit=30"
-            history_resp = requests.get(history_url, headers=headers, timeout=20)
-            history = []
-            if history_resp.status_code == 200:
-                history_json = history_resp.json()
-                for item in reversed(history_json.get('data', [])):
-                    role = item.get("role", "user")
-                    content = ""
-                    try:
-                        content = item["content"][0]["text"]["value"]
-                    except Exception:
-                        content = str(item["content"][0]) if item.get("content") else ""
-                    history.append({"role": role, "content": content})
-            response_text = "(Нет ответа ассистента)"
-            for msg in reversed(history):
-                if msg["role"] == "assistant" and msg["content"]:
-                    response_text = msg["content"]
-                    break
-            return {
-                "status": "completed",
-                "reply": response_text,
-                "thread_id": thread_id,
-                "history": history
-            }
-        except Exception as ex:
-            return {"status": "error", "error": f"Ошибка получения истории: {ex}"}
-    else:
-        return {"status": status, "run_id": run_id, "thread_id": thread_id}
+            return await client.ask(message, thread_id)
+        finally:
+            await client.aclose()
+    return asyncio.run(_ask())
 
 def submit_tool_outputs(thread_id, run_id, tool_outputs):
     """
     Отправляет результаты выполнения функций обратно в OpenAI.
     tool_outputs — список словарей с ключами: "tool_call_id", "output"
     """
-    if not OPENAI_API_KEY:
-        return {"status": "error", "error": "OpenAI ключ не задан."}
-    url = f"https://api.openai.com/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-        "OpenAI-Beta": "assistants=v2",
+    assistant_id = tenants.current().assistant_id
+
+    async def _submit():
+        client = AssistantClient(assistant_id=assistant_id)
+        try:
+            return await client.submit_tool_outputs(thread_id, run_id, tool_outputs)
+        finally:
+            await client.aclose()
+    return asyncio.run(_submit())
+
+def get_catalog():
+    """
+    Каталог услуг, мастеров и цен из Google Sheets (обновляется в фоне).
+    None, если каталог выключен через CATALOG_ENABLED=0 или Google Sheets недоступен.
+    """
+    if not catalog.CATALOG_ENABLED:
+        return None
+    return _optional("catalog")
+
+def get_services_list(category=None, query=None):
+    """
+    Функция для OpenAI Function Calling: услуги с ценами и длительностью из каталога.
+    query — название услуги в свободной форме (ищется нечётко).
+    """
+    salon = get_catalog()
+    if salon is None or not salon.loaded:
+        return {"success": False, "data": None, "error": "Каталог услуг недоступен"}
+    if query:
+        found = salon.find_service(query)
+        services = [found] if found else []
+    else:
+        services = [s for s in salon.services if not category or s.category == category]
+    return {
+        "success": True,
+        "data": [
+            {"name": s.name, "category": s.category, "price": s.price, "duration": s.duration}
+            for s in services
+        ],
+        "error": None,
     }
-    payload = {"tool_outputs": tool_outputs}
-    run_resp = requests.post(url, headers=headers, data=json.dumps(payload))
-    try:
-        run_resp.raise_for_status()
-        return run_resp.json()
-    except Exception as e:
-        return {"status": "error", "error": str(e)}
 
-# Здесь можно добавить функции для получения цен/мастеров/услуг из Google Sheets либо статично
+def get_masters_list(service=None, master_category=None):
+    """
+    Функция для OpenAI Function Calling: мастера (с категориями), выполняющие услугу.
+    """
+    salon = get_catalog()
+    if salon is None or not salon.loaded:
+        return {"success": False, "data": None, "error": "Каталог мастеров недоступен"}
+    category = salon.find_category(master_category) if master_category else None
+    if service:
+        found = salon.find_service(service)
+        if found is None:
+            return {"success": False, "data": None, "error": f"Услуга «{service}» не найдена"}
+        masters = salon.masters_for(found.name, category)
+    else:
+        masters = [m for m in salon.masters if not category or m.category == category]
+    return {
+        "success": True,
+        "data": [{"name": m.name, "category": m.category} for m in masters],
+        "error": None,
+    }
+
+integrations.register("sheets", _build_sheets)
+integrations.register("booking_queue", _build_booking_queue)
+integrations.register("catalog", _build_catalog)
+integrations.register("availability", _build_availability)
+integrations.register("bookings_mirror", _build_bookings_mirror)
+
+# Переменные, без которых часть функций не работает (проверяются при прогреве, а не при импорте)
+REQUIRED_ENV = {
+    "TELEGRAM_BOT_TOKEN": "бот и уведомления",
+    "ADMIN_CHAT_ID": "уведомления админу",
+    "OPENAI_API_KEY": "ответы ассистента",
+    "OPENAI_ASSISTANT_ID": "ответы ассистента",
+    "GOOGLE_SHEET_ID": "запись заявок в Google Sheets",
+}
+
+# Поля салона из реестра, соответствующие REQUIRED_ENV
+TENANT_FIELDS = {
+    "bot_token": "TELEGRAM_BOT_TOKEN",
+    "admin_chat_id": "ADMIN_CHAT_ID",
+    "assistant_id": "OPENAI_ASSISTANT_ID",
+    "sheet_id": "GOOGLE_SHEET_ID",
+}
 
-def get_services_list():
-    # TODO: Реализовать, если нужна выдача услуг и цен
-    return ["Стрижка", "Маникюр", "Педикюр"]
+def warm_up():
+    """
+    Явный прогрев интеграций перед приёмом трафика: Sheets (общий клиент), затем
+    для каждого салона очередь записи, каталог, расписание и локальная копия заявок.
+    Ошибки не останавливают запуск, а выводятся в лог.
+    Возвращает {name: seconds или текст ошибки}.
+    """
+    if not OPENAI_API_KEY:
+        print(f"[Config] OPENAI_API_KEY не задан — не будет работать: {REQUIRED_ENV['OPENAI_API_KEY']}")
+    names = ["catalog", "availability", "bookings_mirror"]
+    if SHEETS_WRITE_BEHIND:
+        names.insert(0, "booking_queue")
+    report = integrations.warm_up(["sheets"])
+    for tenant in tenants.all_tenants().values():
+        for field, env in TENANT_FIELDS.items():
+            if not getattr(tenant, field):
+                label = env if tenant.primary else f"{field} салона {tenant.key}"
+                print(f"[Config] {label} не задан — не будет работать: {REQUIRED_ENV[env]}")
+        with tenants.use(tenant):
+            report.update(integrations.warm_up([tenant.scoped(name) for name in names]))
+    return report
 
 # Аналогично - функции для валидации и обработки входных данных есть смысл добавить по мере необходимости.
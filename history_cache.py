@@ -0,0 +1,144 @@
+"""
+Локальная история сообщений thread OpenAI.
+
+Раньше после каждого run история загружалась заново (последние 30 сообщений
+thread). Теперь для каждого thread хранится ограниченный буфер сообщений
+и id последнего из них: AssistantClient.fetch_history дозапрашивает только
+сообщения после него (курсор after), а /api/chat может отдать виджету
+лишь новые сообщения с момента курсора клиента (since).
+
+Буфер thread ограничен HISTORY_CACHE_MESSAGES, число thread — HISTORY_CACHE_THREADS
+(вытесняются давно не использованные).
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+
+HISTORY_CACHE_ENABLED = os.getenv("HISTORY_CACHE_ENABLED", "1") == "1"
+HISTORY_CACHE_MESSAGES = int(os.getenv("HISTORY_CACHE_MESSAGES", "100"))
+HISTORY_CACHE_THREADS = int(os.getenv("HISTORY_CACHE_THREADS", "2000"))
+# Сколько сообщений отдавать клиенту без курсора (как прежний лимит запроса)
+HISTORY_WINDOW = 30
+
+
+class ThreadHistory:
+    """
+    Сообщения одного thread по возрастанию времени: {"id", "role", "content"}.
+    """
+    __slots__ = ("messages", "ids")
+
+    def __init__(self, size):
+        self.messages = deque(maxlen=size)
+        self.ids = set()
+
+    @property
+    def last_id(self):
+        return self.messages[-1]["id"] if self.messages else None
+
+    def extend(self, messages):
+        added = 0
+        for message in messages:
+            if message["id"] in self.ids:
+                continue
+            if len(self.messages) == self.messages.maxlen:
+                self.ids.discard(self.messages[0]["id"])
+            self.messages.append(message)
+            self.ids.add(message["id"])
+            added += 1
+        return added
+
+    def window(self, limit=HISTORY_WINDOW):
+        return list(self.messages)[-limit:] if limit else list(self.messages)
+
+    def since(self, cursor):
+        """
+        Сообщения после cursor или None, если cursor в буфере не найден.
+        """
+        if cursor not in self.ids:
+            return None
+        messages = list(self.messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i]["id"] == cursor:
+                return messages[i + 1:]
+        return None
+
+
+class HistoryCache:
+    """
+    История по thread_id (LRU). Методы потокобезопасны.
+    """
+
+    def __init__(self, max_messages=HISTORY_CACHE_MESSAGES, max_threads=HISTORY_CACHE_THREADS):
+        self.max_messages = max(max_messages, HISTORY_WINDOW)
+        self.max_threads = max_threads
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"full_fetches": 0, "delta_fetches": 0, "messages_fetched": 0, "evicted": 0}
+
+    def cursor(self, thread_id):
+        """
+        id последнего известного сообщения thread (курсор after для OpenAI) или None.
+        """
+        with self._lock:
+            history = self._threads.get(thread_id)
+            return history.last_id if history is not None else None
+
+    def add(self, thread_id, messages, full=False):
+        """
+        Добавляет загруженные сообщения (по возрастанию времени). full — загрузка
+        без курсора: буфер thread собирается заново.
+        """
+        with self._lock:
+            history = None if full else self._threads.get(thread_id)
+            if history is None:
+                history = self._threads[thread_id] = ThreadHistory(self.max_messages)
+            self._threads.move_to_end(thread_id)
+            self.stats["full_fetches" if full else "delta_fetches"] += 1
+            self.stats["messages_fetched"] += history.extend(messages)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def window(self, thread_id, limit=HISTORY_WINDOW):
+        with self._lock:
+            history = self._threads.get(thread_id)
+            return history.window(limit) if history is not None else []
+
+    def since(self, thread_id, cursor):
+        """
+        Новые сообщения после cursor: (messages, True). Если cursor не задан или уже
+        вытеснен из буфера — последние HISTORY_WINDOW сообщений: (messages, False),
+        клиент должен заменить свою историю целиком.
+        """
+        with self._lock:
+            history = self._threads.get(thread_id)
+            if history is None:
+                return [], False
+            if cursor:
+                messages = history.since(cursor)
+                if messages is not None:
+                    return messages, True
+            return history.window(), False
+
+    def forget(self, thread_id):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def __len__(self):
+        return len(self._threads)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_history_cache():
+    """
+    Общий на процесс кэш истории (None, если выключен через HISTORY_CACHE_ENABLED=0).
+    """
+    global _cache
+    if _cache is None and HISTORY_CACHE_ENABLED:
+        with _cache_lock:
+            if _cache is None:
+                _cache = HistoryCache()
+    return _cache
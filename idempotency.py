@@ -0,0 +1,150 @@
+"""
+Ключи идемпотентности для приёма заявок.
+
+Повторы одной и той же заявки (повторная доставка обновления Telegram,
+двойная отправка формы, повторный вызов save_booking_data после потерянного
+ответа submit_tool_outputs) приходят с тем же ключом и получают исходный
+результат без новой записи в таблицу и нового уведомления.
+
+Ключи хранятся в SQLite (общий файл для воркеров одного хоста): захват ключа —
+атомарный INSERT OR IGNORE, поэтому одновременные повторы тоже отсекаются.
+Готовые результаты дополнительно кэшируются в памяти (LRU). Ключи живут
+IDEMPOTENCY_TTL, число ключей в файле ограничено IDEMPOTENCY_MAX_KEYS.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_PATH = os.getenv(
+    "IDEMPOTENCY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "idempotency.db")
+)
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "50000"))
+# Захват без результата старше этого считается брошенным (процесс упал во время записи)
+IDEMPOTENCY_CLAIM_TIMEOUT = 120.0
+MEMORY_SIZE = 1000
+TRIM_EVERY = 500
+
+NEW = "new"
+DONE = "done"
+BUSY = "busy"
+
+
+class IdempotencyIndex:
+    """
+    claim(key) → (NEW, None) — ключ захвачен, операцию нужно выполнить и вызвать
+    complete() или release(); (DONE, result) — повтор, вернуть result;
+    (BUSY, None) — та же операция сейчас выполняется.
+    """
+
+    def __init__(self, path=IDEMPOTENCY_PATH, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS,
+                 memory_size=MEMORY_SIZE):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.memory_size = memory_size
+        self._memory = OrderedDict()  # key -> (result, expires)
+        self._lock = threading.Lock()
+        self._completed = 0
+        self.stats = {"claimed": 0, "replayed": 0, "busy": 0, "released": 0}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, result TEXT, created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS keys_created ON keys (created)")
+
+    def claim(self, key):
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[1] > now:
+                self._memory.move_to_end(key)
+                self.stats["replayed"] += 1
+                return DONE, cached[0]
+            self._db.execute(
+                "DELETE FROM keys WHERE key = ? AND (created <= ? OR (result IS NULL AND created <= ?))",
+                (key, now - self.ttl, now - IDEMPOTENCY_CLAIM_TIMEOUT),
+            )
+            inserted = self._db.execute(
+                "INSERT OR IGNORE INTO keys (key, result, created) VALUES (?, NULL, ?)", (key, now)
+            ).rowcount
+            if inserted:
+                self.stats["claimed"] += 1
+                return NEW, None
+            row = self._db.execute("SELECT result, created FROM keys WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None:
+            self.stats["busy"] += 1
+            return BUSY, None
+        result = json.loads(row[0])
+        self._remember(key, result, row[1] + self.ttl)
+        self.stats["replayed"] += 1
+        return DONE, result
+
+    def complete(self, key, result):
+        """
+        Сохраняет результат операции для повторов с тем же ключом.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE keys SET result = ?, created = ? WHERE key = ?",
+                (json.dumps(result, ensure_ascii=False, default=str), now, key),
+            )
+            self._completed += 1
+            trim = self._completed % TRIM_EVERY == 0
+        self._remember(key, result, now + self.ttl)
+        if trim:
+            self.trim()
+
+    def release(self, key):
+        """
+        Освобождает захваченный ключ после неудачи: повтор выполнит операцию заново.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM keys WHERE key = ? AND result IS NULL", (key,))
+        self.stats["released"] += 1
+
+    def _remember(self, key, result, expires):
+        with self._lock:
+            self._memory[key] = (result, expires)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def trim(self):
+        """
+        Удаляет просроченные ключи и самые старые сверх max_keys.
+        """
+        now = time.time()
+        with self._lock:
+            removed = self._db.execute(
+                "DELETE FROM keys WHERE created <= ?", (now - self.ttl,)
+            ).rowcount
+            removed += self._db.execute(
+                "DELETE FROM keys WHERE key NOT IN (SELECT key FROM keys ORDER BY created DESC LIMIT ?)",
+                (self.max_keys,),
+            ).rowcount
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_idempotency_index():
+    """
+    Общий на процесс индекс ключей идемпотентности.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IdempotencyIndex()
+        return _index
@@ -0,0 +1,123 @@
+"""
+Реестр внешних интеграций с ленивой инициализацией.
+
+Клиенты (Google Sheets, очередь записи, каталог, расписание) создаются при
+первом обращении или на явном шаге прогрева, а не при импорте модулей:
+процесс стартует без credentials.json и сети, а отсутствующие настройки
+дают понятную ошибку только там, где интеграция действительно нужна.
+Время создания каждого клиента записывается и выводится в лог.
+
+Для разработки и проверок любую интеграцию можно подменить заранее
+созданным объектом: override("sheets", FakeSheetsService()).
+
+Имя вида name@scope — отдельный экземпляр интеграции name (например, каталог
+другого салона): используется фабрика name, вызванная в контексте вызывающего.
+"""
+import threading
+import time
+
+
+class IntegrationUnavailable(RuntimeError):
+    """
+    Интеграцию нельзя создать: нет настроек или файлов.
+    """
+
+
+_factories = {}
+_instances = {}
+_errors = {}
+# Время создания интеграций в секундах: name -> seconds
+TIMINGS = {}
+_lock = threading.RLock()
+
+
+def register(name, factory):
+    """
+    Регистрирует фабрику интеграции: factory() -> клиент.
+    """
+    with _lock:
+        _factories[name] = factory
+
+
+def override(name, instance):
+    """
+    Подменяет интеграцию готовым объектом (например, фейком из fakes.py).
+    """
+    with _lock:
+        _instances[name] = instance
+        _errors.pop(name, None)
+
+
+def reset(name=None):
+    """
+    Забывает созданные клиенты (все или один), следующий get() создаст их заново.
+    """
+    with _lock:
+        if name is None:
+            _instances.clear()
+            _errors.clear()
+        else:
+            _instances.pop(name, None)
+            _errors.pop(name, None)
+
+
+def get(name):
+    """
+    Клиент интеграции; создаётся при первом обращении.
+    """
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        instance = _instances.get(name)
+        if instance is not None:
+            return instance
+        factory = _factories.get(name) or _factories.get(name.partition("@")[0])
+        if factory is None:
+            raise IntegrationUnavailable(f"Интеграция не зарегистрирована: {name}")
+        started = time.perf_counter()
+        try:
+            instance = factory()
+        except Exception as ex:
+            _errors[name] = str(ex)
+            raise
+        TIMINGS[name] = time.perf_counter() - started
+        _instances[name] = instance
+        _errors.pop(name, None)
+        print(f"[Integrations] {name} готов за {TIMINGS[name] * 1000:.0f} мс")
+        return instance
+
+
+def is_ready(name):
+    return name in _instances
+
+
+def warm_up(names=None):
+    """
+    Создаёт перечисленные (или все) интеграции заранее.
+    Ошибки не прерывают прогрев: возвращается {name: seconds или текст ошибки}.
+    """
+    report = {}
+    for name in list(names or _factories):
+        try:
+            get(name)
+            report[name] = TIMINGS.get(name, 0.0)
+        except Exception as ex:
+            report[name] = f"ошибка: {ex}"
+            print(f"[Integrations] {name} недоступен: {ex}")
+    return report
+
+
+def status():
+    """
+    Состояние интеграций для диагностики: ready/error/pending и время создания.
+    """
+    with _lock:
+        return {
+            name: {
+                "state": "ready" if name in _instances else ("error" if name in _errors else "pending"),
+                "seconds": TIMINGS.get(name),
+                "error": _errors.get(name),
+            }
+            for name in set(_factories) | set(_instances)
+        }
@@ -1,90 +1,473 @@
 import os
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+import hmac
+import time
+
+# Отсчёт времени запуска процесса (для лога готовности)
+_STARTED = time.perf_counter()
+from quart import Quart, jsonify, make_response, request
+from quart_cors import cors
 from dotenv import load_dotenv
 from functions import (
-    validate_booking_data,
+    parse_booking_data,
     add_booking_to_sheet,
     send_telegram_notification,
-    ask_openai_assistant,
     save_booking_data,
-    submit_tool_outputs,
-    normalize_booking_datetime,
-    build_booking_notification
+    build_booking_notification,
+    get_catalog,
+    get_services_list,
+    get_masters_list,
+    get_availability,
+    get_free_slots,
+    find_free_slots,
+    get_bookings_mirror,
+    warm_up,
 )
-import threading
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, BotCommand
+from assistant_client import get_assistant_client
+from availability import parse_datetime
+from bookings_mirror import MAX_LIMIT
+from booking import PHONE_HINT, local_now, normalize_phone, parse_booking_datetime, parse_moment, resolve_master
+from agent_loop import get_step_metrics, register_tool, run_turn, stream_turn
+from answer_cache import all_answer_caches
+from executor import ExecutorBusy, get_executor, run_blocking
+from faq_router import get_faq_router
+from history_cache import get_history_cache
+from idempotency import get_idempotency_index
+import integrations
+import metrics
+import tenants
+from notifier import TELEGRAM_API_BASE, all_dispatchers, get_dispatcher
+from reminders import all_reminders, get_reminders
+from storage import get_store, StorePersistence, THREAD_TTL
+from thread_scheduler import get_scheduler
+from update_inbox import UPDATE_INBOX_POLL, get_update_inbox
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, BotCommand, BotCommandScopeChat
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, ContextTypes,
+    Application, ApplicationBuilder, CommandHandler, ContextTypes,
     MessageHandler, filters, ConversationHandler
 )
 import asyncio
 import json
+from datetime import timedelta
 
 load_dotenv()
 
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Потоковые ответы ассистента (run stream) вместо ожидания полного ответа
+ASSISTANT_STREAMING = os.getenv("ASSISTANT_STREAMING", "1") == "1"
+# Telegram ограничивает частоту правок сообщения — правим не чаще раза в N секунд
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+TG_MESSAGE_LIMIT = 4096
+# Сколько ждать прогрева интеграций (Sheets, каталог) при запуске
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "60"))
+# Таймаут записи заявки (Sheets/очередь) при вызове из обработчиков
+SHEETS_CALL_TIMEOUT = float(os.getenv("SHEETS_CALL_TIMEOUT", "20"))
+# Сколько свободных слотов предлагать кнопками на шаге выбора даты
+SLOT_KEYBOARD_SIZE = int(os.getenv("SLOT_KEYBOARD_SIZE", "6"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Режим получения обновлений Telegram: polling или webhook
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+# Публичный https-адрес сервера, например https://example.ngrok.app (для webhook)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+# Путь webhook основного салона; у остальных — TELEGRAM_WEBHOOK_PATH/<ключ салона>
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+# Сколько обновлений бот обрабатывает одновременно
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "64"))
+# Соединений PTB к Bot API (по умолчанию в ApplicationBuilder — столько же); пул общий для ботов всех салонов
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "256"))
+# Токен для /metrics и /debug/traces (Authorization: Bearer ...); пусто — без проверки
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Сколько заявок выводить в ответах /today и /find
+ADMIN_LIST_LIMIT = 50
+# Long polling допускает только один getUpdates на токен: при нескольких воркерах
+# опрашивает Telegram (или регистрирует webhook) тот, кто первым захватил файл-блокировку
+POLLING_LOCK_PATH = os.getenv(
+    "POLLING_LOCK_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".telegram_polling.lock")
+)
+
+app = Quart(__name__)
+# CORS для виджета Тильды: как и раньше, разрешены все источники
+app = cors(app, allow_origin="*")
+
+register_tool("save_booking_data", save_booking_data, pass_call_id=True)
+register_tool("get_services_list", get_services_list)
+register_tool("get_masters_list", get_masters_list)
+register_tool("get_free_slots", get_free_slots)
+
+# PTB Application каждого салона с ботом (ключ салона -> Application), в том же event loop, что и веб-приложение
+telegram_apps = {}
+_polling_lock_file = None
+# Этот воркер держит блокировку: обрабатывает обновления Telegram всех воркеров
+_telegram_owner = False
+# Разбор общего ящика обновлений webhook (только у держателя блокировки)
+_inbox_task = None
+# Фоновая задача прогрева интеграций и запуска бота
+_startup_task = None
+
+def notify_admin(text):
+    """
+    Уведомление админу текущего салона без задержки ответа клиенту: через очередь
+    диспетчера, а если диспетчер не запущен — в пуле потоков.
+    """
+    if not get_dispatcher().submit(text):
+        get_executor().submit(send_telegram_notification, text)
+
+def collect_app_metrics():
+    """
+    Значения, которые считаются в момент запроса /metrics: глубина очередей,
+    пул потоков, статистика кэшей, каталога, расписания и шагов агента.
+    Очереди, кэши и индексы салонов помечены меткой tenant.
+    """
+    samples = []
+
+    def add(name, kind, help_text, value, **labels):
+        samples.append((name, kind, help_text, labels, value))
+
+    executor = get_executor().snapshot()
+    add("executor_active", metrics.GAUGE, "Потоки пула, выполняющие вызов", executor["active"])
+    add("executor_queued", metrics.GAUGE, "Вызовы, ждущие свободного потока", executor["queued"])
+    for result in ("completed", "errors", "timeouts", "rejected"):
+        add("executor_calls_total", metrics.COUNTER, "Вызовы в пуле потоков по итогу", executor[result], result=result)
+    for key, value in executor["tenants"].items():
+        add("executor_tenant_slots", metrics.GAUGE, "Места пула потоков, занятые салоном", value, tenant=key)
+    scheduler = get_scheduler()
+    for key, values in scheduler.tenant_stats.items():
+        add("tenant_runs_inflight", metrics.GAUGE, "Run OpenAI салона в работе", values["inflight"], tenant=key)
+        add("tenant_runs_waiting", metrics.GAUGE, "Ходы салона, ждущие места", values["waiting"], tenant=key)
+        add("tenant_runs_total", metrics.COUNTER, "Ходы диалога салона", values["runs"], tenant=key)
+    for key, dispatcher in all_dispatchers():
+        add("notify_queue_depth", metrics.GAUGE, "Уведомления в очереди на отправку", dispatcher.qsize(), tenant=key)
+        for result in ("sent", "failed", "dropped", "digests"):
+            add("notifications_total", metrics.COUNTER, "Уведомления администратору", dispatcher.stats[result],
+                tenant=key, result=result)
+    for key, cache in all_answer_caches():
+        for result, value in cache.stats.items():
+            add("answer_cache_events_total", metrics.COUNTER, "События кэша ответов", value, tenant=key, result=result)
+    history = get_history_cache()
+    if history is not None:
+        add("history_cache_threads", metrics.GAUGE, "Thread в кэше истории", len(history))
+        for event, value in history.stats.items():
+            add("history_cache_events_total", metrics.COUNTER, "Загрузки истории thread (полные и после курсора)", value, event=event)
+    for key, reminders in all_reminders():
+        add("reminders_pending", metrics.GAUGE, "Напоминания о записи в очереди", reminders.pending_count(), tenant=key)
+        for event, value in reminders.stats.items():
+            add("reminders_events_total", metrics.COUNTER, "Напоминания о записи", value, tenant=key, event=event)
+    for result, value in get_idempotency_index().stats.items():
+        add("idempotency_keys_total", metrics.COUNTER, "Ключи идемпотентности заявок", value, result=result)
+    for key, tenant in tenants.all_tenants().items():
+        name = tenant.scoped("booking_queue")
+        if integrations.is_ready(name):
+            queue = integrations.get(name)
+            add("sheets_queue_pending", metrics.GAUGE, "Заявки, ещё не записанные в Google Sheets", queue.pending_count(), tenant=key)
+            add("sheets_rows_appended_total", metrics.COUNTER, "Строки, записанные очередью в Sheets", queue.stats["appended_rows"], tenant=key)
+            add("sheets_rows_dead_total", metrics.COUNTER, "Строки, отклонённые таблицей", queue.stats["dead"], tenant=key)
+        if integrations.is_ready(tenant.scoped("bookings_mirror")):
+            for event, value in integrations.get(tenant.scoped("bookings_mirror")).stats.items():
+                add("bookings_mirror_events_total", metrics.COUNTER, "События локальной копии заявок", value, tenant=key, event=event)
+        for index in ("catalog", "availability"):
+            if integrations.is_ready(tenant.scoped(index)):
+                for event, value in integrations.get(tenant.scoped(index)).stats.items():
+                    add(f"{index}_events_total", metrics.COUNTER, f"События индекса {index}", value, tenant=key, event=event)
+    for name, info in integrations.status().items():
+        add("integration_ready", metrics.GAUGE, "Интеграция создана (1) или нет (0)", int(info["state"] == "ready"), name=name)
+    for state, values in get_step_metrics().items():
+        add("agent_steps_total", metrics.COUNTER, "Шаги агентского цикла", values["count"], state=state)
+        add("agent_step_errors_total", metrics.COUNTER, "Шаги агентского цикла с ошибкой", values["errors"], state=state)
+        add("agent_step_seconds_total", metrics.COUNTER, "Суммарное время шагов агентского цикла", values["total"], state=state)
+    return samples
+
+metrics.register_collector(collect_app_metrics)
+
+def metrics_allowed():
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}")
 
-app = Flask(__name__)
-CORS(app)
+def history_payload(result, after=None):
+    """
+    История для ответа /api/chat. С курсором after (id последнего сообщения
+    у клиента) — только новые сообщения и history_delta: true; если курсор
+    уже вытеснен из кэша — последние сообщения thread и history_delta: false.
+    """
+    history = result.get("history") or []
+    if result.get("cached"):
+        # Ответ из базы знаний или кэша в thread не попадает — курсор не двигается
+        return {"history": history, "history_cursor": after, "history_delta": bool(after)}
+    cache = get_history_cache()
+    delta = False
+    if after and cache is not None and result.get("thread_id"):
+        history, delta = cache.since(result["thread_id"], after)
+    return {
+        "history": history,
+        "history_cursor": history[-1].get("id") if history else after,
+        "history_delta": delta,
+    }
+
+def admin_day(text):
+    """
+    Начало дня из «сегодня», «завтра», дня недели или ДД.ММ[.ГГГГ]; None, если не распознано.
+    """
+    today = local_now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return parse_moment(f"{text.strip() or 'сегодня'} 00:00", today)
+
+def format_booking_line(item):
+    line = f"{item['date'] or '—'} {item['service']} — {item['name']}, {item['phone']}"
+    return line + (f", мастер {item['master']}" if item['master'] else "")
+
+def format_booking_list(title, items):
+    lines = [title] + [format_booking_line(item) for item in items[:ADMIN_LIST_LIMIT]]
+    if len(items) > ADMIN_LIST_LIMIT:
+        lines.append(f"… и ещё {len(items) - ADMIN_LIST_LIMIT}")
+    return "\n".join(lines)[:TG_MESSAGE_LIMIT]
+
+def booking_stats(mirror):
+    """
+    Сводка по локальной копии заявок: сегодня, завтра, 7 дней, популярные мастера и услуги.
+    """
+    today = local_now().replace(hour=0, minute=0, second=0, microsecond=0)
+    week = today + timedelta(days=7)
+    return {
+        "today": mirror.count(today, today + timedelta(days=1)),
+        "tomorrow": mirror.count(today + timedelta(days=1), today + timedelta(days=2)),
+        "week": mirror.count(today, week),
+        "total": len(mirror),
+        "top_masters": mirror.top("master", today, week),
+        "top_services": mirror.top("service", today, week),
+    }
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def tenant_threads():
+    """
+    user_id -> thread_id консультации текущего салона (общее хранилище с TTL).
+    """
+    return get_store().namespace(tenants.current().scoped("thread"), ttl=THREAD_TTL)
+
+@app.before_request
+async def select_tenant():
+    """
+    Салон для /api/*: заголовок X-Tenant или параметр tenant (без них — основной салон).
+    """
+    if not request.path.startswith("/api/"):
+        return None
+    key = request.headers.get("X-Tenant") or request.args.get("tenant")
+    tenant = tenants.get_tenant(key) if key else tenants.primary()
+    if tenant is None:
+        return jsonify({"success": False, "error": f"Неизвестный салон: {key}"}), 404
+    tenants.activate(tenant)
+    return None
 
 @app.route('/ping', methods=['GET'])
-def ping():
+async def ping():
     return jsonify({"status": "ok", "msg": "pong"})
 
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    if not metrics_allowed():
+        return jsonify({"success": False, "error": "forbidden"}), 403
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route('/debug/traces', methods=['GET'])
+async def debug_traces():
+    """
+    Последние трассы запросов и обновлений Telegram с разбивкой по этапам.
+    Параметры: limit (по умолчанию 50), min_ms — только не короче указанного.
+    """
+    if not metrics_allowed():
+        return jsonify({"success": False, "error": "forbidden"}), 403
+    limit = request.args.get("limit", 50, type=int)
+    min_ms = request.args.get("min_ms", 0.0, type=float)
+    return jsonify({"success": True, "traces": metrics.recent_traces(limit, min_ms)})
+
 @app.route('/api/booking', methods=['POST'])
-def api_booking():
-    data = request.json
-    is_valid, err = validate_booking_data(data)
-    if not is_valid:
+@metrics.traced("http.booking")
+async def api_booking():
+    booking, err = parse_booking_data(await request.get_json(silent=True))
+    if booking is None:
         return jsonify({"success": False, "error": err}), 400
-    result = add_booking_to_sheet(data)
+    data = booking.as_dict()
+    # Повтор запроса с тем же Idempotency-Key не создаёт вторую заявку
+    key = request.headers.get("Idempotency-Key", "").strip()
+    try:
+        result = await run_blocking(add_booking_to_sheet, data, f"api:{key}" if key else None, timeout=SHEETS_CALL_TIMEOUT)
+    except (asyncio.TimeoutError, ExecutorBusy):
+        return jsonify({"success": False, "error": "Сервис записи не отвечает, попробуйте позже"}), 503
     if result["success"]:
-        msg = build_booking_notification(data, "сайта")
-        send_telegram_notification(msg)
+        if not result.get("duplicate"):
+            msg = build_booking_notification(data, "сайта")
+            notify_admin(msg)
         return jsonify({"success": True, "msg": "Заявка сохранена!"})
+    elif result.get("duplicate"):
+        return jsonify({"success": False, "error": result["error"]}), 409
     else:
         return jsonify({"success": False, "error": result["error"]}), 500
 
+@app.route('/api/bookings', methods=['GET'])
+async def api_bookings():
+    """
+    Заявки из локальной копии таблицы (без обращения к Google Sheets).
+    Параметры: date (ДД.ММ.ГГГГ, «сегодня», «завтра»; по умолчанию сегодня),
+    days (сколько дней от date, по умолчанию 1), master, phone (тогда date
+    необязателен), limit. Нужен заголовок Authorization: Bearer с токеном салона
+    (ADMIN_API_TOKEN или api_token из реестра).
+    """
+    token = tenants.current().api_token
+    if not token or not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return jsonify({"success": False, "error": "forbidden"}), 403
+    mirror = await run_blocking(get_bookings_mirror)
+    if mirror is None:
+        return jsonify({"success": False, "error": "Копия заявок недоступна"}), 503
+    phone = request.args.get("phone", "")
+    start = end = None
+    if request.args.get("date") or not phone:
+        start = admin_day(request.args.get("date", ""))
+        if start is None:
+            return jsonify({"success": False, "error": "Дата должна быть в формате ДД.ММ.ГГГГ"}), 400
+        end = start + timedelta(days=max(1, min(request.args.get("days", 1, type=int), 366)))
+    bookings = await run_blocking(
+        mirror.query, start, end, request.args.get("master"), phone, request.args.get("limit", 100, type=int)
+    )
+    return jsonify({"success": True, "count": len(bookings), "bookings": bookings})
+
+def web_chat_key(user_id):
+    return f"web:{user_id}" if user_id else None
+
+async def web_thread(threads, thread_id, web_key):
+    # Виджет может не хранить thread_id — восстанавливаем по user_id
+    return thread_id or (await run_blocking(threads.get, web_key) if web_key else None)
+
 @app.route('/api/chat', methods=['POST'])
-def api_chat():
-    # FIXME: Эта реализация блокирует Flask до завершения всех запросов к OpenAI assistant!
-    #         Для production требуется вынести agent loop в отдельный воркер или переключиться на асинхронный движок (Quart, FastAPI + httpx).
-    data = request.json or {}
+@metrics.traced("http.chat")
+async def api_chat():
+    data = await request.get_json(silent=True) or {}
     user_id = data.get('user_id')
     msg = data.get('message', '')
     thread_id = data.get('thread_id')
-    result = ask_openai_assistant(msg, thread_id)
+    web_key = web_chat_key(user_id)
+    threads = tenant_threads()
+
+    async def chat_turn(message):
+        result = await run_turn(message, await web_thread(threads, thread_id, web_key))
+        if web_key and result.get("thread_id"):
+            threads.set(web_key, result["thread_id"])
+        return result
+
+    result = await get_scheduler().run(thread_id or web_key, msg, chat_turn, share=True)
     if result.get('status') == 'error':
         return jsonify({"success": False, "error": result.get('error', 'Ассистент не отвечает')})
-    # Agent-loop (for MVP only!)
-    while result.get("status") == "requires_action":
-        tool_outputs = []
-        for call in result.get("tool_calls", []):
-            if call["function"]["name"] == "save_booking_data":
-                args = json.loads(call["function"]["arguments"])
-                sheet_result = save_booking_data(**args)
-                tool_outputs.append({
-                    "tool_call_id": call["id"],
-                    "output": json.dumps(sheet_result)
-                })
-        submit_resp = submit_tool_outputs(result["thread_id"], result["run_id"], tool_outputs)
-        result = ask_openai_assistant("", result["thread_id"])
-        # FIXME: В таком цикле весь сервер зависает! Production solution — только через async FSM.
     return jsonify({
         "success": True,
         "reply": result.get("reply"),
         "thread_id": result.get("thread_id"),
-        "history": result.get("history")
+        **history_payload(result, data.get("history_after")),
     })
 
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+async def api_chat_stream():
+    """
+    Потоковый ответ ассистента (Server-Sent Events) для виджета Тильды.
+    События: thread {thread_id}, delta {text}, done {reply, thread_id}, error {error}.
+    GET с query-параметрами подходит для EventSource, POST с JSON — для fetch.
+    Очередь ходов та же, что у /api/chat: по thread_id, а без него — по user_id.
+    """
+    if request.method == 'POST':
+        data = await request.get_json(silent=True) or {}
+    else:
+        data = request.args
+    msg = data.get('message', '')
+    thread_id = data.get('thread_id')
+    web_key = web_chat_key(data.get('user_id'))
+    tenant = tenants.current()
+
+    async def generate():
+        # Тело ответа отдаётся после выхода из обработчика — салон выставляем заново
+        tenants.activate(tenant)
+        threads = tenant_threads()
+        # Поток по thread не склеивается с другими, но ждёт завершения активного run
+        async with get_scheduler().slot(thread_id or web_key):
+            async for event in stream_turn(msg, await web_thread(threads, thread_id, web_key)):
+                if web_key and event["type"] == "thread":
+                    threads.set(web_key, event["thread_id"])
+                kind = event.pop("type")
+                yield sse_event("done" if kind == "completed" else kind, event).encode()
+
+    response = await make_response(
+        generate(),
+        {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Длинный ответ ассистента не должен обрываться таймаутом Quart
+    response.timeout = None
+    return response
+
+def webhook_path(tenant):
+    return TELEGRAM_WEBHOOK_PATH if tenant.primary else f"{TELEGRAM_WEBHOOK_PATH.rstrip('/')}/{tenant.key}"
+
+@app.route(TELEGRAM_WEBHOOK_PATH, methods=['POST'])
+@app.route(f"{TELEGRAM_WEBHOOK_PATH.rstrip('/')}/<tenant_key>", methods=['POST'])
+async def telegram_webhook(tenant_key=None):
+    """
+    Приём обновлений Telegram в режиме webhook (у каждого салона свой путь
+    и секрет). Запрос подтверждается секретом из заголовка
+    X-Telegram-Bot-Api-Secret-Token; обработка идёт в фоне через очередь
+    обновлений PTB, Telegram сразу получает 200.
+
+    Диалоги хранятся в памяти воркера с блокировкой бота, поэтому остальные
+    воркеры передают ему обновление через общий ящик (update_inbox).
+    """
+    tenant = tenants.primary() if tenant_key is None else tenants.get_tenant(tenant_key)
+    # Основной салон — только по TELEGRAM_WEBHOOK_PATH, остальные — по пути со своим ключом
+    if tenant is not None and tenant.primary != (tenant_key is None):
+        tenant = None
+    telegram_app = telegram_apps.get(tenant.key) if tenant is not None else None
+    if telegram_app is None or TELEGRAM_MODE != "webhook":
+        return jsonify({"success": False, "error": "webhook отключён"}), 404
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, tenant.webhook_secret):
+        return jsonify({"success": False, "error": "forbidden"}), 403
+    data = await request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "error": "empty update"}), 400
+    if _telegram_owner:
+        await telegram_app.update_queue.put(Update.de_json(data, telegram_app.bot))
+    else:
+        await run_blocking(get_update_inbox().put, tenant.key, data, name="update_inbox.put")
+    return jsonify({"success": True})
+
+async def _drain_update_inbox():
+    """
+    Передаёт обновления, принятые другими воркерами, приложениям PTB этого воркера.
+    """
+    while True:
+        try:
+            updates = await run_blocking(get_update_inbox().take, name="update_inbox.take")
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            print(f"[Telegram] Ошибка чтения ящика обновлений: {ex}")
+            updates = []
+        for key, data in updates:
+            telegram_app = telegram_apps.get(key)
+            if telegram_app is not None:
+                await telegram_app.update_queue.put(Update.de_json(data, telegram_app.bot))
+        if not updates:
+            await asyncio.sleep(UPDATE_INBOX_POLL)
+
 CHOOSING, FASTBOOK, F_NAME, F_PHONE, F_SERVICE, F_DATE, F_MASTER, F_COMMENT = range(8)
-CONSULT_THREAD = {}
+
+def slots_keyboard(slots):
+    """
+    Клавиатура быстрых ответов со свободным временем (по два слота в ряд).
+    """
+    if not slots:
+        return ReplyKeyboardRemove()
+    rows = [slots[i:i + 2] for i in range(0, len(slots), 2)]
+    return ReplyKeyboardMarkup(rows, one_time_keyboard=True, resize_keyboard=True)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [["Быстрая запись", "Консультация"]]
     await update.message.reply_text(
-        "Здравствуйте! Добро пожаловать в салон красоты ArtBeauty. "
+        f"Здравствуйте! Добро пожаловать в салон красоты {tenants.current().name}. "
         "Чем могу помочь вам сегодня? Рассказать о наших услугах, ценах или хотите записаться на процедуру?",
         reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
     )
@@ -111,33 +494,66 @@ async def get_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return F_PHONE
 
 async def get_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    phone = update.message.text
+    ok, phone = normalize_phone(update.message.text)
+    if not ok:
+        await update.message.reply_text(f"{PHONE_HINT}, например +79991234567 или 8 999 123-45-67.")
+        return F_PHONE
     context.user_data['booking']['phone'] = phone
     await update.message.reply_text("Какая услуга интересует?")
     return F_SERVICE
 
 async def get_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
     service = update.message.text
+    salon = get_catalog()
+    if salon is not None and salon.services:
+        found = salon.find_service(service)
+        if found is None:
+            await update.message.reply_text(
+                "Не нашли такую услугу. Выберите из списка: " + ", ".join(salon.service_names())
+            )
+            return F_SERVICE
+        service = found.name
     context.user_data['booking']['service'] = service
-    await update.message.reply_text("На какую дату и время вас записать? Формат: ДД.ММ.ГГГГ ЧЧ:ММ (например, 05.05.2025 14:30)")
+    await update.message.reply_text(
+        "На какую дату и время вас записать? Выберите свободное время или введите "
+        "в формате ДД.ММ.ГГГГ ЧЧ:ММ (например, 05.05.2025 14:30)",
+        reply_markup=slots_keyboard(find_free_slots(service=service, count=SLOT_KEYBOARD_SIZE)),
+    )
     return F_DATE
 
 async def get_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     date_text = update.message.text
-    ok, normalized = normalize_booking_datetime(date_text)
+    ok, normalized = parse_booking_datetime(date_text)
     if not ok:
         await update.message.reply_text(
-            f"Ошибка: {normalized}\nВведите дату ещё раз в формате ДД.ММ.ГГГГ ЧЧ:ММ."
+            f"Ошибка: {normalized}\nВведите дату ещё раз."
         )
         return F_DATE
     context.user_data['booking']['date'] = normalized
     context.user_data['booking']['datetime'] = normalized
-    await update.message.reply_text("К какому мастеру вы хотите записаться? (или пропустите)")
+    await update.message.reply_text(
+        "К какому мастеру вы хотите записаться? (или пропустите)", reply_markup=ReplyKeyboardRemove()
+    )
     return F_MASTER
 
 async def get_master(update: Update, context: ContextTypes.DEFAULT_TYPE):
     master = update.message.text
-    context.user_data['booking']['master'] = master
+    booking = context.user_data['booking']
+    booking['master'] = master
+    slots = get_availability()
+    moment = parse_datetime(booking['date'])
+    # Расписание ведётся по мастеру из каталога, как при записи (reserve_slot)
+    ok, resolved = resolve_master(get_catalog(), master)
+    if ok and slots is not None and slots.loaded and moment is not None:
+        master = resolved[0] or resolved[1]
+        if not slots.is_free(master, booking.get('service'), moment):
+            await update.message.reply_text(
+                "У мастера это время занято. Выберите другое время:",
+                reply_markup=slots_keyboard(
+                    find_free_slots(master, booking.get('service'), moment, SLOT_KEYBOARD_SIZE)
+                ),
+            )
+            return F_DATE
     await update.message.reply_text("Комментарий к заявке? (или пропустите)")
     return F_COMMENT
 
@@ -146,17 +562,26 @@ async def get_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     booking = context.user_data.get('booking', {})
     booking['comment'] = comment
     booking['source'] = 'Telegram'
-    is_valid, err = validate_booking_data(booking)
-    if not is_valid:
+    record, err = parse_booking_data(booking)
+    if record is None:
         await update.message.reply_text(f"Ошибка: {err}")
         return ConversationHandler.END
-    result = add_booking_to_sheet(booking)
+    booking = record.as_dict()
+    # Повторная доставка того же обновления не создаёт вторую заявку
+    key = f"tg:{update.effective_user.id}:{update.update_id}"
+    try:
+        result = await run_blocking(
+            add_booking_to_sheet, booking, key, chat_id=update.effective_chat.id, timeout=SHEETS_CALL_TIMEOUT
+        )
+    except (asyncio.TimeoutError, ExecutorBusy):
+        result = {"success": False, "error": "сервис записи не отвечает, попробуйте позже"}
     if result["success"]:
-        msg = build_booking_notification(booking, "Telegram бота")
-        send_telegram_notification(msg)
+        if not result.get("duplicate"):
+            msg = build_booking_notification(booking, "Telegram бота")
+            notify_admin(msg)
         await update.message.reply_text("Спасибо! Ваша заявка принята и передана админу.")
     else:
-        await update.message.reply_text("Ошибка при записи заявки. Попробуйте позже.")
+        await update.message.reply_text(f"Не удалось записать заявку: {result['error']}")
     # вернуть пользователя к выбору действия
     keyboard = [["Быстрая запись", "Консультация"]]
     await update.message.reply_text(
@@ -166,31 +591,101 @@ async def get_comment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return CHOOSING
 
 # --- Консультация с Function Calling Agent loop ---
-async def consult_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # FIXME: Блокирующий agent loop внутри асинхронного хендлера!
-    # Для production state-machine реализовать агентский цикл с промежуточными переходами через callback/context.
-    user_id = str(update.message.from_user.id)
-    msg = update.message.text
-    thread_id = CONSULT_THREAD.get(user_id)
-    answer = ask_openai_assistant(msg, thread_id)
+class ThrottledEditor:
+    """
+    Постепенно редактирует одно сообщение бота, не чаще раза в interval секунд,
+    и уважает retry_after, который Telegram присылает при превышении лимитов.
+    """
+    def __init__(self, message, interval):
+        self.message = message
+        self.interval = interval
+        self._next_edit = 0.0
+        self._shown = None
+
+    async def update(self, text):
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._next_edit:
+            return
+        await self._edit(text[:TG_MESSAGE_LIMIT])
+
+    async def finish(self, text):
+        """
+        Финальная правка: дожидается разрешённого момента и дописывает
+        не поместившийся в одно сообщение текст отдельными сообщениями.
+        """
+        chunks = [text[i:i + TG_MESSAGE_LIMIT] for i in range(0, len(text), TG_MESSAGE_LIMIT)] or [text]
+        delay = self._next_edit - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not await self._edit(chunks[0]):
+            # Повтор после retry_after
+            await asyncio.sleep(max(0.0, self._next_edit - asyncio.get_running_loop().time()))
+            await self._edit(chunks[0])
+        for chunk in chunks[1:]:
+            await self.message.reply_text(chunk)
+
+    async def _edit(self, text):
+        loop = asyncio.get_running_loop()
+        if not text or text == self._shown:
+            return True
+        try:
+            await self.message.edit_text(text)
+            self._shown = text
+        except RetryAfter as ex:
+            self._next_edit = loop.time() + float(ex.retry_after)
+            return False
+        except BadRequest as ex:
+            # "Message is not modified" и подобные — не критично для промежуточных правок
+            print(f"[Telegram] Ошибка редактирования: {ex}")
+        self._next_edit = loop.time() + self.interval
+        return True
+
+async def consult_stream_turn(update: Update, user_id, msg):
+    """
+    Ход консультации в потоковом режиме: бот сразу отвечает заглушкой и правит её
+    по мере поступления текста от ассистента.
+    """
+    threads = tenant_threads()
+    thread_id = await run_blocking(threads.get, user_id)
+    placeholder = await update.message.reply_text("…")
+    editor = ThrottledEditor(placeholder, STREAM_EDIT_INTERVAL)
+    text = ""
+    error = None
+    async for event in stream_turn(msg, thread_id):
+        if event["type"] == "thread":
+            threads.set(user_id, event["thread_id"])
+        elif event["type"] == "delta":
+            text += event["text"]
+            await editor.update(text)
+        elif event["type"] == "error":
+            error = event["error"]
+    if not text and error:
+        await editor.finish(error)
+        return
+    if not text:
+        text = (
+            "Готово! Ваша заявка сформирована. "
+            "Если остались вопросы — задайте их, пожалуйста."
+        )
+    await editor.finish(
+        text + "\n\nХотите записаться на услугу? Просто нажмите /start и выберите 'Быстрая запись'."
+    )
+
+async def consult_turn(update: Update, user_id, msg):
+    """
+    Ход консультации с ответом целиком после завершения run.
+    """
+    threads = tenant_threads()
+    thread_id = await run_blocking(threads.get, user_id)
+    answer = await run_turn(msg, thread_id)
     if answer.get('status') == 'error':
+        if answer.get("thread_id"):
+            threads.set(user_id, answer["thread_id"])
         reply = answer.get('error', 'Ассистент не отвечает.')
         await update.message.reply_text(reply)
-        return FASTBOOK
-    while answer.get("status") == "requires_action":
-        tool_outputs = []
-        for call in answer.get("tool_calls", []):
-            if call["function"]["name"] == "save_booking_data":
-                args = json.loads(call["function"]["arguments"])
-                sheet_result = save_booking_data(**args)
-                tool_outputs.append({
-                    "tool_call_id": call["id"],
-                    "output": json.dumps(sheet_result)
-                })
-        submit_resp = submit_tool_outputs(answer["thread_id"], answer["run_id"], tool_outputs)
-        answer = ask_openai_assistant("", answer["thread_id"])
-        # FIXME: Это блокирует бота внутри event-loop! Виден только на тестах. Для продакшена — FSM!
-    CONSULT_THREAD[user_id] = answer.get("thread_id")
+        return
+    if answer.get("thread_id"):
+        threads.set(user_id, answer["thread_id"])
     reply = answer.get("reply")
     if not reply:
         reply = (
@@ -200,24 +695,162 @@ async def consult_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         reply + "\n\nХотите записаться на услугу? Просто нажмите /start и выберите 'Быстрая запись'."
     )
+
+async def consult_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Ходы одного пользователя идут по очереди; сообщения, пришедшие во время
+    # активного run, уходят ассистенту одним следующим ходом с одним ответом
+    user_id = str(update.message.from_user.id)
+    turn = consult_stream_turn if ASSISTANT_STREAMING else consult_turn
+    await get_scheduler().run(user_id, update.message.text, lambda msg: turn(update, user_id, msg))
     return FASTBOOK
 
+def is_admin_chat(update: Update):
+    admin_chat_id = tenants.current().admin_chat_id
+    return bool(admin_chat_id) and str(update.effective_chat.id) == admin_chat_id
+
+async def admin_mirror(update: Update):
+    """
+    Копия заявок для команд администратора; None — команда не из служебного чата
+    или копия недоступна (тогда отвечаем сами).
+    """
+    if not is_admin_chat(update):
+        return None
+    try:
+        mirror = await run_blocking(get_bookings_mirror)
+    except Exception as ex:
+        print(f"[BookingsMirror] Копия заявок недоступна: {ex}")
+        mirror = None
+    if mirror is None:
+        await update.message.reply_text("Локальная копия заявок недоступна.")
+    return mirror
+
+async def admin_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /today [завтра|ДД.ММ.ГГГГ] — заявки на день.
+    """
+    mirror = await admin_mirror(update)
+    if mirror is None:
+        return
+    day = admin_day(" ".join(context.args or []))
+    if day is None:
+        await update.message.reply_text("Укажите день: /today, /today завтра или /today 05.05.2025")
+        return
+    items = await run_blocking(mirror.query, day, day + timedelta(days=1), None, None, MAX_LIMIT)
+    title = f"Записи на {day.strftime('%d.%m.%Y')}: {len(items)}"
+    await update.message.reply_text(format_booking_list(title, items))
+
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    mirror = await admin_mirror(update)
+    if mirror is None:
+        return
+    stats = await run_blocking(booking_stats, mirror)
+    lines = [
+        f"Сегодня: {stats['today']}",
+        f"Завтра: {stats['tomorrow']}",
+        f"7 дней: {stats['week']}",
+        f"Всего в копии: {stats['total']}",
+    ]
+    if stats["top_masters"]:
+        lines.append("Мастера (7 дней): " + ", ".join(f"{name or '—'} {n}" for name, n in stats["top_masters"]))
+    if stats["top_services"]:
+        lines.append("Услуги (7 дней): " + ", ".join(f"{name or '—'} {n}" for name, n in stats["top_services"]))
+    await update.message.reply_text("\n".join(lines))
+
+async def admin_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /find <телефон> — последние заявки с этим номером.
+    """
+    mirror = await admin_mirror(update)
+    if mirror is None:
+        return
+    phone = " ".join(context.args or [])
+    if not phone.strip():
+        await update.message.reply_text("Укажите телефон: /find +79991234567")
+        return
+    items = await run_blocking(mirror.find_phone, phone, ADMIN_LIST_LIMIT)
+    if not items:
+        await update.message.reply_text("Заявок с этим телефоном нет.")
+        return
+    await update.message.reply_text(format_booking_list(f"Заявки с телефоном {phone}: {len(items)}", items))
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Диалог прерван. Вы можете начать сначала с /start', reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
-def run_tg_bot():
-    async def post_init(app):
-        await app.bot.set_my_commands([
-            BotCommand("start", "Начать диалог")
-        ])
+class TracedApplication(Application):
+    """
+    Application, у которого каждое обновление — отдельная трасса со всеми
+    исходящими вызовами (OpenAI, Sheets, Telegram) и выполняется от имени
+    салона бота (tenants.current() в обработчиках).
+    """
+    # Салон бота (None — основной)
+    tenant = None
+
+    async def process_update(self, update):
+        update_id = getattr(update, "update_id", None)
+        started = time.perf_counter()
+        try:
+            with tenants.use(self.tenant or tenants.primary()):
+                with metrics.span("telegram.update", update_id=update_id):
+                    await super().process_update(update)
+        finally:
+            metrics.observe("request_seconds", time.perf_counter() - started, kind="telegram", name="update")
+
+class TracedRequest(HTTPXRequest):
+    """
+    Запросы бота к Bot API как этапы трассы: stage_seconds{stage="telegram.sendMessage"} и т.п.
+    """
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        with metrics.timed("telegram." + url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+
+class SharedRequest(TracedRequest):
+    """
+    Один пул соединений к Bot API на ботов всех салонов (токен — в URL запроса).
+    Каждый бот вызывает initialize()/shutdown(); пул закрывается вместе с последним.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._users = 0
+
+    async def initialize(self):
+        self._users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self._users = max(0, self._users - 1)
+        if not self._users:
+            await super().shutdown()
 
+_telegram_request = None
+
+def telegram_request():
+    global _telegram_request
+    if _telegram_request is None:
+        _telegram_request = SharedRequest(connection_pool_size=TELEGRAM_POOL_SIZE)
+    return _telegram_request
+
+def build_telegram_app(tenant=None):
+    """
+    Собирает PTB Application бота салона (по умолчанию основного) со всеми обработчиками диалога.
+    """
+    tenant = tenant or tenants.primary()
     application = (
         ApplicationBuilder()
-        .token(TELEGRAM_BOT_TOKEN)
+        .application_class(TracedApplication)
+        .token(tenant.bot_token)
+        .request(telegram_request())
+        # Свой адрес Bot API: локальный telegram-bot-api сервер или заменитель в bench/
+        .base_url(f"{TELEGRAM_API_BASE}/bot")
+        .base_file_url(f"{TELEGRAM_API_BASE}/file/bot")
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+        # Диалоги ботов разных салонов лежат в одном хранилище под своими префиксами
+        .persistence(StorePersistence(get_store(), prefix="" if tenant.primary else f"{tenant.key}:"))
         .build()
     )
+    application.tenant = tenant
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={
@@ -231,21 +864,192 @@ def run_tg_bot():
             FASTBOOK: [MessageHandler(filters.TEXT & ~filters.COMMAND, consult_handler)],
         },
         fallbacks=[CommandHandler('cancel', cancel)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="main",
+        persistent=True
     )
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler('cancel', cancel))
+    # Команды администратора: отвечают только в служебном чате салона
+    application.add_handler(CommandHandler('today', admin_today))
+    application.add_handler(CommandHandler('stats', admin_stats))
+    application.add_handler(CommandHandler('find', admin_find))
+    return application
+
+async def start_reminders(tenant=None):
+    # Напоминания отправляются через диспетчер салона, поэтому запускаются после него
+    reminders = get_reminders(tenant)
+    if reminders is not None:
+        await reminders.start(get_dispatcher(tenant).deliver)
+
+async def stop_reminders(tenant=None):
+    reminders = get_reminders(tenant)
+    if reminders is not None:
+        await reminders.stop()
+
+async def close_shared():
+    # Пул соединений к OpenAI общий для ассистентов всех салонов
+    await get_assistant_client().aclose()
+    get_store().close()
+
+async def post_init(application):
+    tenant = application.tenant or tenants.primary()
+    await get_dispatcher(tenant).start(application.bot)
+    await start_reminders(tenant)
+    await application.bot.set_my_commands([
+        BotCommand("start", "Начать диалог")
+    ])
+    if tenant.admin_chat_id:
+        await application.bot.set_my_commands([
+            BotCommand("start", "Начать диалог"),
+            BotCommand("today", "Записи на сегодня (или /today завтра)"),
+            BotCommand("stats", "Сводка по записям"),
+            BotCommand("find", "Заявки по телефону"),
+        ], scope=BotCommandScopeChat(tenant.admin_chat_id))
+
+async def post_shutdown(application):
+    tenant = application.tenant or tenants.primary()
+    await stop_reminders(tenant)
+    await get_dispatcher(tenant).stop()
+    if not telegram_apps:
+        # Отдельный бот (run_tg_bot); в веб-процессе общие ресурсы закрывает stop_telegram_bot
+        await close_shared()
+
+def _acquire_polling_lock():
+    """
+    Неблокирующая файл-блокировка: True только в одном процессе на хосте.
+    """
+    global _polling_lock_file
+    try:
+        import fcntl
+    except ImportError:
+        # Windows: несколько воркеров не поддерживаются, опрашиваем всегда
+        return True
+    lock_file = open(POLLING_LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _polling_lock_file = lock_file
+    return True
+
+@app.before_serving
+async def start_services():
+    """
+    Веб-API начинает отвечать сразу; прогрев интеграций и запуск ботов
+    (сетевые вызовы к Google и Telegram) идут в фоне в том же event loop,
+    поэтому боты всех салонов и API делят пул соединений к OpenAI, пул потоков
+    и клиентов Google Sheets.
+    """
+    global _startup_task
+    if TELEGRAM_MODE not in ("polling", "webhook"):
+        raise RuntimeError(f"Неизвестный TELEGRAM_MODE: {TELEGRAM_MODE} (ожидается polling или webhook)")
+    for tenant in tenants.all_tenants().values():
+        if not tenant.bot_token:
+            continue
+        if TELEGRAM_MODE == "webhook" and not tenant.webhook_secret:
+            label = "TELEGRAM_WEBHOOK_SECRET" if tenant.primary else f"webhook_secret салона {tenant.key}"
+            raise RuntimeError(f"Для TELEGRAM_MODE=webhook задайте {label}")
+        # Сборка приложения PTB не ходит в сеть; обновления webhook копятся в его очереди до старта
+        telegram_apps[tenant.key] = build_telegram_app(tenant)
+    _startup_task = asyncio.get_running_loop().create_task(_start_in_background())
+    print(f"[Startup] Веб-API готов через {time.perf_counter() - _STARTED:.2f} c после запуска процесса")
+
+async def _start_in_background():
+    started = time.perf_counter()
+    try:
+        # Индексы баз знаний строятся один раз при старте, а не на первом вопросе
+        for tenant in tenants.all_tenants().values():
+            get_faq_router(tenant)
+        # Sheets, очереди записи, каталоги и расписания — в пуле потоков, не блокируя API
+        await run_blocking(warm_up, timeout=STARTUP_TIMEOUT, name="warm_up")
+        await start_telegram_bot()
+    except asyncio.CancelledError:
+        raise
+    except Exception as ex:
+        print(f"[Startup] Ошибка фонового запуска: {ex}")
+        return
+    print(f"[Startup] Интеграции и бот запущены за {time.perf_counter() - started:.2f} c")
+
+async def start_telegram_bot():
+    for tenant in tenants.all_tenants().values():
+        if tenant.key not in telegram_apps:
+            # Салон без бота: уведомления и напоминания — напрямую через Bot API
+            await get_dispatcher(tenant).start()
+            await start_reminders(tenant)
+    if not telegram_apps:
+        print("[Telegram] TELEGRAM_BOT_TOKEN не задан — запущено только веб-API")
+        return
+    for telegram_app in telegram_apps.values():
+        await telegram_app.initialize()
+        # post_init вызывает только run_polling, при ручном запуске — вызываем сами
+        await post_init(telegram_app)
+        await telegram_app.start()
+    global _telegram_owner, _inbox_task
+    if not _acquire_polling_lock():
+        return
+    _telegram_owner = True
+    if TELEGRAM_MODE == "webhook":
+        # Обновления, которые приняли другие воркеры (и этот — до захвата блокировки)
+        _inbox_task = asyncio.get_running_loop().create_task(_drain_update_inbox())
+    for key, telegram_app in telegram_apps.items():
+        tenant = tenants.get_tenant(key)
+        if TELEGRAM_MODE == "webhook":
+            # Обновления принимает любой воркер; webhook регистрирует и обрабатывает только один
+            if TELEGRAM_WEBHOOK_URL:
+                url = TELEGRAM_WEBHOOK_URL.rstrip("/") + webhook_path(tenant)
+                await telegram_app.bot.set_webhook(
+                    url,
+                    secret_token=tenant.webhook_secret,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                print(f"[Telegram] Webhook {key}: {url}")
+        else:
+            await telegram_app.updater.start_polling()
+            print(f"[Telegram] Long polling {key} запущен в этом воркере")
+
+@app.after_serving
+async def stop_telegram_bot():
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
+        try:
+            await _startup_task
+        except (asyncio.CancelledError, Exception):
+            pass
+    if _inbox_task is not None:
+        _inbox_task.cancel()
+        try:
+            await _inbox_task
+        except asyncio.CancelledError:
+            pass
+    for tenant in tenants.all_tenants().values():
+        if tenant.key not in telegram_apps:
+            await stop_reminders(tenant)
+            await get_dispatcher(tenant).stop()
+    for telegram_app in telegram_apps.values():
+        if telegram_app.updater.running:
+            await telegram_app.updater.stop()
+        if telegram_app.running:
+            await telegram_app.stop()
+        await post_shutdown(telegram_app)
+        await telegram_app.shutdown()
+    await close_shared()
+
+def run_tg_bot():
+    """
+    Запуск только бота основного салона (без веб-API) в режиме long polling.
+    """
+    get_faq_router()
+    warm_up()
     # БЕЗ asyncio.run(...)! run_polling сам заботится о loop.
-    application.run_polling()
+    build_telegram_app().run_polling()
 
 if __name__ == "__main__":
-    threading.Thread(
-        target=lambda: app.run(
-            host="0.0.0.0",
-            port=int(os.getenv("PORT", 5000)),
-            debug=False,  # важно: reloader выключен, иначе сигнал в отдельном потоке упадет
-            use_reloader=False
-        ),
-        daemon=True
-    ).start()
-    run_tg_bot()
+    import uvicorn
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 5000)),
+        workers=WEB_WORKERS,
+    )
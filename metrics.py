@@ -0,0 +1,340 @@
+"""
+Метрики в формате Prometheus и лёгкая трассировка запросов.
+
+Гистограммы этапов (создание thread, отправка сообщения, run ассистента,
+выполнение функций, запись в Sheets, отправка уведомлений), счётчики ошибок,
+повторов и попаданий в кэш, а также текущие значения (run в работе, глубина
+очередей) отдаются в текстовом формате Prometheus: render() → /metrics.
+Внешняя библиотека не нужна: метрики — словари под общей блокировкой.
+
+Трассировка: span("telegram.update") открывает трассу обновления или HTTP-запроса,
+вложенные span()/timed() — её этапы. Текущий span хранится в contextvars,
+поэтому он переходит в задачи asyncio и в пул потоков run_blocking.
+Последние трассы доступны через recent_traces(), медленные выводятся в лог.
+"""
+import contextvars
+import functools
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_PREFIX = "salon_"
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# Трассы дольше порога (секунды) выводятся в лог с разбивкой по этапам
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name -> {"kind", "help", "buckets", "values": {labels: value | [bucket_counts, sum, count]}}
+_metrics = {}
+# Функции, которые при каждом render() возвращают [(name, kind, help, labels, value)]
+_collectors = []
+_lock = threading.Lock()
+
+
+def describe(name, kind, help_text, buckets=TIME_BUCKETS):
+    """
+    Объявляет метрику (тип и описание для # HELP / # TYPE).
+    """
+    with _lock:
+        _metrics.setdefault(name, {"kind": kind, "help": help_text, "buckets": tuple(buckets), "values": {}})
+
+
+def _values(name, kind):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = {"kind": kind, "help": "", "buckets": TIME_BUCKETS, "values": {}}
+    return metric
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, /, **labels):
+    key = _labels_key(labels)
+    with _lock:
+        values = _values(name, COUNTER)["values"]
+        values[key] = values.get(key, 0) + value
+
+
+def set_gauge(name, value, /, **labels):
+    with _lock:
+        _values(name, GAUGE)["values"][_labels_key(labels)] = value
+
+
+def add_gauge(name, delta, /, **labels):
+    key = _labels_key(labels)
+    with _lock:
+        values = _values(name, GAUGE)["values"]
+        values[key] = values.get(key, 0) + delta
+
+
+def observe(name, value, /, **labels):
+    key = _labels_key(labels)
+    with _lock:
+        metric = _values(name, HISTOGRAM)
+        state = metric["values"].get(key)
+        if state is None:
+            state = metric["values"][key] = [[0] * len(metric["buckets"]), 0.0, 0]
+        for i, bound in enumerate(metric["buckets"]):
+            if value <= bound:
+                state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+
+def register_collector(func):
+    """
+    Регистрирует источник метрик, которые считаются в момент запроса
+    (глубина очередей, статистика кэшей и индексов).
+    """
+    with _lock:
+        if func not in _collectors:
+            _collectors.append(func)
+    return func
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + escaped + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render():
+    """
+    Все метрики в текстовом формате Prometheus (text/plain; version=0.0.4).
+    """
+    collected = {}
+    for collector in list(_collectors):
+        try:
+            samples = collector() or []
+        except Exception as ex:
+            print(f"[Metrics] Ошибка сборщика {getattr(collector, '__name__', collector)}: {ex}")
+            continue
+        for name, kind, help_text, labels, value in samples:
+            entry = collected.setdefault(name, {"kind": kind, "help": help_text, "values": {}})
+            entry["values"][_labels_key(labels)] = value
+    lines = []
+    with _lock:
+        snapshot = {
+            name: {
+                "kind": metric["kind"], "help": metric["help"], "buckets": metric["buckets"],
+                "values": {key: ([list(v[0]), v[1], v[2]] if metric["kind"] == HISTOGRAM else v)
+                           for key, v in metric["values"].items()},
+            }
+            for name, metric in _metrics.items()
+        }
+    snapshot.update(collected)
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        full_name = METRICS_PREFIX + name
+        lines.append(f"# HELP {full_name} {metric['help'] or name}")
+        lines.append(f"# TYPE {full_name} {metric['kind']}")
+        for key, value in sorted(metric["values"].items()):
+            if metric["kind"] != HISTOGRAM:
+                lines.append(f"{full_name}{_format_labels(key)} {_format_value(value)}")
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(metric["buckets"], counts):
+                lines.append(f"{full_name}_bucket{_format_labels(key + (('le', _format_value(float(bound))),))} {bucket_count}")
+            lines.append(f"{full_name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{full_name}_count{_format_labels(key)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Трассировка ---
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "started", "seconds", "error")
+
+    def __init__(self, trace, name, parent_id, attrs):
+        self.trace = trace
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+    def as_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "offset_ms": round((self.started - self.trace.started) * 1000, 1),
+            "duration_ms": None if self.seconds is None else round(self.seconds * 1000, 1),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "started", "wall_time", "spans", "_lock")
+
+    def __init__(self, name):
+        self.trace_id = f"{next(_trace_ids):x}-{os.getpid():x}"
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def as_dict(self):
+        with self._lock:
+            spans = [span.as_dict() for span in self.spans]
+        root = spans[0] if spans else {}
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.wall_time,
+            "duration_ms": root.get("duration_ms"),
+            "spans": spans,
+        }
+
+
+_trace_ids = itertools.count(1)
+_span_ids = itertools.count(1)
+_current = contextvars.ContextVar("metrics_span", default=None)
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def current_span():
+    return _current.get()
+
+
+def current_trace_id():
+    span = _current.get()
+    return span.trace.trace_id if span is not None else None
+
+
+@contextmanager
+def span(name, /, **attrs):
+    """
+    Этап трассы. Без открытой трассы начинает новую (корневой span).
+    """
+    parent = _current.get()
+    trace = parent.trace if parent is not None else Trace(name)
+    item = Span(trace, name, parent.span_id if parent is not None else None, attrs)
+    trace.add(item)
+    token = _current.set(item)
+    try:
+        yield item
+    except BaseException as ex:
+        item.error = f"{type(ex).__name__}: {ex}"
+        raise
+    finally:
+        item.seconds = time.perf_counter() - item.started
+        _current.reset(token)
+        if parent is None:
+            _finish(trace, item)
+
+
+def _finish(trace, root):
+    _traces.append(trace)
+    if root.seconds >= TRACE_SLOW_SECONDS:
+        with trace._lock:
+            stages = sorted((s for s in trace.spans if s is not root and s.seconds), key=lambda s: -s.seconds)
+        details = ", ".join(f"{s.name} {s.seconds:.2f} c" for s in stages[:5])
+        print(f"[Trace] {trace.name} {trace.trace_id}: {root.seconds:.2f} c ({details})")
+
+
+@contextmanager
+def timed(stage, /, **attrs):
+    """
+    Этап с замером: span трассы + гистограмма stage_seconds{stage}
+    и счётчик errors_total{stage} при исключении.
+    """
+    started = time.perf_counter()
+    try:
+        with span(stage, **attrs) as item:
+            yield item
+    except BaseException:
+        inc("errors_total", stage=stage)
+        raise
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage)
+
+
+def record(stage, seconds, error=None, /, **attrs):
+    """
+    Этап, замеренный вручную (например, в async-генераторе, где span через yield
+    держать нельзя): гистограмма и готовый span в текущей трассе.
+    """
+    observe("stage_seconds", seconds, stage=stage)
+    if error is not None:
+        inc("errors_total", stage=stage)
+    parent = _current.get()
+    if parent is not None:
+        item = Span(parent.trace, stage, parent.span_id, attrs)
+        item.started -= seconds
+        item.seconds = seconds
+        item.error = error
+        parent.trace.add(item)
+
+
+def traced(name, kind="http"):
+    """
+    Декоратор корутины-обработчика: корневой span запроса и гистограмма request_seconds.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span(name):
+                    return await func(*args, **kwargs)
+            finally:
+                observe("request_seconds", time.perf_counter() - started, kind=kind, name=name)
+        return wrapper
+    return decorator
+
+
+def recent_traces(limit=50, min_ms=0.0):
+    """
+    Последние завершённые трассы (новые первыми), не короче min_ms.
+    """
+    result = []
+    for trace in reversed(list(_traces)):
+        data = trace.as_dict()
+        if (data["duration_ms"] or 0) >= min_ms:
+            result.append(data)
+            if len(result) >= limit:
+                break
+    return result
+
+
+describe("stage_seconds", HISTOGRAM, "Длительность этапов обработки (OpenAI, функции, Sheets, уведомления)")
+describe("run_polls", HISTOGRAM, "Число опросов статуса run до завершения", COUNT_BUCKETS)
+describe("request_seconds", HISTOGRAM, "Длительность обработки HTTP-запроса или обновления Telegram")
+describe("errors_total", COUNTER, "Ошибки по этапам")
+describe("retries_total", COUNTER, "Повторы внешних вызовов")
+describe("cache_hits_total", COUNTER, "Ответы без обращения к OpenAI (faq — база знаний, cache — кэш ответов)")
+describe("cache_misses_total", COUNTER, "Вопросы, ушедшие к ассистенту")
+describe("runs_in_flight", GAUGE, "Ходы ассистента, выполняемые сейчас")
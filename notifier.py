@@ -0,0 +1,259 @@
+"""
+Асинхронная отправка уведомлений администратору.
+
+Уведомления складываются в ограниченную очередь и отправляются одним
+асинхронным воркером в event loop бота: через уже запущенный PTB Bot или
+через общий keep-alive клиент httpx. Воркер соблюдает паузу между сообщениями
+в один чат, ждёт retry_after при ответе 429, а при накоплении очереди
+склеивает уведомления в сводные сообщения.
+
+У каждого салона (tenants) свой диспетчер: уведомления уходят от его бота
+в его служебный чат, паузы и retry_after считаются на бота.
+"""
+import asyncio
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+import metrics
+import tenants
+
+load_dotenv()
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+# Пауза между сообщениями в один чат (для групп Telegram — около 20 сообщений в минуту)
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "3.0"))
+# С какой глубины очереди уведомления склеиваются в сводку и сколько максимум в одной сводке
+NOTIFY_DIGEST_THRESHOLD = int(os.getenv("NOTIFY_DIGEST_THRESHOLD", "3"))
+NOTIFY_DIGEST_MAX = 20
+NOTIFY_MAX_RETRIES = 5
+TG_MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n———\n\n"
+
+
+class PermanentDeliveryError(Exception):
+    """
+    Ошибка, которую повтор не исправит (чат не найден, бот заблокирован и т.п.).
+    """
+
+
+def build_digest(texts):
+    """
+    Склеивает несколько уведомлений в сообщения не длиннее лимита Telegram.
+    """
+    if len(texts) == 1:
+        return [texts[0][:TG_MESSAGE_LIMIT]]
+    header = f"📬 Сводка: {len(texts)} уведомлений\n\n"
+    messages, current = [], header
+    for text in texts:
+        text = text[:TG_MESSAGE_LIMIT - len(header)]
+        candidate = current + (DIGEST_SEPARATOR if current != header else "") + text
+        if len(candidate) > TG_MESSAGE_LIMIT:
+            messages.append(current)
+            current = header + text
+        else:
+            current = candidate
+    messages.append(current)
+    return messages
+
+
+class NotificationDispatcher:
+    """
+    Очередь уведомлений с одним асинхронным воркером.
+
+    submit() можно вызывать из любого потока; start()/stop() — в event loop,
+    где должен работать воркер.
+    """
+
+    def __init__(self, token=None, default_chat_id=None, queue_size=NOTIFY_QUEUE_SIZE,
+                 chat_interval=NOTIFY_CHAT_INTERVAL, digest_threshold=NOTIFY_DIGEST_THRESHOLD):
+        self.token = token or TELEGRAM_BOT_TOKEN
+        self.default_chat_id = default_chat_id or ADMIN_CHAT_ID
+        self.queue_size = queue_size
+        self.chat_interval = chat_interval
+        self.digest_threshold = digest_threshold
+        self.stats = {"submitted": 0, "sent": 0, "digests": 0, "dropped": 0, "retries": 0, "failed": 0}
+        self._queue = None
+        self._loop = None
+        self._worker = None
+        self._bot = None
+        self._http = None
+        self._next_allowed = {}
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    def qsize(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self, bot=None):
+        """
+        Запускает воркер в текущем event loop. bot — экземпляр telegram.Bot (необязательно).
+        """
+        if self.running:
+            return self
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._bot = bot
+        if bot is None:
+            self._http = httpx.AsyncClient(base_url=TELEGRAM_API_BASE, timeout=10)
+        self._worker = asyncio.create_task(self._run(), name="notification-dispatcher")
+        return self
+
+    async def stop(self, timeout=10):
+        """
+        Отправляет оставшиеся уведомления и останавливает воркер.
+        """
+        if self.running:
+            self._put(None)
+            try:
+                await asyncio.wait_for(self._worker, timeout)
+            except asyncio.TimeoutError:
+                self._worker.cancel()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self._worker = None
+
+    def submit(self, text, chat_id=None):
+        """
+        Ставит уведомление в очередь. Потокобезопасно.
+        Возвращает False, если воркер не запущен (вызывающий решает, как отправить сам).
+        """
+        chat_id = chat_id or self.default_chat_id
+        if not self.running or not chat_id:
+            return False
+        self.stats["submitted"] += 1
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._put((str(chat_id), text))
+        else:
+            self._loop.call_soon_threadsafe(self._put, (str(chat_id), text))
+        return True
+
+    async def deliver(self, chat_id, text):
+        """
+        Отправка в обход очереди и сводок (с паузой на чат и повторами) — для
+        напоминаний клиентам. Вызывается в event loop воркера; True, если доставлено.
+        """
+        if not self.running:
+            return False
+        return await self._deliver(str(chat_id), text[:TG_MESSAGE_LIMIT])
+
+    def _put(self, item):
+        if self._queue.full():
+            # Очередь ограничена: вытесняем самое старое уведомление
+            dropped = self._queue.get_nowait()
+            if dropped is None:
+                self._queue.put_nowait(None)
+                return
+            self.stats["dropped"] += 1
+            print(f"[Telegram] Очередь уведомлений переполнена, пропущено: {dropped[1][:80]!r}")
+        self._queue.put_nowait(item)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Очередь копится — забираем пачку и отправляем сводкой
+            if self._queue.qsize() >= self.digest_threshold:
+                while len(batch) < NOTIFY_DIGEST_MAX and not self._queue.empty():
+                    extra = self._queue.get_nowait()
+                    if extra is None:
+                        stopping = True
+                        break
+                    batch.append(extra)
+            by_chat = {}
+            for chat_id, text in batch:
+                by_chat.setdefault(chat_id, []).append(text)
+            for chat_id, texts in by_chat.items():
+                if len(texts) > 1:
+                    self.stats["digests"] += 1
+                for message in build_digest(texts):
+                    await self._deliver(chat_id, message)
+        # Дописываем то, что успели поставить до остановки
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                await self._deliver(*item)
+
+    async def _deliver(self, chat_id, text):
+        for attempt in range(NOTIFY_MAX_RETRIES):
+            wait = self._next_allowed.get(chat_id, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                with metrics.timed("notification.send", attempt=attempt):
+                    retry_after = await self._send(chat_id, text)
+            except PermanentDeliveryError as ex:
+                self.stats["failed"] += 1
+                print(f"[Telegram] Уведомление отклонено: {ex}")
+                return False
+            except Exception as ex:
+                retry_after = min(30.0, 2.0 ** attempt)
+                print(f"[Telegram] Сетевая ошибка: {ex}")
+            if retry_after is None:
+                self._next_allowed[chat_id] = time.monotonic() + self.chat_interval
+                self.stats["sent"] += 1
+                return True
+            self.stats["retries"] += 1
+            metrics.inc("retries_total", component="notification")
+            self._next_allowed[chat_id] = time.monotonic() + retry_after
+        self.stats["failed"] += 1
+        print(f"[Telegram] Уведомление не доставлено после {NOTIFY_MAX_RETRIES} попыток")
+        return False
+
+    async def _send(self, chat_id, text):
+        """
+        Отправляет сообщение. Возвращает None при успехе или паузу (сек) до повтора.
+        """
+        if self._bot is not None:
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text)
+                return None
+            except RetryAfter as ex:
+                return float(ex.retry_after)
+            except (BadRequest, Forbidden) as ex:
+                raise PermanentDeliveryError(str(ex))
+        resp = await self._http.post(
+            f"/bot{self.token}/sendMessage", data={"chat_id": chat_id, "text": text}
+        )
+        if resp.status_code == 200:
+            return None
+        if resp.status_code == 429:
+            return float(resp.json().get("parameters", {}).get("retry_after", 1))
+        if 400 <= resp.status_code < 500:
+            raise PermanentDeliveryError(f"{resp.status_code} - {resp.text}")
+        print(f"[Telegram] Ошибка: {resp.status_code} - {resp.text}")
+        return 2.0
+
+
+_dispatchers = tenants.PerTenant(lambda tenant: NotificationDispatcher(tenant.bot_token, tenant.admin_chat_id))
+
+
+def get_dispatcher(tenant=None):
+    """
+    Диспетчер уведомлений салона (по умолчанию текущего).
+    """
+    return _dispatchers.get(tenant)
+
+
+def all_dispatchers():
+    """
+    Уже созданные диспетчеры: [(ключ салона, NotificationDispatcher)].
+    """
+    return _dispatchers.items()
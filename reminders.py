@@ -0,0 +1,339 @@
+"""
+Напоминания клиентам о записи.
+
+Для каждой новой заявки ставятся напоминания за REMINDER_OFFSETS_HOURS часов
+до начала (по умолчанию за 24 и за 2 часа). Очередь хранится в SQLite:
+индекс по времени срабатывания — это приоритетная очередь на диске, поэтому
+постановка и отмена стоят O(log n), а ближайшее напоминание — один запрос
+MIN(due) по индексу. Воркер в event loop бота спит до ближайшего срабатывания
+(и не дольше REMINDER_MAX_SLEEP), таблицу заявок не читает, так что десятки
+тысяч будущих напоминаний в простое ничего не стоят и переживают перезапуск.
+
+Срабатывания забираются пачками с «арендой» (UPDATE due на REMINDER_CLAIM_SECONDS
+вперёд): при нескольких воркерах напоминание отправит только один. Отправка —
+через диспетчер уведомлений (пауза на чат, retry_after) с общим лимитом
+REMINDER_RATE сообщений в секунду; неотправленное напоминание повторяется
+с паузой, всего до REMINDER_MAX_ATTEMPTS попыток. Заявки из бота напоминают
+клиенту в его чат, заявки с сайта и от ассистента — администратору
+(позвонить клиенту).
+
+У каждого салона (tenants) своя очередь и свой воркер: напоминание уходит
+через бота салона, а лимит REMINDER_RATE действует на каждого бота отдельно.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from availability import parse_datetime
+import tenants
+from executor import run_blocking
+
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1") == "1"
+REMINDERS_PATH = os.getenv(
+    "REMINDERS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reminders.db")
+)
+# За сколько часов до записи напоминать
+REMINDER_OFFSETS_HOURS = tuple(
+    float(hours) for hours in os.getenv("REMINDER_OFFSETS_HOURS", "24,2").split(",") if hours.strip()
+)
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "50"))
+# Лимит отправки напоминаний на бота (Telegram — около 30 сообщений в секунду)
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))
+# На сколько секунд воркер «арендует» напоминание перед отправкой
+REMINDER_CLAIM_SECONDS = 300.0
+# Дольше не спим, чтобы увидеть напоминания, поставленные другими воркерами
+REMINDER_MAX_SLEEP = float(os.getenv("REMINDER_MAX_SLEEP", "60"))
+# Попыток отправки одного напоминания и пауза перед повтором (удваивается)
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "3"))
+REMINDER_RETRY_SECONDS = 60.0
+# Пауза воркера после ошибки базы или пула потоков (удваивается до REMINDER_MAX_SLEEP)
+ERROR_BACKOFF = 1.0
+
+
+def booking_start(date_text, tz=None):
+    """
+    Начало записи (ДД.ММ.ГГГГ ЧЧ:ММ, время салона в часовом поясе tz,
+    по умолчанию — текущего салона) как timestamp или None.
+    """
+    moment = parse_datetime(date_text)
+    if moment is None:
+        return None
+    return (tz or tenants.current().tz).localize(moment).timestamp()
+
+
+def format_offset(hours):
+    if hours % 24 == 0:
+        days = int(hours // 24)
+        return "завтра" if days == 1 else f"через {days} дн."
+    if hours >= 1:
+        return f"через {hours:g} ч"
+    return f"через {int(hours * 60)} мин"
+
+
+def reminder_text(data, hours, to_client):
+    master = f", мастер {data['master']}" if data.get("master") else ""
+    if to_client:
+        return (
+            f"⏰ Напоминаем: {format_offset(hours)} у вас запись — {data.get('service', '')}, "
+            f"{data.get('date', '')}{master}.\n"
+            "Ждём вас! Если планы изменились, пожалуйста, сообщите нам."
+        )
+    return (
+        f"⏰ Напомните клиенту о записи ({format_offset(hours)}): "
+        f"{data.get('name', '—')}, {data.get('phone', '—')} — {data.get('service', '')}, "
+        f"{data.get('date', '')}{master}"
+    )
+
+
+class ReminderScheduler:
+    """
+    Постоянная очередь напоминаний с асинхронным воркером.
+
+    schedule()/cancel() потокобезопасны; start(send)/stop() — в event loop,
+    где работает воркер. send(chat_id, text) — корутина, True при доставке.
+    admin_chat_id и tz — служебный чат и часовой пояс салона (без tz — текущего салона).
+    """
+
+    def __init__(self, path=REMINDERS_PATH, admin_chat_id=None, tz=None, offsets=REMINDER_OFFSETS_HOURS,
+                 batch_size=REMINDER_BATCH_SIZE, rate=REMINDER_RATE, max_sleep=REMINDER_MAX_SLEEP,
+                 max_attempts=REMINDER_MAX_ATTEMPTS, retry_delay=REMINDER_RETRY_SECONDS):
+        self.admin_chat_id = admin_chat_id
+        self.tz = tz
+        self.offsets = offsets
+        self.batch_size = batch_size
+        self.interval = 1.0 / rate if rate else 0.0
+        self.max_sleep = max_sleep
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stats = {"scheduled": 0, "cancelled": 0, "sent": 0, "failed": 0, "retried": 0, "expired": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._worker = None
+        self._send = None
+        self._sleep_until = None
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS reminders ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, booking TEXT NOT NULL, "
+            "due REAL NOT NULL, expires REAL NOT NULL, chat_id TEXT NOT NULL, text TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [name for _, name, *_ in self._db.execute("PRAGMA table_info(reminders)")]
+        if "attempts" not in columns:
+            # Очередь, созданная до появления повторов
+            self._db.execute("ALTER TABLE reminders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS reminders_due ON reminders (due)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS reminders_booking ON reminders (booking)")
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    # --- Очередь ---
+
+    def schedule(self, booking_key, data, chat_id):
+        """
+        Ставит напоминания по заявке data (date — ДД.ММ.ГГГГ ЧЧ:ММ). chat_id — чат
+        клиента в Telegram или None (тогда напоминание уходит администратору).
+        Возвращает число поставленных напоминаний.
+        """
+        start = booking_start(data.get("date") or data.get("datetime") or "", self.tz)
+        target = chat_id or self.admin_chat_id
+        if start is None or not target:
+            return 0
+        now = time.time()
+        items = [
+            (f"{booking_key}:{hours:g}", booking_key, start - hours * 3600, start, str(target),
+             reminder_text(data, hours, bool(chat_id)))
+            for hours in self.offsets if start - hours * 3600 > now
+        ]
+        if not items:
+            return 0
+        with self._lock:
+            added = sum(
+                self._db.execute(
+                    "INSERT OR IGNORE INTO reminders (key, booking, due, expires, chat_id, text) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", item
+                ).rowcount
+                for item in items
+            )
+        self.stats["scheduled"] += added
+        self._wake(min(item[2] for item in items))
+        return added
+
+    def cancel(self, booking_keys):
+        """
+        Отменяет напоминания заявок (ключи bookings_mirror.row_key). Возвращает число отменённых.
+        """
+        with self._lock:
+            removed = sum(
+                self._db.execute("DELETE FROM reminders WHERE booking = ?", (key,)).rowcount
+                for key in booking_keys
+            )
+        self.stats["cancelled"] += removed
+        return removed
+
+    def next_due(self):
+        with self._lock:
+            return self._db.execute("SELECT MIN(due) FROM reminders").fetchone()[0]
+
+    def pending_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+
+    def claim_due(self, now=None):
+        """
+        Забирает пачку наступивших напоминаний: [(id, chat_id, text, expires, attempts)].
+        Пока напоминание не отправлено и не удалено, другие воркеры его не видят.
+        """
+        now = now or time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, due, chat_id, text, expires, attempts FROM reminders WHERE due <= ? ORDER BY due LIMIT ?",
+                (now, self.batch_size),
+            ).fetchall()
+            claimed = []
+            for reminder_id, due, chat_id, text, expires, attempts in rows:
+                if self._db.execute(
+                    "UPDATE reminders SET due = ? WHERE id = ? AND due = ?",
+                    (now + REMINDER_CLAIM_SECONDS, reminder_id, due),
+                ).rowcount:
+                    claimed.append((reminder_id, chat_id, text, expires, attempts))
+        return claimed
+
+    def done(self, reminder_id):
+        with self._lock:
+            self._db.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
+
+    def retry(self, reminder_id, attempts):
+        """
+        Возвращает неотправленное напоминание в очередь с паузой.
+        False, если попытки исчерпаны и напоминание удалено.
+        """
+        attempts += 1
+        if attempts >= self.max_attempts:
+            self.done(reminder_id)
+            return False
+        with self._lock:
+            self._db.execute(
+                "UPDATE reminders SET due = ?, attempts = ? WHERE id = ?",
+                (time.time() + self.retry_delay * 2 ** (attempts - 1), attempts, reminder_id),
+            )
+        return True
+
+    # --- Воркер ---
+
+    def _wake(self, due):
+        # Новое напоминание раньше, чем проснётся воркер, — будим его
+        if self._loop is None or (self._sleep_until is not None and due >= self._sleep_until):
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass
+
+    async def start(self, send):
+        if self.running:
+            return self
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._send = send
+        self._worker = asyncio.create_task(self._run(), name="reminders")
+        return self
+
+    async def stop(self):
+        if self.running:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self._loop = None
+
+    async def _deliver(self, reminder_id, chat_id, text, expires, attempts):
+        if expires <= time.time():
+            # Воркер не работал, а запись уже началась — напоминать поздно
+            self.stats["expired"] += 1
+            await run_blocking(self.done, reminder_id, name="reminders.done")
+            return
+        try:
+            sent = await self._send(chat_id, text)
+        except Exception as ex:
+            print(f"[Reminders] Ошибка отправки напоминания {reminder_id}: {ex}")
+            sent = False
+        if sent:
+            self.stats["sent"] += 1
+            await run_blocking(self.done, reminder_id, name="reminders.done")
+        elif await run_blocking(self.retry, reminder_id, attempts, name="reminders.retry"):
+            self.stats["retried"] += 1
+        else:
+            self.stats["failed"] += 1
+
+    async def _run(self):
+        backoff = ERROR_BACKOFF
+        while True:
+            try:
+                await self._step()
+                backoff = ERROR_BACKOFF
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                # Занятый пул, таймаут или ошибка SQLite не должны останавливать воркер
+                self.stats["errors"] += 1
+                print(f"[Reminders] Ошибка воркера напоминаний, повтор через {backoff:.0f} c: {ex}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_sleep)
+
+    async def _step(self):
+        """
+        Отправляет наступившие напоминания и спит до следующего.
+        """
+        batch = await run_blocking(self.claim_due, name="reminders.claim")
+        for item in batch:
+            await self._deliver(*item)
+            if self.interval:
+                await asyncio.sleep(self.interval)
+        if len(batch) >= self.batch_size:
+            return
+        # Сброс до запроса: напоминание, поставленное во время запроса, разбудит воркер
+        self._wakeup.clear()
+        next_due = await run_blocking(self.next_due, name="reminders.next_due")
+        now = time.time()
+        self._sleep_until = min(next_due, now + self.max_sleep) if next_due is not None else now + self.max_sleep
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), max(0.0, self._sleep_until - now))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._sleep_until = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_schedulers = tenants.PerTenant(
+    lambda tenant: ReminderScheduler(tenant.path(REMINDERS_PATH), tenant.admin_chat_id, tenant.tz)
+)
+
+
+def get_reminders(tenant=None):
+    """
+    Очередь напоминаний салона (по умолчанию текущего); None, если выключена через REMINDERS_ENABLED=0.
+    """
+    if not REMINDERS_ENABLED:
+        return None
+    return _schedulers.get(tenant)
+
+
+def all_reminders():
+    """
+    Уже созданные очереди напоминаний: [(ключ салона, ReminderScheduler)].
+    """
+    return _schedulers.items()
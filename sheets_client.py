@@ -0,0 +1,124 @@
+"""
+Потокобезопасный доступ к Google Sheets API.
+
+Транспорт httplib2 под googleapiclient нельзя использовать из нескольких
+потоков одновременно, поэтому у каждого потока (пул run_blocking, очередь
+записи, обновление каталога и расписания) свой авторизованный клиент.
+Клиенты создаются из один раз прочитанного встроенного discovery-документа
+(без запросов к сети, файл читается с диска один раз), а токен сервисного
+аккаунта общий: обновляется под блокировкой одним потоком.
+
+SheetsClientPool ведёт себя как service.spreadsheets(): values(), batchUpdate() и т.д.
+Запрос нужно выполнять (execute) в том же потоке, где он создан.
+"""
+import os
+import threading
+
+SHEETS_HTTP_TIMEOUT = float(os.getenv("SHEETS_HTTP_TIMEOUT", "30"))
+
+
+def load_discovery_document(api="sheets", version="v4"):
+    """
+    Discovery-документ из пакета googleapiclient (без обращения к сети).
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+    document = get_static_doc(api, version)
+    if document is None:
+        raise RuntimeError(f"Нет встроенного discovery-документа для {api} {version}")
+    return document
+
+
+class SharedCredentials:
+    """
+    Общие для потоков учётные данные: токен обновляет один поток, остальные
+    ждут его и используют тот же токен.
+    """
+
+    def __init__(self, credentials):
+        self._credentials = credentials
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def __getattr__(self, name):
+        return getattr(self._credentials, name)
+
+    def refresh(self, request):
+        with self._lock:
+            self._credentials.refresh(request)
+            self.refreshes += 1
+
+    def before_request(self, request, method, url, headers):
+        if not self._credentials.valid:
+            with self._lock:
+                # Пока ждали блокировку, токен мог обновить другой поток
+                if not self._credentials.valid:
+                    self._credentials.refresh(request)
+                    self.refreshes += 1
+        self._credentials.apply(headers)
+
+
+class SheetsClientPool:
+    """
+    Клиент spreadsheets() на каждый поток с общими учётными данными и discovery-документом.
+    """
+
+    def __init__(self, credentials, timeout=SHEETS_HTTP_TIMEOUT):
+        self.credentials = SharedCredentials(credentials)
+        self.timeout = timeout
+        self._document = None
+        self._document_lock = threading.Lock()
+        self._local = threading.local()
+        self._clients = 0
+        self._clients_lock = threading.Lock()
+
+    @classmethod
+    def from_service_account_file(cls, path, scopes, **kwargs):
+        from google.oauth2 import service_account
+        credentials = service_account.Credentials.from_service_account_file(path, scopes=scopes)
+        return cls(credentials, **kwargs)
+
+    def _discovery(self):
+        if self._document is None:
+            with self._document_lock:
+                if self._document is None:
+                    self._document = load_discovery_document()
+        return self._document
+
+    def _build(self):
+        import google_auth_httplib2
+        import httplib2
+        from googleapiclient.discovery import build_from_document
+        http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+        service = build_from_document(self._discovery(), http=http)
+        with self._clients_lock:
+            self._clients += 1
+        return service.spreadsheets()
+
+    def client(self):
+        """
+        Ресурс spreadsheets() текущего потока.
+        """
+        spreadsheets = getattr(self._local, "spreadsheets", None)
+        if spreadsheets is None:
+            spreadsheets = self._local.spreadsheets = self._build()
+        return spreadsheets
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self.client().values()
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+    def warm_up(self):
+        """
+        Заранее читает discovery-документ (при старте, а не на первой заявке).
+        """
+        self._discovery()
+        return self
+
+    @property
+    def stats(self):
+        return {"clients": self._clients, "token_refreshes": self.credentials.refreshes}
@@ -0,0 +1,301 @@
+"""
+Отложенная (write-behind) запись заявок в Google Sheets.
+
+Заявка сначала сохраняется в локальную очередь SQLite (режим WAL) и сразу
+считается принятой. Фоновый поток забирает накопившиеся строки и отправляет
+их одним вызовом values().append, соблюдая квоту Sheets API на запросы в
+минуту и повторяя неудачные попытки с экспоненциальной задержкой.
+Строки удаляются из очереди только после успешной записи в таблицу.
+
+Очередь может быть общей для нескольких воркеров uvicorn: перед отправкой
+строки берутся в аренду (lease), поэтому каждую пачку отправляет один воркер.
+Аренда упавшего воркера истекает, и строки подхватывают остальные.
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import metrics
+
+SHEETS_QUEUE_PATH = os.getenv(
+    "SHEETS_QUEUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sheets_queue.db")
+)
+# Сколько строк отправлять одним append
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "50"))
+# Сколько ждать после первой заявки, чтобы собрать пачку
+SHEETS_LINGER = float(os.getenv("SHEETS_LINGER", "0.5"))
+# Квота Sheets API на запись: запросов в минуту (с запасом от лимита 60)
+SHEETS_REQUESTS_PER_MINUTE = int(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "50"))
+# На сколько секунд воркер забирает пачку (дольше одного вызова append)
+SHEETS_LEASE_SECONDS = float(os.getenv("SHEETS_LEASE_SECONDS", "120"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+
+# HTTP-статусы, при которых запись стоит повторить позже
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+# Нет доступа к таблице: повтор не поможет, дело не в строках
+ACCESS_STATUSES = (401, 403)
+
+
+def _error_status(ex):
+    """
+    HTTP-статус ошибки googleapiclient (HttpError.resp.status) или None для сетевых ошибок.
+    """
+    status = getattr(getattr(ex, "resp", None), "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class BookingQueue:
+    """
+    Долговременная очередь строк для Google Sheets с фоновой отправкой пачками.
+
+    sheets — объект spreadsheets() из googleapiclient или FakeSheetsService.
+    """
+
+    def __init__(self, sheets, spreadsheet_id, path=SHEETS_QUEUE_PATH, range_="A2",
+                 batch_size=SHEETS_BATCH_SIZE, linger=SHEETS_LINGER,
+                 requests_per_minute=SHEETS_REQUESTS_PER_MINUTE, lease_seconds=SHEETS_LEASE_SECONDS):
+        self.sheets = sheets
+        self.spreadsheet_id = spreadsheet_id
+        self.range = range_
+        self.batch_size = batch_size
+        self.linger = linger
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        # Одна пачка в полёте: фоновый поток и flush() не отправляют строки дважды
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._last_request = 0.0
+        self._failures = 0
+        self._retry_at = 0.0
+        self._single_row_mode = False
+        self.stats = {"enqueued": 0, "appended_rows": 0, "requests": 0, "errors": 0, "dead": 0}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, row TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, lease REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [name for _, name, *_ in self._db.execute("PRAGMA table_info(pending)")]
+        if "lease" not in columns:
+            # Очередь, созданная до появления аренды
+            self._db.execute("ALTER TABLE pending ADD COLUMN lease REAL NOT NULL DEFAULT 0")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead ("
+            "id INTEGER PRIMARY KEY, row TEXT NOT NULL, error TEXT, created REAL NOT NULL)"
+        )
+
+    # --- Приём заявок ---
+
+    def enqueue(self, row):
+        """
+        Сохраняет строку в очередь и будит фоновый поток. Возвращает id записи.
+        """
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO pending (row, created) VALUES (?, ?)",
+                (json.dumps(row, ensure_ascii=False), time.time()),
+            )
+            self.stats["enqueued"] += 1
+        self._wakeup.set()
+        return cur.lastrowid
+
+    def pending_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def pending_rows(self):
+        """
+        Строки, ещё не записанные в таблицу (в порядке поступления).
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT row FROM pending ORDER BY id").fetchall()
+        return [json.loads(raw) for raw, in rows]
+
+    # --- Отправка ---
+
+    def _next_batch(self):
+        """
+        Берёт в аренду пачку строк, которые не отправляет другой воркер: [(id, row)].
+        """
+        limit = 1 if self._single_row_mode else self.batch_size
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, row, lease FROM pending WHERE lease <= ? ORDER BY id LIMIT ?", (now, limit)
+            ).fetchall()
+            claimed = []
+            for row_id, raw, lease in rows:
+                if self._db.execute(
+                    "UPDATE pending SET lease = ? WHERE id = ? AND lease = ?",
+                    (now + self.lease_seconds, row_id, lease),
+                ).rowcount:
+                    claimed.append((row_id, raw))
+        return claimed
+
+    def _release(self, ids, delay=0.0):
+        # Строки снова доступны всем воркерам (не раньше, чем через delay секунд)
+        with self._lock:
+            self._db.executemany(
+                "UPDATE pending SET lease = ? WHERE id = ?", [(time.time() + delay, i) for i in ids]
+            )
+
+    def _pace(self):
+        """
+        Выдерживает минимальный интервал между запросами к Sheets API.
+        """
+        wait = self._last_request + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_request = time.monotonic()
+
+    def flush_once(self):
+        """
+        Отправляет одну пачку. Возвращает число записанных строк
+        (0 — очередь пуста, None — ошибка, пачка осталась в очереди).
+        """
+        with self._flush_lock:
+            return self._flush_batch()
+
+    def _flush_batch(self):
+        batch = self._next_batch()
+        if not batch:
+            self._single_row_mode = False
+            return 0
+        ids = [row_id for row_id, _ in batch]
+        rows = [json.loads(raw) for _, raw in batch]
+        self._pace()
+        self.stats["requests"] += 1
+        try:
+            with metrics.timed("sheets.append", rows=len(rows)):
+                self.sheets.values().append(
+                    spreadsheetId=self.spreadsheet_id,
+                    range=self.range,
+                    valueInputOption="USER_ENTERED",
+                    insertDataOption="INSERT_ROWS",
+                    body={"values": rows},
+                ).execute()
+        except Exception as ex:
+            self._on_error(ex, batch)
+            return None
+        with self._lock:
+            self._db.executemany("DELETE FROM pending WHERE id = ?", [(i,) for i in ids])
+        self.stats["appended_rows"] += len(rows)
+        self._failures = 0
+        self._retry_at = 0.0
+        return len(rows)
+
+    def _on_error(self, ex, batch):
+        self.stats["errors"] += 1
+        status = _error_status(ex)
+        ids = [row_id for row_id, _ in batch]
+        with self._lock:
+            self._db.executemany("UPDATE pending SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+        if status in ACCESS_STATUSES:
+            self._bury(batch, ex)
+            print(f"[GoogleSheets] Нет доступа к таблице ({status}), заявок отложено в dead: {len(batch)}: {ex}")
+            return
+        if status is not None and status not in RETRYABLE_STATUSES:
+            # Ошибка в данных: ищем «плохую» строку, отправляя по одной
+            if len(batch) > 1:
+                self._single_row_mode = True
+                self._release(ids)
+                print(f"[GoogleSheets] Пачка отклонена ({status}), повтор по одной строке: {ex}")
+                return
+            self._bury(batch, ex)
+            print(f"[GoogleSheets] Строка {batch[0][0]} отклонена таблицей и отложена в dead: {ex}")
+            return
+        self._failures += 1
+        metrics.inc("retries_total", component="sheets")
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._failures - 1))
+        delay *= random.uniform(0.8, 1.2)
+        self._retry_at = time.monotonic() + delay
+        # Другие воркеры тоже не повторяют пачку раньше паузы
+        self._release(ids, delay)
+        print(f"[GoogleSheets] Ошибка при добавлении заявок ({len(batch)} шт.), повтор через {delay:.1f} c: {ex}")
+
+    def _bury(self, batch, ex):
+        with self._lock:
+            for row_id, raw in batch:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO dead (id, row, error, created) VALUES (?, ?, ?, ?)",
+                    (row_id, raw, str(ex), time.time()),
+                )
+                self._db.execute("DELETE FROM pending WHERE id = ?", (row_id,))
+        self.stats["dead"] += len(batch)
+
+    def flush(self, timeout=None):
+        """
+        Синхронно отправляет всю очередь (для остановки процесса и тестов).
+        Возвращает True, если очередь опустела за отведённое время.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    return False
+                time.sleep(wait)
+            sent = self.flush_once()
+            if sent == 0:
+                return True
+            if deadline is not None and time.monotonic() > deadline:
+                return self.pending_count() == 0
+
+    # --- Фоновый поток ---
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="sheets-flusher", daemon=True)
+            self._thread.start()
+            # Строки, оставшиеся с прошлого запуска, отправляются сразу
+            self._wakeup.set()
+        return self
+
+    def stop(self, drain=True, timeout=30):
+        """
+        Останавливает фоновый поток; при drain=True дописывает очередь.
+        """
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        drained = self.flush(timeout) if drain else self.pending_count() == 0
+        return drained
+
+    def _run(self):
+        while not self._stopping:
+            # Без новых заявок тоже просыпаемся: аренда упавшего воркера могла истечь
+            self._wakeup.wait(self.lease_seconds)
+            if self._stopping:
+                break
+            # Небольшая пауза, чтобы собрать заявки из всплеска в одну пачку
+            time.sleep(self.linger)
+            self._wakeup.clear()
+            while not self._stopping:
+                wait = self._retry_at - time.monotonic()
+                if wait > 0:
+                    self._wakeup.wait(wait)
+                    self._wakeup.clear()
+                    continue
+                sent = self.flush_once()
+                if sent == 0:
+                    break
+
+    def close(self):
+        self.stop(drain=False, timeout=5)
+        with self._lock:
+            self._db.close()
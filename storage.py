@@ -0,0 +1,401 @@
+"""
+Долговременное хранилище состояния бота: связки пользователь → thread_id,
+состояния ConversationHandler и незавершённые заявки (context.user_data).
+
+Хранилище — это ключ-значение с TTL и отложенной пакетной записью.
+Бэкенды: SQLite (по умолчанию, один файл на хост) и Redis-совместимый клиент
+(redis.Redis или fakes.FakeRedis) для нескольких воркеров/хостов.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite")
+STORE_PATH = os.getenv(
+    "STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_state.db")
+)
+STORE_REDIS_URL = os.getenv("STORE_REDIS_URL", "redis://localhost:6379/0")
+STORE_PREFIX = os.getenv("STORE_PREFIX", "salon:")
+# Записи копятся в памяти и сбрасываются пачкой: по таймеру или по количеству
+STORE_FLUSH_INTERVAL = float(os.getenv("STORE_FLUSH_INTERVAL", "2.0"))
+STORE_MAX_PENDING = int(os.getenv("STORE_MAX_PENDING", "200"))
+STORE_EVICT_INTERVAL = 600
+
+DAY = 24 * 3600
+THREAD_TTL = float(os.getenv("STORE_THREAD_TTL_DAYS", "30")) * DAY
+CONVERSATION_TTL = float(os.getenv("STORE_CONVERSATION_TTL_DAYS", "7")) * DAY
+
+
+class BatchingStore:
+    """
+    Общая часть бэкендов: буфер несохранённых записей, TTL и фоновый сброс.
+    Пока работает фоновый поток, set() и delete() не обращаются к бэкенду
+    и безопасны для event loop. Наследники реализуют _read, _write_many, _scan и _evict.
+    """
+
+    def __init__(self, flush_interval=STORE_FLUSH_INTERVAL, max_pending=STORE_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        # Пачка, которая прямо сейчас пишется в бэкенд: чтения видят её до конца записи
+        self._inflight = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        # Будит фоновый поток раньше таймера: буфер заполнен или пора остановиться
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # --- Публичный интерфейс ---
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            buffered = self._pending.get(key) or self._inflight.get(key)
+            if buffered is not None:
+                raw, expires = buffered
+                if raw is None or (expires is not None and expires <= now):
+                    return default
+                return json.loads(raw)
+        raw = self._read(key, now)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._pending[key] = (json.dumps(value, ensure_ascii=False), expires)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._request_flush()
+
+    def delete(self, key):
+        with self._lock:
+            self._pending[key] = (None, None)
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._request_flush()
+
+    def _request_flush(self):
+        # set()/delete() вызываются из event loop: запись в бэкенд — в фоновом потоке
+        if self._thread is not None and self._thread.is_alive():
+            self._wakeup.set()
+        else:
+            self.flush()
+
+    def items(self, prefix):
+        """
+        Все живые пары (ключ, значение) с данным префиксом.
+        """
+        self.flush()
+        now = time.time()
+        return [(key, json.loads(raw)) for key, raw in self._scan(prefix, now)]
+
+    def namespace(self, name, ttl=None):
+        return Namespace(self, name, ttl)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+        try:
+            self._write_many([(key, raw, expires) for key, (raw, expires) in batch.items()])
+        except Exception:
+            # Не теряем записи: возвращаем в буфер, если их не перезаписали новые
+            with self._lock:
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+            raise
+        finally:
+            with self._lock:
+                self._inflight = {}
+        return len(batch)
+
+    def evict_expired(self):
+        return self._evict(time.time())
+
+    def start(self):
+        """
+        Фоновый поток: периодический сброс буфера и удаление просроченных ключей.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._maintain, name="store-maintenance", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        self.flush()
+
+    def _maintain(self):
+        last_evict = time.monotonic()
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.flush()
+                if time.monotonic() - last_evict >= STORE_EVICT_INTERVAL:
+                    evicted = self.evict_expired()
+                    last_evict = time.monotonic()
+                    if evicted:
+                        print(f"[Store] Удалено просроченных записей: {evicted}")
+            except Exception as ex:
+                print(f"[Store] Ошибка фонового сброса: {ex}")
+
+    # --- Реализация бэкенда ---
+
+    def _read(self, key, now):
+        raise NotImplementedError
+
+    def _write_many(self, items):
+        raise NotImplementedError
+
+    def _scan(self, prefix, now):
+        raise NotImplementedError
+
+    def _evict(self, now):
+        raise NotImplementedError
+
+
+class SQLiteStore(BatchingStore):
+    """
+    Хранилище в файле SQLite (WAL): переживает перезапуск, общее для воркеров одного хоста.
+    """
+
+    def __init__(self, path=STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db_lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires)")
+
+    def _read(self, key, now):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, now)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write_many(self, items):
+        upserts = [(key, raw, expires) for key, raw, expires in items if raw is not None]
+        deletes = [(key,) for key, raw, _ in items if raw is None]
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                if upserts:
+                    self._db.executemany(
+                        "INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) "
+                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires",
+                        upserts,
+                    )
+                if deletes:
+                    self._db.executemany("DELETE FROM kv WHERE key = ?", deletes)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _scan(self, prefix, now):
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self._db_lock:
+            return self._db.execute(
+                "SELECT key, value FROM kv WHERE key LIKE ? ESCAPE '\\' AND (expires IS NULL OR expires > ?)",
+                (escaped + "%", now),
+            ).fetchall()
+
+    def _evict(self, now):
+        with self._db_lock:
+            return self._db.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,)).rowcount
+
+    def close(self):
+        super().close()
+        with self._db_lock:
+            self._db.close()
+
+
+class RedisStore(BatchingStore):
+    """
+    Хранилище поверх Redis-совместимого клиента (get/set/delete/pipeline/scan_iter).
+    TTL выполняет сам Redis, пачки записей уходят одним pipeline.
+    """
+
+    def __init__(self, client, prefix=STORE_PREFIX, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.prefix = prefix
+
+    def _read(self, key, now):
+        raw = self.client.get(self.prefix + key)
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        return raw
+
+    def _write_many(self, items):
+        now = time.time()
+        pipe = self.client.pipeline()
+        for key, raw, expires in items:
+            if raw is None:
+                pipe.delete(self.prefix + key)
+            elif expires is None:
+                pipe.set(self.prefix + key, raw)
+            elif expires > now:
+                pipe.set(self.prefix + key, raw, ex=max(1, int(expires - now)))
+            else:
+                pipe.delete(self.prefix + key)
+        pipe.execute()
+
+    def _scan(self, prefix, now):
+        result = []
+        for full_key in self.client.scan_iter(match=self.prefix + prefix + "*"):
+            if isinstance(full_key, bytes):
+                full_key = full_key.decode("utf-8")
+            raw = self._read(full_key[len(self.prefix):], now)
+            if raw is not None:
+                result.append((full_key[len(self.prefix):], raw))
+        return result
+
+    def _evict(self, now):
+        return 0
+
+
+class Namespace:
+    """
+    Ключи одного вида (например, thread:<user_id>) с общим TTL.
+    """
+
+    def __init__(self, store, name, ttl=None):
+        self.store = store
+        self.prefix = f"{name}:"
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        return self.store.get(self.prefix + str(key), default)
+
+    def set(self, key, value):
+        self.store.set(self.prefix + str(key), value, self.ttl)
+
+    def delete(self, key):
+        self.store.delete(self.prefix + str(key))
+
+
+class StorePersistence(BasePersistence):
+    """
+    Persistence для PTB поверх хранилища: состояния ConversationHandler
+    и user_data (включая незавершённую заявку) с TTL.
+    PTB читает состояния и user_data при запуске, поэтому диалог, начатый
+    до перезапуска, продолжается с того же места. Между воркерами состояния
+    ConversationHandler не синхронизируются: refresh_user_data лишь подгружает
+    user_data, если в памяти воркера он пуст.
+    prefix отделяет ключи ботов разных салонов в одном хранилище.
+    """
+
+    def __init__(self, store, ttl=CONVERSATION_TTL, update_interval=5, prefix=""):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get_user_data(self):
+        prefix = f"{self.prefix}user:"
+        return {int(key[len(prefix):]): value for key, value in self.store.items(prefix)}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        prefix = f"{self.prefix}conv:{name}:"
+        return {
+            tuple(json.loads(key[len(prefix):])): state
+            for key, state in self.store.items(prefix)
+        }
+
+    async def update_conversation(self, name, key, new_state):
+        store_key = f"{self.prefix}conv:{name}:{json.dumps(list(key))}"
+        if new_state is None:
+            self.store.delete(store_key)
+        else:
+            self.store.set(store_key, new_state, self.ttl)
+
+    async def update_user_data(self, user_id, data):
+        if data:
+            self.store.set(f"{self.prefix}user:{user_id}", data, self.ttl)
+        else:
+            self.store.delete(f"{self.prefix}user:{user_id}")
+
+    async def refresh_user_data(self, user_id, user_data):
+        # Непустой user_data в памяти новее хранилища (PTB сбрасывает его раз в update_interval)
+        if not user_data:
+            stored = self.store.get(f"{self.prefix}user:{user_id}")
+            if stored:
+                user_data.update(stored)
+
+    async def drop_user_data(self, user_id):
+        self.store.delete(f"{self.prefix}user:{user_id}")
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        self.store.flush()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Общее на процесс хранилище, выбранное через STORE_BACKEND (sqlite или redis).
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORE_BACKEND == "redis":
+                try:
+                    import redis
+                except ImportError:
+                    raise RuntimeError("Для STORE_BACKEND=redis установите пакет redis")
+                _store = RedisStore(redis.Redis.from_url(STORE_REDIS_URL))
+            else:
+                _store = SQLiteStore()
+            _store.start()
+        return _store
@@ -3,6 +3,7 @@
 Следит за локальным ngrok (порт 4040) и обновляет конфигурационный JSON
 актуальным публичным https-URL. Подходит для локального тестирования
 виджета Тильды, который читает apiBase из этого JSON.
+В режиме TELEGRAM_MODE=webhook заодно переустанавливает webhook бота.
 """
 
 import json
@@ -20,6 +21,11 @@ CONFIG_URL = "https://api.jsonbin.io/v3/b/6927156aae596e708f725703"
 JSONBIN_MASTER_KEY = os.getenv("JSONBIN_MASTER_KEY")
 POLL_INTERVAL = 10  # секунд
 
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+
 
 def get_https_tunnel():
     resp = requests.get(NGROK_API, timeout=5)
@@ -46,6 +52,19 @@ def update_config(api_base):
     print(f"[sync_ngrok] Конфиг обновлён: {api_base}")
 
 
+def update_telegram_webhook(api_base):
+    if TELEGRAM_MODE != "webhook" or not TELEGRAM_BOT_TOKEN:
+        return
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook"
+    payload = {"url": api_base + TELEGRAM_WEBHOOK_PATH}
+    if TELEGRAM_WEBHOOK_SECRET:
+        payload["secret_token"] = TELEGRAM_WEBHOOK_SECRET
+    resp = requests.post(url, data=payload, timeout=5)
+    print(f"[sync_ngrok] setWebhook -> {resp.status_code}")
+    resp.raise_for_status()
+    print(f"[sync_ngrok] Webhook обновлён: {payload['url']}")
+
+
 def main():
     last_url = None
     while True:
@@ -53,6 +72,7 @@ def main():
             current = get_https_tunnel()
             if current != last_url:
                 update_config(current)
+                update_telegram_webhook(current)
                 last_url = current
         except Exception as err:
             print(f"[sync_ngrok] Ошибка: {err}")
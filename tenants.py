@@ -0,0 +1,244 @@
+"""
+Несколько салонов (tenants) в одном процессе.
+
+Салон — запись реестра: токен бота, ассистент OpenAI, таблица Google Sheets,
+служебный чат, часовой пояс и папка базы знаний. Реестр читается из JSON-файла
+TENANTS_FILE; без него единственный салон собирается из прежних переменных
+окружения (TELEGRAM_BOT_TOKEN, OPENAI_ASSISTANT_ID, GOOGLE_SHEET_ID, ...).
+
+Первый салон реестра — основной: ему достаются запросы без ключа салона, а его
+интеграции и файлы SQLite называются как раньше. У остальных к имени интеграции
+добавляется @<key>, а к имени файла — .<key> (bookings.db → bookings.salon2.db).
+
+Текущий салон хранится в contextvars: веб-запрос и обновление Telegram выставляют
+его на входе, а пул потоков (executor.run_blocking) копирует контекст вместе
+с вызовом, поэтому запись в Sheets, каталог и расписание видят салон вызывающего
+без явной передачи. Фоновые потоки индексов получают колбэки через Tenant.bind().
+"""
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+
+import pytz
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+# Одновременных run OpenAI на салон (0 — половина общего MAX_INFLIGHT_RUNS при нескольких салонах)
+TENANT_MAX_INFLIGHT_RUNS = int(os.getenv("TENANT_MAX_INFLIGHT_RUNS", "0"))
+DEFAULT_TENANT_KEY = "default"
+SALON_NAME = os.getenv("SALON_NAME", "ArtBeauty")
+INSTRUCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_instructions")
+
+# Ключ салона попадает в URL webhook и имена файлов
+_KEY_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+# Значение "env:NAME" в реестре берётся из переменной окружения NAME (секреты не лежат в JSON)
+ENV_PREFIX = "env:"
+FIELDS = (
+    "name", "bot_token", "assistant_id", "sheet_id", "admin_chat_id", "timezone",
+    "knowledge_dir", "webhook_secret", "api_token", "max_inflight_runs",
+)
+# Обязательные поля для всех салонов, кроме основного (у него — переменные окружения)
+REQUIRED_FIELDS = ("assistant_id", "sheet_id")
+
+
+class Tenant:
+    """
+    Настройки одного салона. primary — основной салон (запросы без ключа, прежние имена файлов).
+    """
+
+    def __init__(self, key, name=None, bot_token=None, assistant_id=None, sheet_id=None, admin_chat_id=None,
+                 timezone=None, knowledge_dir=None, webhook_secret="", api_token="",
+                 max_inflight_runs=TENANT_MAX_INFLIGHT_RUNS, primary=False):
+        self.key = key
+        self.name = name or SALON_NAME
+        self.bot_token = bot_token
+        self.assistant_id = assistant_id
+        self.sheet_id = sheet_id
+        self.admin_chat_id = str(admin_chat_id) if admin_chat_id else None
+        self.timezone = timezone or os.getenv("TIMEZONE", "Europe/Moscow")
+        self.tz = pytz.timezone(self.timezone)
+        self.knowledge_dir = knowledge_dir or INSTRUCTIONS_DIR
+        self.webhook_secret = webhook_secret or ""
+        self.api_token = api_token or ""
+        self.max_inflight_runs = int(max_inflight_runs or 0)
+        self.primary = primary
+
+    def __repr__(self):
+        return f"Tenant({self.key!r})"
+
+    @property
+    def knowledge_path(self):
+        return os.path.join(self.knowledge_dir, "Knowledge.txt")
+
+    @property
+    def prompt_path(self):
+        return os.path.join(self.knowledge_dir, "Prompt.txt")
+
+    def scoped(self, name):
+        """
+        Имя интеграции или ключа салона: у основного — без изменений, иначе name@key.
+        """
+        return name if self.primary else f"{name}@{self.key}"
+
+    def path(self, path):
+        """
+        Файл SQLite салона: у основного — path, иначе path с .key перед расширением.
+        """
+        if self.primary:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.key}{ext}"
+
+    def bind(self, func):
+        """
+        Обёртка, выполняющая func от имени салона (для колбэков фоновых потоков).
+        """
+        def bound(*args, **kwargs):
+            with use(self):
+                return func(*args, **kwargs)
+        return bound
+
+
+def _resolve(value):
+    if isinstance(value, str) and value.startswith(ENV_PREFIX):
+        return os.getenv(value[len(ENV_PREFIX):])
+    return value
+
+
+def _env_tenant(key=DEFAULT_TENANT_KEY, **overrides):
+    # Основной салон: прежние переменные окружения, поверх — поля из реестра
+    settings = {
+        "bot_token": os.getenv("TELEGRAM_BOT_TOKEN"),
+        "assistant_id": os.getenv("OPENAI_ASSISTANT_ID"),
+        "sheet_id": os.getenv("GOOGLE_SHEET_ID"),
+        "admin_chat_id": os.getenv("ADMIN_CHAT_ID"),
+        "webhook_secret": os.getenv("TELEGRAM_WEBHOOK_SECRET", ""),
+        "api_token": os.getenv("ADMIN_API_TOKEN", ""),
+    }
+    settings.update({name: value for name, value in overrides.items() if value not in (None, "")})
+    return Tenant(key, primary=True, **settings)
+
+
+def load_tenants(path):
+    """
+    Читает реестр: {"key": {"bot_token": ..., "assistant_id": ..., ...}, ...}.
+    Порядок ключей сохраняется, первый салон — основной. ValueError при ошибке в реестре.
+    """
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    if not isinstance(raw, dict) or not raw:
+        raise ValueError(f"{path}: ожидается непустой объект {{ключ салона: настройки}}")
+    base = os.path.dirname(os.path.abspath(path))
+    result = {}
+    for i, (key, entry) in enumerate(raw.items()):
+        if not _KEY_RE.match(key):
+            raise ValueError(f"{path}: ключ салона {key!r} — только a-z, 0-9, _ и -")
+        if not isinstance(entry, dict):
+            raise ValueError(f"{path}: настройки салона {key} должны быть объектом")
+        unknown = set(entry) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"{path}: неизвестные поля салона {key}: {', '.join(sorted(unknown))}")
+        settings = {name: _resolve(value) for name, value in entry.items()}
+        missing = [name for name in REQUIRED_FIELDS if i and not settings.get(name)]
+        if missing:
+            # Без них салон молча взял бы ассистента или таблицу основного салона
+            raise ValueError(f"{path}: у салона {key} не заданы {', '.join(missing)}")
+        if settings.get("knowledge_dir"):
+            settings["knowledge_dir"] = os.path.join(base, settings["knowledge_dir"])
+        try:
+            result[key] = _env_tenant(key, **settings) if i == 0 else Tenant(key, **settings)
+        except pytz.UnknownTimeZoneError:
+            raise ValueError(f"{path}: неизвестный часовой пояс салона {key}: {settings.get('timezone')}")
+    return result
+
+
+_tenants = None
+_tenants_lock = threading.Lock()
+_current = contextvars.ContextVar("tenant", default=None)
+
+
+def all_tenants():
+    """
+    Салоны процесса {key: Tenant} (реестр читается при первом обращении).
+    """
+    global _tenants
+    if _tenants is None:
+        with _tenants_lock:
+            if _tenants is None:
+                if TENANTS_FILE:
+                    _tenants = load_tenants(TENANTS_FILE)
+                    print(f"[Tenants] Салонов в реестре: {len(_tenants)} ({', '.join(_tenants)})")
+                else:
+                    _tenants = {DEFAULT_TENANT_KEY: _env_tenant()}
+    return _tenants
+
+
+def primary():
+    return next(iter(all_tenants().values()))
+
+
+def get_tenant(key):
+    """
+    Салон по ключу или None.
+    """
+    return all_tenants().get(key)
+
+
+def is_multi():
+    return len(all_tenants()) > 1
+
+
+def current():
+    """
+    Салон текущего запроса или обновления (без него — основной).
+    """
+    tenant = _current.get()
+    return tenant if tenant is not None else primary()
+
+
+def activate(tenant):
+    """
+    Делает салон текущим до конца контекста (задачи); возвращает токен для reset.
+    """
+    return _current.set(tenant)
+
+
+@contextlib.contextmanager
+def use(tenant):
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+class PerTenant:
+    """
+    Отдельный объект на каждый салон: factory(tenant) вызывается при первом get().
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, tenant=None):
+        tenant = tenant or current()
+        item = self._items.get(tenant.key)
+        if item is None:
+            with self._lock:
+                item = self._items.get(tenant.key)
+                if item is None:
+                    item = self._items[tenant.key] = self._factory(tenant)
+        return item
+
+    def items(self):
+        """
+        Уже созданные объекты: [(key, объект)].
+        """
+        return list(self._items.items())
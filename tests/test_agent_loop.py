@@ -0,0 +1,178 @@
+"""
+Вызов функций ассистента из агентского цикла: блокирующая функция уходит
+в пул потоков и не останавливает event loop.
+"""
+import asyncio
+import json
+import time
+
+import agent_loop
+from answer_cache import AnswerCache
+from faq_router import FaqRouter
+
+
+def test_blocking_tool_keeps_loop_responsive(monkeypatch):
+    calls = []
+
+    def slow_booking(name, phone):
+        # Аргумент name совпадает с параметром run_blocking и не должен с ним смешиваться
+        time.sleep(0.3)
+        calls.append((name, phone))
+        return {"success": True}
+
+    monkeypatch.setitem(agent_loop.TOOLS, "slow_booking", slow_booking)
+    call = {
+        "id": "call_1",
+        "function": {"name": "slow_booking", "arguments": json.dumps({"name": "Анна", "phone": "+79990000000"})},
+    }
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await agent_loop._call_tool(call)
+        task.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(scenario())
+    assert result == {"success": True}
+    assert calls == [("Анна", "+79990000000")]
+    # Пока функция спала в потоке, loop продолжал обслуживать другие задачи
+    assert ticks >= 10
+
+
+class HangingClient:
+    """
+    Ассистент, чей run не завершается; запоминает отменённые run.
+    """
+    configured = True
+
+    def __init__(self):
+        self.cancelled = []
+
+    async def add_message(self, thread_id, content):
+        pass
+
+    async def create_run(self, thread_id):
+        return "run_1"
+
+    async def wait_for_run(self, thread_id, run_id, timeout):
+        await asyncio.sleep(timeout)
+        raise asyncio.TimeoutError
+
+    async def ask_stream(self, message, thread_id=None):
+        yield {"type": "thread", "thread_id": thread_id}
+        yield {"type": "run", "run_id": "run_1", "thread_id": thread_id}
+        await asyncio.sleep(10)
+
+    async def cancel_run(self, thread_id, run_id):
+        self.cancelled.append((thread_id, run_id))
+        return True
+
+
+def test_run_turn_cancels_run_after_timeout():
+    client = HangingClient()
+    result = asyncio.run(agent_loop.run_turn("Вопрос", "thread_1", client=client, max_seconds=0.1))
+    assert result["status"] == "error"
+    assert client.cancelled == [("thread_1", "run_1")]
+
+
+def test_stream_turn_has_time_budget_and_cancels_run():
+    client = HangingClient()
+
+    async def scenario():
+        return [event async for event in agent_loop.stream_turn("Вопрос", "thread_1", client=client, max_seconds=0.1)]
+
+    started = time.perf_counter()
+    events = asyncio.run(scenario())
+    assert time.perf_counter() - started < 2
+    assert events[-1]["type"] == "error"
+    assert all(event["type"] != "run" for event in events)
+    assert client.cancelled == [("thread_1", "run_1")]
+
+
+class RecordingClient:
+    """
+    Ассистент, к которому ход не должен дойти; запоминает сообщения, дописанные в thread.
+    """
+    configured = True
+
+    def __init__(self):
+        self.messages = []
+
+    async def add_message(self, thread_id, content, role="user"):
+        self.messages.append((thread_id, role, content))
+
+    async def create_run(self, thread_id):
+        raise AssertionError("ход должен обойтись без OpenAI")
+
+    async def ask_stream(self, message, thread_id=None):
+        raise AssertionError("ход должен обойтись без OpenAI")
+        yield
+
+
+def test_cached_answer_serves_follow_up_in_thread(monkeypatch):
+    cache = AnswerCache(sources=())
+    cache.put("Какие есть способы оплаты?", "Наличными или картой.")
+    monkeypatch.setattr(agent_loop, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(agent_loop, "get_faq_router", lambda: None)
+    client = RecordingClient()
+
+    result = asyncio.run(agent_loop.run_turn("Какие есть способы оплаты?", "thread_1", client=client))
+    assert result["cached"] and result["reply"] == "Наличными или картой."
+    # Вопрос и ответ попадают в thread, чтобы ассистент видел их в следующих ходах
+    assert client.messages == [
+        ("thread_1", "user", "Какие есть способы оплаты?"),
+        ("thread_1", "assistant", "Наличными или картой."),
+    ]
+    # Отсылка к прошлому сообщению уходит ассистенту
+    assert agent_loop._local_answer("А сколько это стоит?", "thread_1") == (None, None)
+
+
+def test_faq_answers_follow_up_question_in_thread(monkeypatch, tmp_path):
+    knowledge = tmp_path / "Knowledge.txt"
+    knowledge.write_text(json.dumps([
+        {"Вопросы": "Какие есть способы оплаты в вашем салоне?", "Ответы": "Наличными или банковской картой."},
+        {"Вопросы": "Как долго держится результат окрашивания?", "Ответы": "Обычно от 4 до 6 недель."},
+    ], ensure_ascii=False), encoding="utf-8")
+    router = FaqRouter(str(knowledge))
+    monkeypatch.setattr(agent_loop, "get_faq_router", lambda: router)
+    monkeypatch.setattr(agent_loop, "get_answer_cache", lambda: None)
+    client = RecordingClient()
+
+    async def scenario():
+        return [event async for event in agent_loop.stream_turn(
+            "Как долго держится окрашивание?", "thread_1", client=client
+        )]
+
+    events = asyncio.run(scenario())
+    assert events[-1]["type"] == "completed"
+    assert events[-1]["source"] == "faq"
+    assert events[-1]["reply"] == "Обычно от 4 до 6 недель."
+    assert [role for _, role, _ in client.messages] == ["user", "assistant"]
+
+
+def test_stream_turn_cancels_run_when_consumer_leaves():
+    client = HangingClient()
+
+    async def scenario():
+        stream = agent_loop.stream_turn("Вопрос", "thread_1", client=client)
+        assert (await stream.__anext__())["type"] == "thread"
+        task = asyncio.create_task(stream.__anext__())
+        await asyncio.sleep(0.05)
+        # Клиент отключился, пока ассистент ещё отвечал
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert client.cancelled == [("thread_1", "run_1")]
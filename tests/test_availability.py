@@ -0,0 +1,58 @@
+"""
+Индекс занятости: записи к мастеру, на категорию и к любому мастеру
+делят места мастеров этой категории.
+"""
+from datetime import datetime
+
+import functions
+from availability import AvailabilityIndex
+from catalog import Catalog, Master, Service
+
+MOMENT = datetime(2030, 1, 7, 12, 0)
+
+
+def make_index(monkeypatch, rows=()):
+    salon = Catalog(None, "sheet")
+    salon.load(
+        [Service("Стрижка", "Волосы", 1000, 60, ())],
+        [
+            Master("Анна", "Парикмахер", ()),
+            Master("Мария", "Парикмахер", ()),
+            Master("Ольга", "Маникюр", ()),
+        ],
+    )
+    monkeypatch.setattr(functions, "get_catalog", lambda: salon)
+    index = AvailabilityIndex(lambda: list(rows), groups_of=functions._master_groups)
+    index.rebuild()
+    return index
+
+
+def test_master_conflicts_with_category_and_any_master_bookings(monkeypatch):
+    index = make_index(monkeypatch)
+    assert index.reserve("Парикмахер", "Стрижка", MOMENT)[0]
+    assert index.reserve("", "Стрижка", MOMENT)[0]
+    # Одна парикмахерская запись и одна «к любому»: Анна ещё может быть свободна
+    assert index.is_free("Анна", "Стрижка", MOMENT)
+    assert index.reserve("Мария", "Стрижка", MOMENT)[0]
+    # Оба парикмахера заняты, Ольга — «любой мастер»: свободных мест нет ни у кого
+    assert not index.is_free("Анна", "Стрижка", MOMENT)
+    assert not index.is_free("Парикмахер", "Стрижка", MOMENT)
+    assert not index.is_free(None, "Стрижка", MOMENT)
+
+
+def test_any_master_slots_count_bookings_of_concrete_masters(monkeypatch):
+    row = ["Клиент", "+79990000000", "Стрижка", "07.01.2030 12:00"]
+    index = make_index(monkeypatch, [row + ["Анна"], row + ["Мария"], row + ["Ольга"]])
+    assert not index.is_free(None, "Стрижка", MOMENT)
+    assert MOMENT not in index.free_slots(None, "Стрижка", MOMENT, count=3)
+
+
+def test_release_frees_every_group(monkeypatch):
+    index = make_index(monkeypatch)
+    ok, token = index.reserve("Анна", "Стрижка", MOMENT)
+    assert ok and not index.is_free("Анна", "Стрижка", MOMENT)
+    index.release(token)
+    assert index.is_free("Анна", "Стрижка", MOMENT)
+    assert index.reserve("Парикмахер", "Стрижка", MOMENT)[0]
+    assert index.reserve("Парикмахер", "Стрижка", MOMENT)[0]
+    assert not index.is_free("Анна", "Стрижка", MOMENT)
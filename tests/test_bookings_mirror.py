@@ -0,0 +1,99 @@
+"""
+Локальная копия таблицы заявок: фоновая сверка с таблицей.
+"""
+import re
+import sqlite3
+import time
+
+import functions
+import reminders
+from bookings_mirror import BookingMirror, row_key
+
+_RANGE_RE = re.compile(r"A(\d+):H(\d+)")
+
+
+class Sheet:
+    """
+    Лист заявок в памяти: read(a1) отдаёт строки диапазона, как values().get.
+    """
+
+    def __init__(self, rows=()):
+        self.rows = [list(row) for row in rows]
+        self.reads = []
+
+    def read(self, range_):
+        self.reads.append(range_)
+        start, end = (int(value) for value in _RANGE_RE.match(range_).groups())
+        return self.rows[start - 2:end - 1]
+
+
+def booking(n):
+    return [f"Клиент {n}", f"+7999000{n:04d}", "Стрижка", f"{n % 28 + 1:02d}.01.2030 12:00", "", "", "Сайт", ""]
+
+
+def test_sync_thread_survives_failed_transaction(tmp_path, monkeypatch):
+    sheet = Sheet([booking(1)])
+    mirror = BookingMirror(sheet.read, path=str(tmp_path / "bookings.db"), sync_interval=0.02)
+    upsert = mirror._upsert
+    failures = {"left": 1}
+
+    def flaky_upsert(*args):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return upsert(*args)
+
+    monkeypatch.setattr(mirror, "_upsert", flaky_upsert)
+    mirror.start()
+    for _ in range(100):
+        if mirror.stats["syncs"]:
+            break
+        time.sleep(0.02)
+    assert mirror._thread.is_alive()
+    assert mirror.stats["errors"] == 1
+    assert len(mirror) == 1
+    mirror.close()
+
+
+def test_incremental_sync_reads_only_new_rows(tmp_path):
+    sheet = Sheet([booking(1), booking(2)])
+    mirror = BookingMirror(sheet.read, path=str(tmp_path / "bookings.db"), page_rows=10)
+    assert mirror.sync() == 2
+    assert sheet.reads == ["A2:H11"]
+
+    sheet.rows.append(booking(3))
+    assert mirror.sync() == 1
+    # Дочитывается только хвост после последней известной строки
+    assert sheet.reads[-1] == "A4:H13"
+    assert len(mirror) == 3
+    assert mirror.stats["full_syncs"] == 1
+    mirror.close()
+
+
+def test_full_sync_removes_deleted_rows_and_cancels_reminders(tmp_path, monkeypatch):
+    scheduler = reminders.ReminderScheduler(str(tmp_path / "reminders.db"), admin_chat_id="1")
+    monkeypatch.setattr(reminders, "get_reminders", lambda: scheduler)
+    sheet = Sheet([booking(1), booking(2)])
+    queued = booking(3)
+    mirror = BookingMirror(
+        sheet.read, lambda: [queued], functions._cancel_reminders, path=str(tmp_path / "bookings.db"),
+    )
+    mirror.sync()
+    mirror.record(queued)
+    data = {"name": "Клиент 2", "phone": "+79990000002", "service": "Стрижка", "date": booking(2)[3]}
+    assert scheduler.schedule(row_key(booking(2)), data, None) == 2
+
+    # Администратор удалил заявку из таблицы: дочитывание хвоста этого не видит
+    del sheet.rows[1]
+    time.sleep(0.01)
+    mirror.sync()
+    assert len(mirror) == 3
+    assert scheduler.pending_count() == 2
+
+    mirror.sync(full=True)
+    # Заявка из очереди записи ещё не в таблице, но остаётся в копии
+    assert len(mirror) == 2
+    assert mirror.stats["removed"] == 1
+    assert scheduler.pending_count() == 0
+    mirror.close()
+    scheduler.close()
@@ -0,0 +1,75 @@
+"""
+Обработчики бота: запись заявки в медленный Google Sheets идёт через пул
+потоков и не останавливает event loop.
+"""
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+
+import availability
+import bookings_mirror
+import catalog
+import functions
+import integrations
+import main
+import reminders
+from booking import local_now
+from fakes import FakeSheetsService
+from idempotency import IdempotencyIndex
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def test_get_comment_keeps_loop_responsive_while_sheets_is_slow(monkeypatch, tmp_path):
+    sheets = FakeSheetsService(latency=0.3)
+    integrations.override("sheets", sheets)
+    monkeypatch.setattr(functions, "SHEETS_WRITE_BEHIND", False)
+    monkeypatch.setattr(catalog, "CATALOG_ENABLED", False)
+    monkeypatch.setattr(availability, "AVAILABILITY_ENABLED", False)
+    monkeypatch.setattr(bookings_mirror, "BOOKINGS_MIRROR_ENABLED", False)
+    monkeypatch.setattr(reminders, "REMINDERS_ENABLED", False)
+    index = IdempotencyIndex(str(tmp_path / "idempotency.db"))
+    monkeypatch.setattr(functions, "get_idempotency_index", lambda: index)
+    monkeypatch.setattr(main, "notify_admin", lambda text: None)
+
+    date = (local_now() + timedelta(days=3)).strftime("%d.%m.%Y 12:00")
+    message = FakeMessage("Без комментариев")
+    update = SimpleNamespace(
+        message=message, update_id=1,
+        effective_user=SimpleNamespace(id=42), effective_chat=SimpleNamespace(id=42),
+    )
+    context = SimpleNamespace(user_data={"booking": {
+        "name": "Анна", "phone": "+79990000000", "service": "Стрижка", "date": date, "master": "",
+    }})
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        state = await main.get_comment(update, context)
+        task.cancel()
+        return state, ticks
+
+    try:
+        state, ticks = asyncio.run(scenario())
+    finally:
+        integrations.reset("sheets")
+        index.close()
+    assert state == main.CHOOSING
+    assert message.replies[0] == "Спасибо! Ваша заявка принята и передана админу."
+    assert len(sheets.tables[""]) == 1
+    # Пока запись в таблицу ждала ответа Sheets, loop обслуживал другие задачи
+    assert ticks >= 10
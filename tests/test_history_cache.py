@@ -0,0 +1,65 @@
+"""
+Кэш истории thread: после первой загрузки дозапрашиваются только сообщения
+после курсора after, а виджет получает лишь новые сообщения.
+"""
+import asyncio
+
+import assistant_client
+from assistant_client import AssistantClient
+from history_cache import HistoryCache
+
+
+def message(n, role="user"):
+    return {"id": f"msg_{n}", "role": role, "content": [{"type": "text", "text": {"value": f"Текст {n}"}}]}
+
+
+class ThreadMessages(AssistantClient):
+    """
+    AssistantClient, отвечающий на GET /threads/{id}/messages из списка в памяти.
+    """
+
+    def __init__(self, messages):
+        super().__init__(api_key="test", assistant_id="asst")
+        self.messages = messages
+        self.requests = []
+
+    async def _request(self, method, path, payload=None, params=None):
+        self.requests.append(dict(params))
+        items = list(self.messages)
+        if params.get("after"):
+            ids = [item["id"] for item in items]
+            items = items[ids.index(params["after"]) + 1:]
+        if params.get("order") == "desc":
+            items.reverse()
+        limit = params["limit"]
+        return {"data": items[:limit], "has_more": len(items) > limit}
+
+
+def test_fetch_history_loads_only_messages_after_cursor(monkeypatch):
+    cache = HistoryCache(max_messages=50)
+    monkeypatch.setattr(assistant_client, "get_history_cache", lambda: cache)
+    client = ThreadMessages([message(1), message(2, "assistant")])
+
+    first = asyncio.run(client.fetch_history("thread_1"))
+    assert [item["id"] for item in first] == ["msg_1", "msg_2"]
+    assert "after" not in client.requests[-1]
+
+    client.messages += [message(3), message(4, "assistant")]
+    second = asyncio.run(client.fetch_history("thread_1"))
+    assert [item["id"] for item in second] == ["msg_1", "msg_2", "msg_3", "msg_4"]
+    # Второй ход запросил только новые сообщения
+    assert client.requests[-1]["after"] == "msg_2"
+    assert cache.stats["delta_fetches"] == 1
+    assert cache.stats["messages_fetched"] == 4
+
+
+def test_since_returns_new_messages_or_full_window():
+    cache = HistoryCache(max_messages=30)
+    cache.add("thread_1", [{"id": f"msg_{n}", "role": "user", "content": ""} for n in range(40)], full=True)
+
+    messages, incremental = cache.since("thread_1", "msg_37")
+    assert incremental and [item["id"] for item in messages] == ["msg_38", "msg_39"]
+    # Курсор уже вытеснен из буфера — клиент получает окно целиком
+    messages, incremental = cache.since("thread_1", "msg_1")
+    assert not incremental and len(messages) == 30 and messages[-1]["id"] == "msg_39"
+    assert cache.since("thread_unknown", "msg_1") == ([], False)
@@ -0,0 +1,67 @@
+"""
+Ключи идемпотентности: повтор заявки получает исходный результат,
+освобождённый или просроченный ключ можно захватить заново.
+"""
+import time
+
+import idempotency
+from idempotency import BUSY, DONE, NEW, IdempotencyIndex
+
+
+def test_claim_complete_and_replay(tmp_path):
+    index = IdempotencyIndex(str(tmp_path / "keys.db"))
+    assert index.claim("tg:1:100") == (NEW, None)
+    # Та же заявка, пока первая ещё пишется
+    assert index.claim("tg:1:100") == (BUSY, None)
+    index.complete("tg:1:100", {"success": True, "data": {"queued": 7}})
+    assert index.claim("tg:1:100") == (DONE, {"success": True, "data": {"queued": 7}})
+    index.close()
+
+    # Результат хранится в файле: его видит другой воркер (и тот же после перезапуска)
+    other = IdempotencyIndex(str(tmp_path / "keys.db"))
+    assert other.claim("tg:1:100") == (DONE, {"success": True, "data": {"queued": 7}})
+    other.close()
+
+
+def test_release_lets_retry_run_again(tmp_path):
+    index = IdempotencyIndex(str(tmp_path / "keys.db"))
+    assert index.claim("web:abc")[0] == NEW
+    index.release("web:abc")
+    assert index.claim("web:abc")[0] == NEW
+    assert index.stats["released"] == 1
+    index.close()
+
+
+def test_keys_expire_after_ttl(tmp_path):
+    index = IdempotencyIndex(str(tmp_path / "keys.db"), ttl=0.05, memory_size=0)
+    assert index.claim("web:old")[0] == NEW
+    index.complete("web:old", {"success": True})
+    assert index.claim("web:old")[0] == DONE
+    time.sleep(0.06)
+    assert index.claim("web:old")[0] == NEW
+    index.close()
+
+
+def test_abandoned_claim_can_be_taken_over(tmp_path, monkeypatch):
+    # Процесс упал между claim и complete: ключ освобождается по IDEMPOTENCY_CLAIM_TIMEOUT, а не по TTL
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_CLAIM_TIMEOUT", 0.05)
+    index = IdempotencyIndex(str(tmp_path / "keys.db"))
+    assert index.claim("web:lost")[0] == NEW
+    assert index.claim("web:lost")[0] == BUSY
+    time.sleep(0.06)
+    assert index.claim("web:lost")[0] == NEW
+    index.close()
+
+
+def test_trim_keeps_newest_keys(tmp_path):
+    index = IdempotencyIndex(str(tmp_path / "keys.db"), max_keys=2)
+    for i in range(4):
+        assert index.claim(f"key:{i}")[0] == NEW
+        index.complete(f"key:{i}", {"n": i})
+        time.sleep(0.001)
+    assert index.trim() == 2
+    index.close()
+    index = IdempotencyIndex(str(tmp_path / "keys.db"))
+    assert index.claim("key:3") == (DONE, {"n": 3})
+    assert index.claim("key:0")[0] == NEW
+    index.close()
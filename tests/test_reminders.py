@@ -0,0 +1,70 @@
+"""
+Воркер напоминаний: переживает ошибки базы и пула потоков,
+неотправленные напоминания повторяет ограниченное число раз.
+"""
+import asyncio
+import time
+
+import reminders
+from executor import ExecutorBusy
+from reminders import ReminderScheduler
+
+
+def add_due(scheduler, key, chat_id="1"):
+    # Напоминание, срок которого уже наступил (schedule() ставит только будущие)
+    with scheduler._lock:
+        scheduler._db.execute(
+            "INSERT INTO reminders (key, booking, due, expires, chat_id, text) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, key, time.time() - 1, time.time() + 3600, chat_id, f"Напоминание {key}"),
+        )
+
+
+def test_worker_survives_errors_and_retries_failed_sends(monkeypatch, tmp_path):
+    monkeypatch.setattr(reminders, "ERROR_BACKOFF", 0.01)
+    scheduler = ReminderScheduler(str(tmp_path / "reminders.db"), rate=0, max_sleep=0.05, retry_delay=0.01)
+    add_due(scheduler, "ok")
+    add_due(scheduler, "flaky")
+    claim_due = scheduler.claim_due
+    failures = {"claim": 1}
+
+    def busy_once():
+        if failures["claim"]:
+            failures["claim"] -= 1
+            raise ExecutorBusy("пул занят")
+        return claim_due()
+
+    monkeypatch.setattr(scheduler, "claim_due", busy_once)
+    sent = []
+    attempts = {}
+
+    async def send(chat_id, text):
+        attempts[text] = attempts.get(text, 0) + 1
+        if text == "Напоминание flaky" and attempts[text] < 2:
+            return False
+        sent.append(text)
+        return True
+
+    async def scenario():
+        await scheduler.start(send)
+        for _ in range(100):
+            if len(sent) == 2:
+                break
+            await asyncio.sleep(0.02)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert sorted(sent) == ["Напоминание flaky", "Напоминание ok"]
+    assert scheduler.stats["errors"] == 1
+    assert scheduler.stats["retried"] == 1
+    assert scheduler.pending_count() == 0
+
+
+def test_retry_gives_up_after_max_attempts(tmp_path):
+    scheduler = ReminderScheduler(str(tmp_path / "reminders.db"), max_attempts=2, retry_delay=0)
+    add_due(scheduler, "lost")
+    (reminder_id, _, _, _, attempts), = scheduler.claim_due()
+    assert scheduler.retry(reminder_id, attempts)
+    (reminder_id, _, _, _, attempts), = scheduler.claim_due()
+    assert attempts == 1
+    assert not scheduler.retry(reminder_id, attempts)
+    assert scheduler.pending_count() == 0
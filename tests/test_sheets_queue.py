@@ -0,0 +1,39 @@
+"""
+Очередь заявок для Google Sheets: несколько воркеров на одной базе
+не отправляют одну строку дважды.
+"""
+import threading
+
+from fakes import FakeSheetsService
+from sheets_queue import BookingQueue
+
+
+def test_two_queues_on_one_db_append_each_row_once(tmp_path):
+    sheets = FakeSheetsService(latency=0.05)
+    path = str(tmp_path / "queue.db")
+    first = BookingQueue(sheets, "sheet", path, linger=0, requests_per_minute=0)
+    second = BookingQueue(sheets, "sheet", path, linger=0, requests_per_minute=0)
+    for i in range(5):
+        first.enqueue([f"Клиент {i}", "+7999000000{i}"])
+
+    threads = [threading.Thread(target=queue.flush) for queue in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(sheets.tables[""]) == 5
+    assert first.pending_count() == 0
+    first.close()
+    second.close()
+
+
+def test_access_error_is_not_retried(tmp_path):
+    sheets = FakeSheetsService(fail_times=1, fail_status=403)
+    queue = BookingQueue(sheets, "sheet", str(tmp_path / "queue.db"), linger=0, requests_per_minute=0)
+    queue.enqueue(["Клиент", "+79990000000"])
+
+    assert queue.flush(timeout=5)
+    assert queue.stats["dead"] == 1
+    assert sheets.tables.get("", []) == []
+    queue.close()
@@ -0,0 +1,103 @@
+"""
+Хранилище состояния бота: отложенная пакетная запись в бэкенд и восстановление
+состояния после перезапуска.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from fakes import FakeRedis
+from storage import RedisStore, SQLiteStore, StorePersistence
+
+
+class RecordingStore(SQLiteStore):
+    """
+    SQLiteStore, запоминающий потоки, из которых шла запись в базу.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writers = []
+
+    def _write_many(self, items):
+        self.writers.append(threading.current_thread().name)
+        super()._write_many(items)
+
+
+def test_full_buffer_is_flushed_in_background(tmp_path):
+    store = RecordingStore(str(tmp_path / "state.db"), flush_interval=60, max_pending=2).start()
+    store.set("a", 1)
+    store.set("b", 2)
+    # set() из event loop не пишет в базу сам, а будит фоновый поток
+    for _ in range(100):
+        if store.writers:
+            break
+        time.sleep(0.01)
+    assert store.writers == ["store-maintenance"]
+    assert store._read("b", time.time()) == "2"
+    store.close()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "redis"])
+def test_buffered_writes_survive_restart(tmp_path, backend):
+    redis = FakeRedis()
+
+    def open_store():
+        if backend == "redis":
+            return RedisStore(redis, flush_interval=60)
+        return SQLiteStore(str(tmp_path / "state.db"), flush_interval=60)
+
+    store = open_store()
+    threads = store.namespace("thread", ttl=3600)
+    threads.set(1, "thread_1")
+    threads.set(2, "thread_2")
+    # До сброса запись видна из буфера, но ещё не дошла до бэкенда
+    assert threads.get(1) == "thread_1"
+    assert store._read("thread:1", time.time()) is None
+    assert store.flush() == 2
+    threads.delete(2)
+    store.close()
+
+    restored = open_store()
+    assert restored.namespace("thread").get(1) == "thread_1"
+    assert restored.namespace("thread").get(2) is None
+    restored.close()
+
+
+def test_expired_keys_are_hidden_and_evicted(tmp_path):
+    store = SQLiteStore(str(tmp_path / "state.db"), flush_interval=60)
+    store.set("short", "value", ttl=0.05)
+    store.set("long", "value", ttl=3600)
+    store.flush()
+    time.sleep(0.06)
+    assert store.get("short") is None
+    assert store.items("") == [("long", "value")]
+    assert store.evict_expired() == 1
+    store.close()
+
+
+def test_persistence_restores_dialog_after_restart(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def save():
+        store = SQLiteStore(path, flush_interval=60)
+        persistence = StorePersistence(store, prefix="salon:")
+        await persistence.update_conversation("booking", (42, 42), 3)
+        await persistence.update_user_data(42, {"booking": {"name": "Анна"}})
+        await persistence.flush()
+        store.close()
+
+    async def restore():
+        store = SQLiteStore(path, flush_interval=60)
+        persistence = StorePersistence(store, prefix="salon:")
+        try:
+            return await persistence.get_conversations("booking"), await persistence.get_user_data()
+        finally:
+            store.close()
+
+    asyncio.run(save())
+    conversations, user_data = asyncio.run(restore())
+    assert conversations == {(42, 42): 3}
+    assert user_data == {42: {"booking": {"name": "Анна"}}}
@@ -0,0 +1,43 @@
+"""
+Планировщик ходов: сообщения, пришедшие во время хода, склеиваются
+в следующий ход и не зависают, если его отменили.
+"""
+import asyncio
+
+from thread_scheduler import ThreadScheduler
+
+
+def test_pending_messages_are_cancelled_with_the_drain_task():
+    scheduler = ThreadScheduler()
+    started = []
+    release_first = None
+
+    async def runner(message):
+        started.append(message)
+        if message == "первое":
+            await release_first.wait()
+        else:
+            await asyncio.sleep(10)
+        return {"status": "completed", "reply": message}
+
+    async def scenario():
+        nonlocal release_first
+        release_first = asyncio.Event()
+        first = asyncio.create_task(scheduler.run("user", "первое", runner))
+        await asyncio.sleep(0.01)
+        waiting = [asyncio.create_task(scheduler.run("user", text, runner)) for text in ("второе", "третье")]
+        await asyncio.sleep(0.01)
+        release_first.set()
+        assert await first == {"status": "completed", "reply": "первое"}
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        # Остановка процесса: фоновый объединённый ход отменяется
+        for task in asyncio.all_tasks():
+            if task.get_coro().__name__ == "_drain":
+                task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*waiting, return_exceptions=True), 1)
+
+    results = asyncio.run(scenario())
+    assert started == ["первое", "второе\n\nтретье"]
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert scheduler.active_keys() == 0
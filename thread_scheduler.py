@@ -0,0 +1,223 @@
+"""
+Планировщик ходов диалога по thread.
+
+Assistants API не принимает новые сообщения в thread, пока в нём идёт run.
+Поэтому ходы одного пользователя/thread выполняются строго по очереди,
+а сообщения, пришедшие во время активного run, склеиваются в один следующий
+ход. Общий семафор ограничивает число одновременных run в процессе
+(лимиты OpenAI по запросам и токенам).
+
+Ключи ходов относятся к текущему салону (tenants): одинаковые user_id в ботах
+разных салонов не мешают друг другу. При нескольких салонах у каждого есть
+свой семафор (TENANT_MAX_INFLIGHT_RUNS, по умолчанию половина общего лимита):
+ходы загруженного салона ждут в его очереди и не занимают все места общего
+семафора, так что остальные салоны продолжают получать ответы.
+"""
+import asyncio
+import contextlib
+import os
+
+import tenants
+
+MAX_INFLIGHT_RUNS = int(os.getenv("MAX_INFLIGHT_RUNS", "20"))
+MERGE_SEPARATOR = "\n\n"
+
+# Результат для сообщения, которое вошло в ход другого сообщения (ответ уже отправлен им)
+MERGED = {"status": "merged"}
+
+
+class _KeyState:
+    __slots__ = ("lock", "pending", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # (message, runner, future, share)
+        self.pending = []
+        self.refs = 0
+
+
+class ThreadScheduler:
+    """
+    run(key, message, runner) — выполнить ход runner(message) для ключа
+    (user_id или thread_id). Если по ключу уже идёт ход, сообщение ждёт
+    и попадает в следующий, объединённый ход.
+    """
+
+    def __init__(self, max_inflight=MAX_INFLIGHT_RUNS):
+        self.max_inflight = max_inflight
+        self._semaphore = None
+        self._keys = {}
+        self.stats = {"runs": 0, "merged": 0, "inflight": 0, "waiting": 0}
+        # Ключ салона -> семафор салона (None — без своего лимита) и его счётчики
+        self._tenant_sems = {}
+        self.tenant_stats = {}
+
+    def _sem(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_inflight)
+        return self._semaphore
+
+    def tenant_limit(self, tenant):
+        """
+        Сколько run салон может выполнять одновременно.
+        """
+        if tenant.max_inflight_runs:
+            return min(tenant.max_inflight_runs, self.max_inflight)
+        return max(1, self.max_inflight // 2) if tenants.is_multi() else self.max_inflight
+
+    def _tenant_sem(self, tenant):
+        if tenant.key not in self._tenant_sems:
+            limit = self.tenant_limit(tenant)
+            self._tenant_sems[tenant.key] = asyncio.Semaphore(limit) if limit < self.max_inflight else None
+            self.tenant_stats[tenant.key] = {"runs": 0, "inflight": 0, "waiting": 0}
+        return self._tenant_sems[tenant.key], self.tenant_stats[tenant.key]
+
+    @contextlib.asynccontextmanager
+    async def _run_slot(self):
+        # Сначала место салона, затем общее: ожидающие ходы салона сверх его лимита
+        # стоят в его очереди, а не в общей
+        tenant_sem, tenant_stats = self._tenant_sem(tenants.current())
+        self.stats["waiting"] += 1
+        tenant_stats["waiting"] += 1
+        try:
+            if tenant_sem is not None:
+                await tenant_sem.acquire()
+            try:
+                await self._sem().acquire()
+            except BaseException:
+                if tenant_sem is not None:
+                    tenant_sem.release()
+                raise
+        finally:
+            self.stats["waiting"] -= 1
+            tenant_stats["waiting"] -= 1
+        self.stats["inflight"] += 1
+        tenant_stats["inflight"] += 1
+        try:
+            yield
+        finally:
+            self.stats["inflight"] -= 1
+            tenant_stats["inflight"] -= 1
+            self._sem().release()
+            if tenant_sem is not None:
+                tenant_sem.release()
+
+    async def _execute(self, runner, message):
+        async with self._run_slot():
+            self.stats["runs"] += 1
+            self.tenant_stats[tenants.current().key]["runs"] += 1
+            return await runner(message)
+
+    def _acquire_state(self, key):
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = _KeyState()
+        state.refs += 1
+        return state
+
+    def _release_state(self, key, state):
+        state.refs -= 1
+        if state.refs == 0 and not state.pending and not state.lock.locked():
+            self._keys.pop(key, None)
+
+    def _handoff(self, key, state):
+        """
+        Освобождает ключ или, если накопились сообщения, передаёт блокировку
+        фоновой задаче, которая выполнит объединённый ход.
+        """
+        if state.pending:
+            state.refs += 1
+            asyncio.get_running_loop().create_task(self._drain(key, state))
+        else:
+            state.lock.release()
+
+    async def _drain(self, key, state):
+        batch = []
+        try:
+            while state.pending:
+                batch, state.pending = state.pending, []
+                batch = [item for item in batch if not item[2].done()]
+                if not batch:
+                    continue
+                merged = MERGE_SEPARATOR.join(message for message, _, _, _ in batch if message)
+                leader_runner, leader_future = batch[0][1], batch[0][2]
+                try:
+                    result = await self._execute(leader_runner, merged)
+                except Exception as ex:
+                    for _, _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(ex)
+                    continue
+                leader_future.set_result(result)
+                for _, _, future, share in batch[1:]:
+                    if not future.done():
+                        future.set_result(result if share else MERGED)
+        finally:
+            # Задачу отменили (остановка процесса): ожидающие ход не должны висеть вечно
+            for _, _, future, _ in batch + state.pending:
+                if not future.done():
+                    future.cancel()
+            state.pending = []
+            state.lock.release()
+            self._release_state(key, state)
+
+    async def run(self, key, message, runner, share=False):
+        """
+        Выполняет ход runner(message) с учётом очереди по ключу.
+        share=True — сообщения, вошедшие в чужой ход, получают его результат
+        (для HTTP), иначе MERGED (бот отвечает один раз на весь ход).
+        """
+        if key is None:
+            return await self._execute(runner, message)
+        key = (tenants.current().key, key)
+        state = self._acquire_state(key)
+        try:
+            if state.lock.locked():
+                future = asyncio.get_running_loop().create_future()
+                state.pending.append((message, runner, future, share))
+                self.stats["merged"] += 1
+                return await future
+            await state.lock.acquire()
+            try:
+                return await self._execute(runner, message)
+            finally:
+                self._handoff(key, state)
+        finally:
+            self._release_state(key, state)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, key):
+        """
+        Эксклюзивный слот по ключу без склейки сообщений (для потоковых ответов).
+        """
+        if key is None:
+            async with self._run_slot():
+                yield
+            return
+        key = (tenants.current().key, key)
+        state = self._acquire_state(key)
+        try:
+            await state.lock.acquire()
+            try:
+                async with self._run_slot():
+                    yield
+            finally:
+                self._handoff(key, state)
+        finally:
+            self._release_state(key, state)
+
+    def active_keys(self):
+        return len(self._keys)
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """
+    Общий на процесс планировщик ходов.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ThreadScheduler()
+    return _scheduler
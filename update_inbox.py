@@ -0,0 +1,78 @@
+"""
+Общий ящик обновлений Telegram для воркеров одного хоста (режим webhook).
+
+Telegram присылает обновления любому воркеру uvicorn, а диалог быстрой записи
+(ConversationHandler) живёт в памяти воркера, который держит блокировку
+бота. Остальные воркеры кладут сырое обновление в SQLite, а держатель
+блокировки забирает его и передаёт своему приложению PTB, поэтому все
+сообщения одного диалога обрабатывает один процесс.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+UPDATE_INBOX_PATH = os.getenv(
+    "UPDATE_INBOX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "update_inbox.db")
+)
+# Как часто держатель блокировки проверяет ящик, сек
+UPDATE_INBOX_POLL = float(os.getenv("UPDATE_INBOX_POLL", "0.05"))
+UPDATE_INBOX_BATCH = 100
+
+
+class UpdateInbox:
+    """
+    put() — из любого воркера; take() — только у держателя блокировки бота.
+    """
+
+    def __init__(self, path=UPDATE_INBOX_PATH):
+        self._lock = threading.Lock()
+        self.stats = {"put": 0, "taken": 0}
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS updates ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, tenant TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)"
+        )
+
+    def put(self, tenant_key, data):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO updates (tenant, data, created) VALUES (?, ?, ?)",
+                (tenant_key, json.dumps(data, ensure_ascii=False), time.time()),
+            )
+            self.stats["put"] += 1
+
+    def take(self, limit=UPDATE_INBOX_BATCH):
+        """
+        Забирает накопившиеся обновления в порядке поступления: [(tenant_key, data)].
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, tenant, data FROM updates ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            if rows:
+                self._db.execute("DELETE FROM updates WHERE id <= ?", (rows[-1][0],))
+            self.stats["taken"] += len(rows)
+        return [(tenant, json.loads(data)) for _, tenant, data in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_inbox = None
+_inbox_lock = threading.Lock()
+
+
+def get_update_inbox():
+    """
+    Общий на процесс ящик обновлений.
+    """
+    global _inbox
+    with _inbox_lock:
+        if _inbox is None:
+            _inbox = UpdateInbox()
+        return _inbox